@@ -22,28 +22,29 @@ Tested with Psychopy 1.83.04 and 1.84.02
   Peirce, JW (2007) PsychoPy - Psychophysics software in Python. Journal of Neuroscience Methods, 162(1-2), 8-13.
   Peirce, JW (2009) Generating stimuli for neuroscience using PsychoPy. Frontiers in Neuroinformatics, 2:10. doi: 10.3389/neuro.11.010.2008
 ***************************************************************************************************************
+Startup only loads what the session dialog needs; psychopy's window modules (and numpy, which they
+and the session container use) are loaded once the dialog is answered, and opencv and the recording
+modules only when record is 'yes'. Run with --import-times to print the time taken by each startup
+stage.
+***************************************************************************************************************
 """
-from ctypes import c_bool
+from timeit import default_timer
+_scriptStart = default_timer()
 import datetime
-from multiprocessing import Process, Queue, Value
-import numpy as np
 import os
-import pandas as pd
-from psychopy import visual, core, event, logging, gui, monitors
-import pyglet
 from subprocess import check_output
 import sys
-import yaml
-import cv2 #try to import with others
+from eyecam.startup import StartupTimer, importTimesRequested
+from eyecam.tasks import QuitRequested, Scheduler
+from eyecam.waits import POLL_S, TRIGGER_POLL_S, waitKeys, zeroClocksAt
 
 
 #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
 #Params
 #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-# Ensure that relative paths start from the same directory as this script
+# Relative paths start from the same directory as this script (chdir in main):
 _thisDir = os.path.dirname(os.path.abspath(__file__)).decode(
     sys.getfilesystemencoding())
-os.chdir(_thisDir)
 # RA's screen (for eye video monitor; 0=primary, 1=secondary and should usually be 0):
 raScreen = 0
 # Frame rate (for recording):
@@ -65,6 +66,7 @@ endExpNow = False  # flag for 'escape' or other condition => quit the exp
 
 # Load Site-configurable parameters
 def loadConfiguration(configFile):
+    import yaml
     if os.path.exists(configFile):
         with open(configFile) as f:
             config = yaml.safe_load(f)
@@ -76,32 +78,27 @@ def loadConfiguration(configFile):
     return config
 
 
-config = loadConfiguration('siteConfig.yaml')
-
-# Display Information
-display = pyglet.window.get_platform().get_default_display()
-screens = display.get_screens()
-if config['monitor']['screen'] >= len(screens):
-    pScreen = 0
-else:
-    pScreen = config['monitor']['screen']
-
-#dims for participant screen (ra screen set below):
-resolution = [screens[pScreen].width, screens[pScreen].height]
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+#Participant display (queried once the dialog is answered)
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+def participantMonitor(config):
+    # Returns the participant screen number, its resolution and a psychopy Monitor for it.
+    import pyglet
+    display = pyglet.window.get_platform().get_default_display()
+    screens = display.get_screens()
+    if config['monitor']['screen'] >= len(screens):
+        pScreen = 0
+    else:
+        pScreen = config['monitor']['screen']
 
-mon = monitors.Monitor('newMonitor')
-mon.setWidth(config['monitor']['width'])
-mon.setDistance(config['monitor']['distance'])
-mon.setSizePix(resolution)
+    #dims for participant screen (ra screen set below):
+    resolution = [screens[pScreen].width, screens[pScreen].height]
 
-# Set HCP Style Params
-triggerKey = config['trigger']  #5 at Harvard
-titleLetterSize = config['style']['titleLetterSize']  # 3
-textLetterSize = config['style']['textLetterSize']  # 1.5
-fixLetterSize = config['style']['fixLetterSize']  # 2.5
-wrapWidth = config['style']['wrapWidth']  # 30
-subtitleLetterSize = config['style']['subtitleLetterSize']  # 1
-verbalColor = config['style']['verbalColor'] #  '#3EB4F0'
+    mon = monitors.Monitor('newMonitor')
+    mon.setWidth(config['monitor']['width'])
+    mon.setDistance(config['monitor']['distance'])
+    mon.setSizePix(resolution)
+    return pScreen, resolution, mon
 
 
 
@@ -158,7 +155,7 @@ def instruct(expName):
     loopOver = False
     npresses = 0
     while not loopOver:
-        inkeys = event.getKeys()
+        inkeys = waitKeys(event.getKeys)
         if 'space' in inkeys:
             npresses += 1
             if npresses == 1:
@@ -177,14 +174,6 @@ def instruct(expName):
     return raWin
 
 
-#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-#Image cropping function
-#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-def reFrame(fr, aperture):
-    return fr[aperture[0]:aperture[1], aperture[2]:aperture[3], :]
-
-
-#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
 #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
 #Present fixation, leave it up until script ends
 #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
@@ -196,43 +185,39 @@ def fixCross(win, cross):
 
 
 #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-#Wait for scanner trigger
-#Returns trigger timestamp
+#Run tasks (see eyecam.tasks): each is a generator run by
+#the run's Scheduler; `run` is the run's shared state dict
 #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-def waitForTrigger(clocks):
-    # Inputs: Psychopy Clock to reset when trigger is received.
-    # Returns: core timer and wall time of trigger
+def triggerTask(run, clocks):
+    # Wait for the scanner trigger; zero `clocks` at trigger time.
+    # Sets run['trigger_ts'] (core timer) and run['triggerWallTime'].
+    # Keys are polled every TRIGGER_POLL_S with the CPU free in between; the trigger time is the
+    # time the key event was received, and the clocks are zeroed at that time.
     event.clearEvents() #Flush keys
-    trigger_ts = core.getTime()
-    loopOver = False
     event.getKeys() #clear any pre-existing keypresses before beginning to wait
-    while not loopOver:
-        inkeys = event.getKeys()
+    while True:
+        inkeys = dict(event.getKeys(keyList=[triggerKey, quitKey], timeStamped=True))
         if triggerKey in inkeys:
-            trigger_ts = core.getTime()  # time stamp for start of scan
-            triggerWallTime = datetime.datetime.today()  # Wall Time timestamp
-            loopOver = True
-            for clock in clocks:
-                clock.reset()  # Zero the countdown clock
+            break
         elif quitKey in inkeys:
-            endExpNow = True
-            core.quit()
-            loopOver = True
+            raise QuitRequested()
+        #Keep the RA View live from the idle camera while waiting:
+        eyecam.showIdle()
+        yield TRIGGER_POLL_S
+    trigger_ts = inkeys[triggerKey]  # time stamp for start of scan
+    # Wall Time timestamp
+    triggerWallTime = datetime.datetime.today() - datetime.timedelta(seconds=core.getTime() - trigger_ts)
+    zeroClocksAt(clocks, trigger_ts, core.getTime)  # Zero the countdown clock
+    run['trigger_ts'], run['triggerWallTime'] = trigger_ts, triggerWallTime
     triggerMsg = 'Trigger received at %s' % triggerWallTime.strftime(timestampFormat)
     print(triggerMsg)
     logging.info(triggerMsg)
-    return trigger_ts, triggerWallTime
 
 
-
-#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-#Countdown (for consistency w/ other scripts)
-#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-def count_down(win, cap=None, aperture=None, timestamps=None, clock=None):
-    # Create images for Routine "countdown"
-    # To record images during the countdown, provide the cv VideoCapture instance, an aperture
-    # (or None) to reframe the recorded image, a list of timestamps to append times to, and a
-    # psychopy Clock to read times from.
+def countdownTask(win):
+    # Countdown (for consistency w/ other scripts). Each number is shown until a deadline 2 s after
+    # the previous one, so the countdown does not drift by the flip times; frames keep being
+    # recorded by the capture task meanwhile.
     counter = visual.TextStim(win=win,
                               ori=0,
                               name='countdownText',
@@ -245,35 +230,76 @@ def count_down(win, cap=None, aperture=None, timestamps=None, clock=None):
                               colorSpace='rgb',
                               opacity=1,
                               depth=-3.0)
+    countStart = core.getTime()
     for this_one in range(4, 0, -1):
         counter.setText(str(this_one))
         counter.draw(win)
         win.flip()
-        flip_time = core.getTime()
         win.mouseVisible = False
-        while core.getTime() - flip_time < 2:
-            if cap:
-                recFrame(cap, aperture=aperture)
-                timestamps.append(clock.getTime())
-            if event.getKeys(keyList=[quitKey]):
-                core.quit()
-                break
+        stepEnd = countStart + 2 * (5 - this_one)
+        while core.getTime() < stepEnd:
+            yield stepEnd - core.getTime()
+
+
+def quitKeyTask():
+    while True:
+        if event.getKeys(keyList=[quitKey]):
+            raise QuitRequested()
+        yield POLL_S
 
 
 #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-#Video writing function
-#To be run in parallel with data collection loop in main
+#One run, from the trigger to the end of the scan
+#(windows, engine etc. are the session's, set up in main)
 #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-def writeVid(update_queue, quit_flag, thisRun, out_file):
-    #CV2 does not like to run in two processes simultaneously:
-    import imageio
-    #Create video writer object:
-    out = imageio.get_writer(out_file, fps=vid_frame_rate)
-    while not quit_flag.value:
-        #Keep popping and writing frames:
-        out.append_data(update_queue.get())
-    #Finishes file IO when quit_flag is flipped to True:
-    out.close()
+def runEvent(run, condition, duration=0):
+    #Design event at the current time, for the run's design csv and the session container:
+    onset = globalClock.getTime()
+    run['events'].append({'condition': condition,
+                          'run': 'run%d' % run['number'],
+                          'duration': duration,
+                          'onset': onset})
+    eyecam.event(condition, onset, duration)
+
+
+def runTask(sched, run):
+    # Bring Participant Window to the front
+    win.winHandle.activate()
+
+    # Wait for scanner trigger; zero clocks at trigger time:
+    yield sched.spawn('trigger', triggerTask(run, [globalClock, routineTimer]))
+
+    # Start timing for the length of the scan
+    routineTimer.add(runDuration)
+    sched.spawn('keys', quitKeyTask())
+
+    #Idle grabbing stops; from here on frames go to this run's video:
+    expInfo['triggerWallTime'] = run['triggerWallTime'].strftime(timestampFormat)
+    eyecam.startRun(run['number'], run['filename'], run=run, date=expInfo['date'],
+                    triggerWallTime=expInfo['triggerWallTime'])
+    runEvent(run, 'ScanStart')
+
+    #Capture a timestamp for every frame from here on, alongside the countdown and fixation:
+    eyecam.spawnTasks(sched, run, lambda run, warnings: showWarnings(raWin, run['status'], warnText, warnings,
+                                                                     run['number']))
+    if expInfo['scan type'] == 'REST':
+        runEvent(run, 'Countdown', 8)
+        run['status'] = countText
+        countText.draw(raWin)
+        raWin.flip()
+        yield sched.spawn('countdown', countdownTask(win))
+    runEvent(run, 'FixStart')
+
+    fixCross(win, cross)
+    run['status'] = recText if recVideo else norecText
+    run['status'].draw(raWin)
+    raWin.flip()
+
+    # Bring Participant Window to the front
+    win.winHandle.activate()
+    #Until the end of the scan; the capture, key and telemetry tasks keep running meanwhile:
+    while routineTimer.getTime() > 0:
+        yield routineTimer.getTime()
 
 
 #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
@@ -300,7 +326,9 @@ def scanInit():
             'sessionID': u'',
             'runNumber': '1',
             'test mode': False}
+    startup.mark('ready for dialog')
     dlg = gui.DlgFromDict(dictionary=expInfo, title='Eye Cam')
+    startup.pause()
     if dlg.OK == False: core.quit()  # user pressed cancel
     expInfo['date'] = datetime.datetime.now().strftime('%Y-%m-%d_%H%M%S')
     if expInfo['scan type'] == 'SELECT SCAN TYPE':
@@ -362,29 +390,55 @@ def scanInit():
 
     return expInfo, logFile, expName, nRuns, recVideo, eyeCam, useAperture, aperture, runDuration, filebase
 
-def recFrame(cap, aperture=None):
-    #read a frame from the cv device `cap`, queue it to write, and display it:
-    ret, frame = cap.read()
-    if aperture:
-        update_queue.put(reFrame(frame, aperture))
-        cv2.imshow('RA View', reFrame(frame, aperture))
-    else:
-        update_queue.put(frame)
-        cv2.imshow('RA View', frame)
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+#Show acquisition warnings under the RA's status text
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+def showWarnings(raWin, statusText, warnText, warnings, run):
+    #Only called when the warnings change (a flip can wait for the screen refresh):
+    warnText.setText('\n'.join(warnings))
+    statusText.draw(raWin)
+    warnText.draw(raWin)
+    raWin.flip()
+    for warning in warnings:
+        logging.warning('Run %d: %s' % (run, warning))
 
 
 #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
 #Main experiment:
 #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
 if __name__ == "__main__":
+    startup = StartupTimer(importTimesRequested(), start=_scriptStart)
+    os.chdir(_thisDir)
+    config = loadConfiguration('siteConfig.yaml')
+    # Set HCP Style Params
+    triggerKey = config['trigger']  #5 at Harvard
+    titleLetterSize = config['style']['titleLetterSize']  # 3
+    textLetterSize = config['style']['textLetterSize']  # 1.5
+    fixLetterSize = config['style']['fixLetterSize']  # 2.5
+    wrapWidth = config['style']['wrapWidth']  # 30
+    subtitleLetterSize = config['style']['subtitleLetterSize']  # 1
+    verbalColor = config['style']['verbalColor'] #  '#3EB4F0'
+    startup.mark('config')
+    #Only what the dialog needs:
+    from psychopy import core, gui, logging
+    startup.mark('psychopy core/gui/logging')
+
     #User information
     expInfo, logFile, expName, nRuns, recVideo, eyeCam, useAperture, aperture, runDuration, filebase = scanInit()
 
+    from psychopy import visual, event, monitors
+    from eyecam.acquisition import EyeCamSession, runSummary
+    startup.mark('psychopy visual/event')
+    # Display Information
+    pScreen, resolution, mon = participantMonitor(config)
+    startup.mark('display')
+
     # Setup the participant Window
     # put inside name=main
     win = visual.Window(size=resolution, fullscr=False, screen=pScreen, allowGUI=False, allowStencil=False,
                         monitor=mon, color=[-1,-1,-1], colorSpace='rgb',
                         blendMode='avg', useFBO=True, units='deg')
+    startup.mark('participant window')
     #Create fixation cross object:
     cross = visual.TextStim(win=win, ori=0, name='cross',
                             text='+',    font='Arial',
@@ -421,157 +475,94 @@ if __name__ == "__main__":
         pos=[0, 0], height=titleLetterSize, wrapWidth=30,
         color='white', colorSpace='rgb', opacity=1,
         depth=-1.0)
+    warnText = visual.TextStim(win=raWin, ori=0, name='warnText',
+        text='', font='Arial',
+        pos=[0, -titleLetterSize * 2], height=titleLetterSize / 2., wrapWidth=30,
+        color='red', colorSpace='rgb', opacity=1,
+        depth=-2.0)
     version = gitVersion()
     logging.exp('git-revision: %s' % version)
-    runTS = []
     getOut = False
     globalClock = core.Clock()
     routineTimer = core.CountdownTimer()
-    for thisRun in range(nRuns):
-        events = []
-        if recVideo:
-            #Create video capture object to control camera/frame grabber:
-            cap = cv2.VideoCapture(eyeCam)
-            logging.debug('opened video reader on camera %u' % eyeCam)
-            try:
-                cap.set(cv2.cv.CV_CAP_PROP_FPS, value=vid_frame_rate)
-            except StandardError:
-                cap.set(cv2.CAP_PROP_FPS, value=vid_frame_rate)
-            #Read a frame, get dims:
-            ret, frame = cap.read()
-            if useAperture:
-                w = np.shape(reFrame(frame, aperture))[1]
-                h = np.shape(reFrame(frame, aperture))[0]
-            else:
-                w = np.shape(frame)[1]
-                h = np.shape(frame)[0]
-        else:
-            cap = None
-        #Indicate script is waiting for trigger:
-        waitText.draw()
-        raWin.flip()
-
-        # Run Output Filename
-        filename = filebase + '_'.join(['', 'run%s' % (thisRun + 1), expInfo['date']])
-
-        if recVideo:
-            #Queue of frames from cap; data collection loop adds frames, video writing process
-            #pops frames (FIFO):
-            update_queue = Queue()
-            #Flag to tell parallel process when to exit loop
-            quit_flag = Value(c_bool, False)
-
-            #Write file in another process:
-            writeProc = Process(name='Write',
-                                target=writeVid,
-                                args=(update_queue, quit_flag, thisRun, filename + vidExt))
-            writeProc.start()
-
-            #Initialize the cv2 Window (so we can re-focus back to psychopy)
-            cv2.namedWindow('RA View', cv2.WINDOW_AUTOSIZE)
-
-
-        # Bring Participant Window to the front
-        win.winHandle.activate()
-
-        # Wait for scanner trigger; zero clocks at trigger time:
-        trigger_ts, triggerWallTime = waitForTrigger([globalClock, routineTimer])
-
-        # Start timing for the length of the scan
-        routineTimer.add(runDuration)
-
-        expInfo['triggerWallTime'] = triggerWallTime.strftime(timestampFormat)
-        events.append({'condition': 'ScanStart',
-                       'run': 'run%d' % (thisRun + 1),
-                       'duration': 0,
-                       'onset': globalClock.getTime()})
-
-        #Capture a timestamp for every frame (1st entry will be trigger):
-        runTS.append([])  # Start a new list for this run's timestamps
-        if expInfo['scan type'] == 'REST':
-            events.append({'condition': 'Countdown',
-                           'run': 'run%d' % (thisRun + 1),
-                           'duration': 8,
-                           'onset': globalClock.getTime()})
-            countText.draw(raWin)
-            raWin.flip()
-            count_down(win, cap=cap, aperture=aperture, timestamps=runTS[thisRun], clock=globalClock)
-        events.append({'condition': 'FixStart',
-                       'run': 'run%d' % (thisRun + 1),
-                       'duration': 0,
-                       'onset': globalClock.getTime()})
-
-        fixCross(win, cross)
-        if recVideo:
-            #Data collection loop:
-            recText.draw(raWin)
-            raWin.flip()
-        else:
-            norecText.draw(raWin)
+    #The camera, frame ring and writer / openness processes are set up once and reused by every
+    #run (opencv and the recording modules are only loaded if record is 'yes'):
+    eyecam = EyeCamSession(config, eyeCam=eyeCam, fps=vid_frame_rate, aperture=aperture if useAperture else None,
+                           clock=globalClock, duration=runDuration, dataDir=os.path.dirname(filebase),
+                           log=logging, vidExt=vidExt)
+    #Every process started by open() is stopped on the way out, also if open() or a run fails:
+    try:
+        eyecam.open()
+        startup.mark('recording devices and workers')
+        #Events, frame timestamps and run diagnostics of every run, appended as they happen:
+        eyecam.start(filebase, {'expInfo': dict(expInfo),
+                                'git-revision': version.decode('ascii') if isinstance(version, bytes) else version})
+        for thisRun in range(nRuns):
+            events = []
+            #Indicate script is waiting for trigger:
+            waitText.draw()
             raWin.flip()
 
-
-        # Bring Participant Window to the front
-        win.winHandle.activate()
-        while routineTimer.getTime() > 0 and not endExpNow:
-            #collect time stamp for each image:
-            if event.getKeys(keyList=[quitKey]):
-                scanOver = True
-                if recVideo:
-                    writeProc.terminate()
-                    cap.release()
-                    cv2.destroyAllWindows()
-                core.quit()
-                endExpNow = True
+            # Run Output Filename
+            filename = filebase + '_'.join(['', 'run%s' % (thisRun + 1), expInfo['date']])
+            run = {'number': thisRun + 1, 'filename': filename, 'events': events, 'status': waitText}
+            #Trigger wait, countdown, capture, preview, telemetry and writer supervision run as tasks;
+            #escape raises QuitRequested once they have all been cancelled:
+            sched = Scheduler()
+            try:
+                sched.run(runTask(sched, run))
+            except QuitRequested:
+                #A run in progress is still drained and finalized below, marked aborted; the session is
+                #shut down once, after the loop:
+                logging.warning('Run %d: quit requested' % (thisRun + 1))
+                getOut = True
+            finally:
+                logging.info('Run %d task timing (ms): %s' % (thisRun + 1, sched.stats()))
+            if getOut and eyecam.currentRun is None:
+                #Quit before the trigger: nothing was recorded
                 break
+            runEndTime = datetime.datetime.today()
+            logging.info('Run %s %s: %s' % (thisRun + 1, 'aborted' if getOut else 'finished',
+                                            runEndTime.strftime(timestampFormat)))
+            runEvent(run, 'RunAborted' if getOut else 'RunEnd')
+            import pandas as pd
+            run_df = pd.DataFrame(events)
+            run_df['git-revision'] = version
+            run_df.to_csv(filename + '_design.csv')
             if recVideo:
-                recFrame(cap, aperture=aperture)
-                runTS[thisRun].append(globalClock.getTime())
-        runEndTime = datetime.datetime.today()
-        logging.info('Run %s finished: %s' % (thisRun + 1, runEndTime.strftime(timestampFormat)))
-        events.append({'condition': 'RunEnd',
-                       'duration': 0,
-                       'run': 'run%d' % (thisRun + 1),
-                       'onset': globalClock.getTime()})
-        run_df = pd.DataFrame(events)
-        run_df.to_csv(filename + '_design.csv')
-        run_df['git-revision'] = version
-        if recVideo:
+                ioText.draw(raWin)
+                raWin.flip()
+                raWin.winHandle.activate()
+            #The writer encodes whatever is still in the ring and closes the file (the camera keeps
+            #grabbing until the next run); timing stats are saved to the run's _timing.json:
+            report = eyecam.endRun(run, aborted=getOut)
+            if recVideo:
+                print('**********************************************************')
+                print('**********************************************************')
+                print('**********************************************************')
+                print('Run ' + str(thisRun + 1) + ' Timing Diagnostics:')
+                print('**********************************************************')
+                print('\n'.join(runSummary(report, eyecam.cameras)))
+                print('**********************************************************')
+                if report.get('openness'):
+                    logging.info('Run %d eye openness: %s' % (thisRun + 1, report['openness']))
+            if getOut:
+                break
+
+        # Log Settings
+        # put inside name=main
+        logging.info(expInfo)
+        logging.info('nRuns: %d, runDuration: %.02f' % (nRuns, runDuration))
+        logging.info('Recording frame rate: %d' % vid_frame_rate)
+
+        if eyecam.spooled and eyecam.spoolTranscode == 'session_end' and not getOut:
             ioText.draw(raWin)
             raWin.flip()
-            raWin.winHandle.activate()
-            #Flip quit_flag to True when done:
-            quit_flag.value = True
-            #End writing proca:
-            writeProc.terminate()
-            #Get some timing stats, print some, save the rest to .csv:
-            timing = pd.DataFrame({'TS': runTS[thisRun]})
-            timing['second'] = np.floor(timing['TS'])
-            x = timing.groupby('second')['second'].count()
-            print('**********************************************************')
-            print('**********************************************************')
-            print('**********************************************************')
-            print('Run ' + str(thisRun + 1) + ' Timing Diagnostics:')
-            print('**********************************************************')
-            print('Frequency: Frames Within Each Second')
-            out_dist = x.groupby(x).count()
-            print(out_dist)
-            out_dist.to_csv(filebase + 'EyeCamFPS_Dist.csv')
-            print('**********************************************************')
-            #Save timestamps:
-            cap.release()
-            cv2.destroyAllWindows()
-
-            #Time stamp file name:
-            out_file_ts = filename + '_ts.csv'
-            #Save timestamp file:
-            np.savetxt(out_file_ts, runTS[thisRun], delimiter=',', fmt='%.04f')
-
-    # Log Settings
-    # put inside name=main
-    logging.info(expInfo)
-    logging.info('nRuns: %d, runDuration: %.02f' % (nRuns, runDuration))
-    logging.info('Recording frame rate: %d' % vid_frame_rate)
+        #Spools are transcoded now unless the session was aborted (see python -m eyecam.spool):
+        eyecam.stop(transcode=not getOut)
+    finally:
+        #Stop the writer and openness processes and release the camera:
+        eyecam.close()
 
     #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
     #Clean up & shut  down
@@ -15,12 +15,14 @@ gklobusicky@fas.harvard.edu
 
 from psychopy import core, visual, event, gui
 import cv2
-import numpy as np
 import math
 import os
 import sys
 import yaml
 import itertools
+import time
+from eyecam.aperture import AP_MAP, ApertureCalibration
+from eyecam.waits import POLL_S
 
 
 #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
@@ -40,13 +42,8 @@ rec_frame_rate = 30
 SHIFT_COEFF = 5
 #Number of pixels (on each side) by which to grow or shrink camera aperture:
 SCALE_COEFF = 1
-#aperture transformations:
-AP_MAP = {"up":[-1,-1,0,0],
-                "down": [1,1,0,0],
-                "left": [0,0,-1,-1],
-                "right":[0,0,1,1],
-                "b":[-1,1,-1,1], #bigger
-                "s":[1,-1,1,-1]} #smaller
+#Number of frames sampled to detect the aperture automatically (~2 s at 30 fps):
+AUTO_FRAMES = 60
 #Location of configuration file:
 CONFIG_FILE = 'siteConfig.yaml'
 
@@ -72,59 +69,6 @@ if config['dualCam'] == 'yes' or config['dualCam'] == 1:
 else:
     eye_cam = 0
 #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-#Image cropping function
-#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-def reFrame(fr, aperture):
-    return fr[aperture[0]:aperture[1], aperture[2]:aperture[3], :]
-
-#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-#Aperture fixing function
-#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-
-def closestLegalAperture(aperture, vidSize):
-    ''' return the closest aperture which is of even width and height and fully within vidSize.
-    aperture format is [top bottom left right], vidSize format is [height width]'''
-    
-    def ap2size(ap):
-        size = [ap[1] - ap[0], ap[3] - ap[2]]
-        return size
-    apSize = ap2size(aperture)
-
-    #if height and/or width are odd, expand them by one pixel to make them even
-    if apSize[0] % 2 != 0:
-        aperture[1] += 1
-        apSize = ap2size(aperture)
-    if apSize[1] % 2 != 0:
-        aperture[3] += 1
-        apSize = ap2size(aperture)
-        
-    #if aperture is larger than vidSize, shrink it to the closest even size that fits
-    if apSize[0] > vidSize[0]:
-        amntOver = apSize[0] - vidSize[0]
-        shrinkCoeff = amntOver / 2 + amntOver % 2 #if vidSize is odd for some reason, this should handle it
-        aperture = [aperture[i] + shrinkCoeff * AP_MAP['s'][i] for i in range(len(aperture))] 
-        apSize = ap2size(aperture)
-    if apSize[1] > vidSize[1]:
-        amntOver = apSize[1] - vidSize[1]
-        shrinkCoeff = amntOver / 2. + amntOver % 2
-        aperture = [aperture[i] + shrinkCoeff * AP_MAP['s'][i] for i in range(len(aperture))]
-        apSize = ap2size(aperture)
-
-    #if the aperture extends off the screen, bring it back on
-    if aperture[0] < 0: #top
-        #aperture = np.add(aperture, np.multiply(-aperture[0], AP_MAP['down']))
-        aperture = [aperture[i] - (aperture[0] * AP_MAP['down'][i]) for i in range(len(aperture))]
-    if aperture[2] < 0: #left
-        aperture = [aperture[i] - aperture[2] * AP_MAP['right'][i] for i in range(len(aperture))]
-    if aperture[1] > vidSize[0] : #bottom
-        aperture = [aperture[i] + (aperture[1]-vidSize[0]) * AP_MAP['up'][i] for i in range(len(aperture))]
-    if aperture[3] > vidSize[1] : #right
-        aperture = [aperture[i] + (aperture[3]-vidSize[1]) * AP_MAP['left'][i] for i in range(len(aperture))]
-
-
-    return aperture 
-
-#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
 #Aperture calibration function
 #Returns aperture
 #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
@@ -132,51 +76,35 @@ def calibrate():
     #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
     #Psychopy setup & display
     #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
-    #Create vid capture object:
-    cap = cv2.VideoCapture(eye_cam) 
-    #Read a frame:
-    ret, frame = cap.read()
-    
-    #x, y dimensions of the frame:
-    o_frame_dim = np.shape(np.array(frame))
-    #if an aperture was already in siteConfig, use it
-    if 'aperture' in config:
-        aperture = closestLegalAperture(config['aperture'], o_frame_dim)
-    else:
-        #default aperture is 20% of screen (centered)
-        aperture = [int(o_frame_dim[0]//2 - o_frame_dim[0]*0.10),
-                    int(o_frame_dim[0]//2 + o_frame_dim[0]*0.10),
-                    int(o_frame_dim[1]//2 - o_frame_dim[1]*0.10),
-                    int(o_frame_dim[1]//2 + o_frame_dim[1]*0.10)]
-    #key dict to move & resize aperture (by pixels):
-    ap_map = {"up":[-SHIFT_COEFF,-SHIFT_COEFF,0,0],
-                "down": [SHIFT_COEFF,SHIFT_COEFF,0,0],
-                "left": [0,0,-SHIFT_COEFF,-SHIFT_COEFF],
-                "right":[0,0,SHIFT_COEFF,SHIFT_COEFF],
-                "b":[-SCALE_COEFF,SCALE_COEFF,-SCALE_COEFF,SCALE_COEFF], #bigger
-                "s":[SCALE_COEFF,-SCALE_COEFF,SCALE_COEFF,-SCALE_COEFF]} #smaller
-    #To make sure aperture stays within the screen's limits
-    def checkAp(ap):
-        return np.all([i>0 for i in ap]) and ap[1]<=o_frame_dim[0] and ap[3]<=o_frame_dim[1]
+    #Open the camera (or the source selected in siteConfig.yaml); the aperture starts as the one
+    #in siteConfig, else one proposed around the eye, else the centered 20% of the frame
+    #(see eyecam.aperture):
+    calibration = ApertureCalibration(config, eye_cam, shift=SHIFT_COEFF, scale=SCALE_COEFF,
+                                      autoFrames=AUTO_FRAMES)
+    calibration.start()
     #Adjust the frame/aperture:
     done = False
     while not done:
-        #Get new image:
-        ret, frame = cap.read()
-        frame = reFrame(frame, aperture)
+        #Get new image (waits for the device's next frame), cropped to the aperture:
+        frame = calibration.frame()
         #Display the frame if it exists:
-        if ret:
+        if frame is not None:
             cv2.imshow("Aperture", frame)
+        else:
+            #No frame from the device; sleep instead of spinning on it:
+            time.sleep(POLL_S)
         #Check for keypress:
-        key = event.getKeys(AP_MAP.keys()+["q"])
+        key = event.getKeys(list(AP_MAP.keys()) + ["a", "q"])
         if len(key)==1:
             if key[0]=="q":
                 done=True
+            elif key[0]=="a":
+                #re-detect; keeps the current aperture if nothing stands out:
+                calibration.propose()
             else:
-                newapp = [aperture[i]+ap_map[key[0]][i] for i in range(len(aperture))]
-                aperture = closestLegalAperture(newapp, o_frame_dim)
+                calibration.adjust(key[0])
     #Shut down cv2 objects:
-    cap.release()
+    aperture = calibration.stop()
     cv2.destroyAllWindows()
     return aperture
 
@@ -188,7 +116,7 @@ if __name__ == "__main__":
         units='deg',
         screen=raScreen)
     instructText = visual.TextStim(win=raWin, ori=0, name='introText',
-        text='Arrow keys will move the aperture\n\nb: Bigger aperture\ns:Smaller aperture\n\nq:Finished', 
+        text='Arrow keys will move the aperture\n\nb: Bigger aperture\ns:Smaller aperture\na: Detect aperture\n\nq:Finished', 
         font='Arial',
         pos=[0, 0], height=titleLetterSize//2, wrapWidth=30,
         color='white', colorSpace='rgb', opacity=1,
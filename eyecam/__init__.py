@@ -0,0 +1,6 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Acquisition helpers shared by EyeCam_Scan.py and calibrate_eyecam.py
+***************************************************************************************************************
+"""
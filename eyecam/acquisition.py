@@ -0,0 +1,512 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+EyeCamSession: the recording side of EyeCam_Scan.py as an importable object. The camera, frame ring,
+writer and openness processes and any additional cameras are opened once and kept until close(), so
+a resident process can run participants back to back without paying for device and worker start-up
+each time, and the pipeline can run headless (no psychopy, no windows) in tests:
+
+    eyecam = EyeCamSession(config, headless=True)
+    eyecam.open()                                         # devices and workers
+    eyecam.start('data/REST_X', {'sessionID': 'X'})       # one participant (session container)
+    report = eyecam.run(1, 'data/REST_X_run1_DATE', 390.4)
+    eyecam.stop()                                         # end of participant (deferred transcoding)
+    ...
+    eyecam.close()
+
+run() zeroes the clock and records for a fixed time. EyeCam_Scan.py instead drives each run from
+its own scheduler, with the trigger, countdown and windows kept in the script:
+    eyecam.showIdle()                          # every trigger-wait poll: RA View from the idle camera
+    run = eyecam.startRun(number, filename)    # at the trigger, once the clock has been zeroed
+    eyecam.spawnTasks(sched, run, onWarnings)  # capture, preview, telemetry and writer watch tasks
+    ...                                        # the scheduler runs until the end of the scan
+    report = eyecam.endRun(run)                # drain, finalize, timing diagnostics
+***************************************************************************************************************
+"""
+import datetime
+import logging
+import os
+from timeit import default_timer
+
+from eyecam.session import SessionStore, sessionPath
+from eyecam.tasks import Scheduler
+from eyecam.waits import POLL_S
+
+
+class Clock(object):
+    ''' Stand-in for psychopy.core.Clock (getTime, reset, add) when running without psychopy.'''
+
+    def __init__(self):
+        self._start = default_timer()
+
+    def getTime(self):
+        return default_timer() - self._start
+
+    def reset(self):
+        self._start = default_timer()
+
+    def add(self, t):
+        self._start += t
+
+
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+#Run tasks (see eyecam.tasks)
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+def captureTask(cap, clock, frameRing, aperture, preview, telemetry, timestamps, trace=None):
+    #read, queue and show one frame per step; cap.grab() waits for the device, so this runs at the
+    #camera's frame rate:
+    from eyecam.capture import recFrame
+    while True:
+        try:
+            timestamps.append(recFrame(cap, clock, frameRing, aperture=aperture, preview=preview,
+                                       telemetry=telemetry, trace=trace))
+        except IOError:
+            #The writer died with the ring full; writerWatchTask reports it
+            return
+        yield 0
+
+
+def captureThreadTask(cap, clock, frameRing, aperture, preview, telemetry, timestamps, trace=None):
+    #Grab & timestamp on its own thread; this task only displays the newest frame:
+    from eyecam.capture import CaptureThread
+    captureThread = CaptureThread(cap, clock, aperture=aperture, frameRing=frameRing,
+                                  timestamps=timestamps, telemetry=telemetry, trace=trace)
+    captureThread.start()
+    try:
+        shown = 0
+        while True:
+            count, frame = captureThread.latest()
+            if preview is not None and count != shown:
+                preview.show(frame)
+                shown = count
+            yield POLL_S
+    finally:
+        captureThread.stop()
+
+
+def telemetryTask(run, telemetry, frameRing, preview, onWarnings):
+    while True:
+        warnings = telemetry.poll(frameRing, preview)
+        if warnings is not None:
+            onWarnings(run, warnings)
+        yield telemetry.interval
+
+
+def eyeAlertTask(run, eyeMonitor, preview, onWarnings, interval=0.25):
+    #The eye-closure alert on the RA View (and onWarnings when it changes), when telemetry is off:
+    shown = []
+    while True:
+        found = eyeMonitor.warnings()
+        if preview is not None:
+            preview.overlay = [(warning, True) for warning in found]
+        if found != shown:
+            shown = found
+            onWarnings(run, found)
+        yield interval
+
+
+def camerasTask(cameras, filename, vidExt):
+    #The additional cameras record on their own threads from the trigger until the run's tasks are
+    #cancelled at the end of the scan:
+    for camera in cameras:
+        camera.startRun(camera.outFile(filename, vidExt))
+    try:
+        while True:
+            yield 1
+    finally:
+        for camera in cameras:
+            camera.stopCapture()
+
+
+def sessionFramesTask(store, timestamps):
+    #Stream the run's frame timestamps into the session container about once a second:
+    stored = 0
+    try:
+        while True:
+            yield 1.
+            count = len(timestamps)
+            store.frames(timestamps[stored:count], stored)
+            stored = count
+    finally:
+        store.frames(timestamps[stored:], stored)
+
+
+def writerWatchTask(run, sched, engine, log):
+    #If the writer process dies, stop feeding the ring (capture would block on it) and let the run
+    #finish on time without video:
+    while engine.writerAlive():
+        yield 0.5
+    log.error('Run %d: video writer process stopped; recording stopped' % run['number'])
+    print('Video writer process stopped; recording stopped')
+    if run.get('capture'):
+        sched.cancel(run['capture'])
+
+
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+#Acquisition session
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+class EyeCamSession(object):
+    ''' Recording pipeline for siteConfig `config` (see the module docstring).
+
+    eyeCam is the camera device number, aperture the crop ([top bottom left right], None for the
+    whole frame), clock the session clock (anything with getTime/reset/add; a Clock by default),
+    duration the planned run length in seconds (sizes spool and trace preallocation) and dataDir
+    where the frame ring's spill file goes. headless skips the RA View window. log is anything
+    with info/warning/error (psychopy.logging in the scan script; the 'eyecam' logger by default).
+    With config record: 'no' only the session container is written.'''
+
+    def __init__(self, config, eyeCam=0, fps=30, aperture=None, clock=None, duration=None, dataDir='data',
+                 headless=False, log=None, vidExt='.mp4'):
+        self.config = config
+        self.eyeCam = eyeCam
+        self.fps = fps
+        self.aperture = aperture
+        self.clock = clock or Clock()
+        self.duration = duration
+        self.dataDir = dataDir
+        self.headless = headless
+        self.log = log or logging.getLogger('eyecam')
+        self.vidExt = vidExt
+        self.record = config.get('record', 'yes') == 'yes'
+        self.threaded = config.get('capture', {}).get('thread', 'no') == 'yes'
+        encoderConfig = config.get('encoder', {})
+        self.spooling = encoderConfig.get('mode', 'live') == 'spool'
+        self.spoolTranscode = encoderConfig.get('transcode', 'session_end')
+        self.cap, self.frameRing, self.engine, self.eyeMonitor, self.preview = None, None, None, None, None
+        self.cameras = []
+        self.store = None
+        self.spooled = []
+        #State dict of the run being recorded (between startRun and endRun), else None:
+        self.currentRun = None
+        #Idle-thread frame count last drawn by showIdle:
+        self._idleShown = 0
+
+    #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    #Devices and workers
+    #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    def open(self):
+        #Open the camera(s) and start the writer / openness processes (only with record: 'yes'):
+        if not self.record or self.engine is not None:
+            return
+        from eyecam.cameras import cameraEntries
+        from eyecam.openness import opennessOptions
+        from eyecam.sources import openSource
+        from eyecam.writer import writerOptions
+        config = self.config
+        #Check the whole config before any device or process is opened (bad entries raise ValueError):
+        options = writerOptions(config, self.fps, duration=self.duration)
+        opennessOptions(config)
+        cameraEntries(config)
+        #Create video capture object to control camera/frame grabber (or the synthetic/replay
+        #source selected in siteConfig.yaml):
+        self.cap = openSource(config, self.eyeCam)
+        self.log.info('opened video reader on camera %u' % self.eyeCam)
+        try:
+            self._openWorkers(options)
+        except Exception:
+            #Nothing started so far may outlive a failed open (the writer process is not a daemon):
+            self.close()
+            raise
+
+    def _openWorkers(self, options):
+        #The rest of open(), once the eye camera is open: ring, writer, eye monitor, cameras, window
+        from eyecam.cameras import camerasFromConfig
+        from eyecam.engine import AcquisitionEngine
+        from eyecam.frames import reFrame
+        from eyecam.openness import eyeMonitorFromConfig
+        from eyecam.ring import ringFromConfig
+        from eyecam.sources import PROP_FPS, CompactSource
+        config = self.config
+        cap = self.cap
+        cap.set(PROP_FPS, self.fps)
+        if config.get('capture', {}).get('color', 'bgr') == 'gray':
+            #Frames are cropped and converted to grayscale once, as they are retrieved:
+            cap = CompactSource(cap, self.aperture)
+            self.aperture = None
+            self.cap = cap
+        #Read a frame, get dims:
+        ret, frame = cap.read()
+        if not ret:
+            raise IOError('No frames from camera %u' % self.eyeCam)
+        if self.aperture:
+            frame = reFrame(frame, self.aperture)
+        #Bounded shared-memory ring of frames from cap; data collection loop copies frames into
+        #free slots, video writing process pops slot indices (FIFO) and encodes from shared memory.
+        #What happens when the writer falls behind is set by capture: overflow in siteConfig.yaml:
+        if not os.path.isdir(self.dataDir):
+            os.makedirs(self.dataDir)
+        self.frameRing = ringFromConfig(config, frame.shape, dtype=frame.dtype,
+                                        spillPath=os.path.join(self.dataDir, 'eyecam_spill.raw'))
+        self.log.info('Frame ring: %d slots, overflow policy %s' % (self.frameRing.nSlots, self.frameRing.overflow))
+        #Write files in another process (encoder settings from siteConfig.yaml); the process waits
+        #for each run's file name and keeps the camera grabbing between runs:
+        self.engine = AcquisitionEngine(cap, self.frameRing, self.fps, self.clock,
+                                        options, aperture=self.aperture)
+        #Optional eye-openness worker; it is offered every frame put into the ring and skips frames
+        #it has no time for:
+        self.eyeMonitor = eyeMonitorFromConfig(config, frame.shape, dtype=frame.dtype)
+        if self.eyeMonitor:
+            self.frameRing.onPut = self.eyeMonitor.offer
+        #Additional cameras (siteConfig.yaml `cameras`), each with its own ring, writer process and
+        #capture thread, on the same clock:
+        self.cameras = camerasFromConfig(config, self.fps, self.clock, os.path.join(self.dataDir, 'eyecam'),
+                                         duration=self.duration)
+        for camera in self.cameras:
+            self.log.info('Camera %s: frame ring %d slots' % (camera.name, camera.frameRing.nSlots))
+        if not self.headless:
+            import cv2
+            from eyecam.preview import previewFromConfig
+            #Initialize the cv2 Window (so we can re-focus back to psychopy)
+            cv2.namedWindow('RA View', cv2.WINDOW_AUTOSIZE)
+            self.preview = previewFromConfig(config, 'RA View')
+
+    def close(self):
+        #Stop the writer and openness processes and release the camera(s); a run still in progress
+        #is finalized first, marked aborted:
+        if self.currentRun is not None:
+            self.endRun(self.currentRun, aborted=True)
+        if self.store is not None:
+            self.stop(transcode=False)
+        if self.eyeMonitor:
+            self.eyeMonitor.close()
+        for camera in self.cameras:
+            camera.close()
+        if self.engine is not None:
+            self.engine.close()
+        elif self.cap is not None:
+            #open() failed before the engine took over the camera:
+            self.cap.release()
+        if self.preview is not None:
+            import cv2
+            cv2.destroyAllWindows()
+        self.cap, self.frameRing, self.engine, self.eyeMonitor, self.preview = None, None, None, None, None
+        self.cameras = []
+
+    def showIdle(self):
+        #Between runs: draw the idle camera's newest frame on the RA View (at the preview's rate) so
+        #the eye can be checked before the trigger. Called from the trigger wait loop:
+        if self.preview is None or self.engine is None:
+            return
+        count, frame = self.engine.latest()
+        if count != self._idleShown and self.preview.show(frame):
+            self._idleShown = count
+
+    #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    #Participant sessions
+    #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    def start(self, filebase, info=None):
+        #Begin a participant's session; filebase is the data file stem (data/<scan>_<id>):
+        self.store = SessionStore(sessionPath(filebase), info)
+        self.spooled = []
+
+    def stop(self, transcode=True):
+        #End the participant's session; spools are encoded now if encoder transcode is session_end:
+        if self.spooled and self.spoolTranscode == 'session_end' and transcode:
+            self.transcodeSpools()
+        self.store.close()
+        self.store = None
+
+    def event(self, condition, onset, duration=0):
+        #Design event of the current run (for the session container):
+        if self.store is None or self.store.run is None:
+            raise RuntimeError('design events belong to a run; call startRun() first')
+        self.store.event(condition, onset, duration)
+
+    def transcodeSpools(self):
+        #Encode raw spools (encoder mode: spool) into their videos
+        from eyecam.spool import transcodeSpool
+        for metaFile in self.spooled:
+            try:
+                out_file = transcodeSpool(metaFile)
+                self.log.info('Transcoded spool to %s' % out_file)
+            except (IOError, OSError) as err:
+                #The spool is kept; it can be transcoded later with `python -m eyecam.spool data`
+                print('Transcoding %s failed: %s' % (metaFile, err))
+                self.log.error('Transcoding %s failed: %s' % (metaFile, err))
+        self.spooled = []
+
+    #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    #Runs
+    #::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    def startRun(self, number, filename, run=None, **info):
+        # Start recording run `number` into filename + vidExt (call right after the trigger, with the
+        # clock zeroed). run is an existing state dict to fill in; info goes into the run's entry in
+        # the session container. Returns the run's state dict.
+        if self.store is None:
+            raise RuntimeError('start() a session before recording its runs')
+        run = {} if run is None else run
+        run.update({'number': number, 'filename': filename, 'timestamps': [], 'telemetry': None,
+                    'trace': None, 'capture': None})
+        video = filename + self.vidExt
+        if self.record:
+            from eyecam.telemetry import telemetryFromConfig
+            from eyecam.trace import traceFromConfig, writerTraceOptions
+            log = self.log
+            self.frameRing.onDrop = lambda seq, ts, number=number: log.warning(
+                'Run %d: dropped frame %d (t=%.4f), writer ring full' % (number, seq, ts))
+            #Rolling fps / frame interval / drop / writer lag figures on the RA View:
+            run['telemetry'] = telemetryFromConfig(self.config, self.fps)
+            if run['telemetry'] and self.eyeMonitor:
+                #Sustained eye closure is shown with the telemetry warnings:
+                run['telemetry'].sources.append(self.eyeMonitor)
+            #Opt-in per-frame stage timing (trace section or EYECAM_TRACE), room for the whole run:
+            traceFrames = int(((self.duration or 60) + 10) * self.fps * 1.2)
+            run['trace'] = traceFromConfig(self.config, traceFrames)
+            #Idle grabbing stops; from here on frames go to this run's video:
+            #(with tracing on, the writer also gets the run's trace and profiler options)
+            self.engine.startRun(video, **writerTraceOptions(self.config, filename, traceFrames))
+            if self.eyeMonitor:
+                self.eyeMonitor.startRun(video)
+        self.store.startRun(number, video=os.path.basename(video) if self.record else None, **info)
+        self.currentRun = run
+        return run
+
+    def spawnTasks(self, sched, run, onWarnings=None):
+        # Spawn the run's recording tasks on `sched`; they run until it cancels them at the end of
+        # the scan. onWarnings(run, warnings) is called when the telemetry warnings change (they are
+        # logged by default).
+        if not self.record:
+            return
+        #(spawned before the capture task, so it is cancelled after it and stores the last frames)
+        sched.spawn('session', sessionFramesTask(self.store, run['timestamps']))
+        feed = captureThreadTask if self.threaded else captureTask
+        run['capture'] = sched.spawn('capture', feed(self.cap, self.clock, self.frameRing, self.aperture,
+                                                     self.preview, run['telemetry'], run['timestamps'],
+                                                     run['trace']))
+        if self.cameras:
+            sched.spawn('cameras', camerasTask(self.cameras, run['filename'], self.vidExt))
+        sched.spawn('writer', writerWatchTask(run, sched, self.engine, self.log))
+        if run['telemetry']:
+            sched.spawn('telemetry', telemetryTask(run, run['telemetry'], self.frameRing, self.preview,
+                                                   onWarnings or self._logWarnings))
+        elif self.eyeMonitor:
+            #Without telemetry the eye-closure alert is shown on its own:
+            sched.spawn('openness', eyeAlertTask(run, self.eyeMonitor, self.preview,
+                                                 onWarnings or self._logWarnings))
+
+    def _logWarnings(self, run, warnings):
+        for warning in warnings:
+            self.log.warning('Run %d: %s' % (run['number'], warning))
+
+    def endRun(self, run, aborted=False):
+        # The writer encodes whatever is still in the ring and closes the file (the camera keeps
+        # grabbing until the next run); the run's diagnostics are saved and returned:
+        #     timing, openness, timing_<camera>    as stored in the session container
+        #     pacing                               cfr pacing corrections (repeated, dropped)
+        #     error                                the writer's error, if it failed
+        #     aborted                              True for a run stopped early (e.g. escape)
+        report = {}
+        if self.record:
+            report = self._finishRecording(run)
+        report['aborted'] = aborted
+        if self.preview is not None:
+            #The telemetry overlay is the finished run's; the idle preview is drawn without it:
+            self.preview.overlay = []
+        self.store.endRun(**dict((key, value) for key, value in report.items() if key != 'error'))
+        self.currentRun = None
+        return report
+
+    def _finishRecording(self, run):
+        import numpy as np
+        from eyecam.pacing import pacedTimestamps, pacingSummary
+        from eyecam.spool import spoolFiles
+        from eyecam.timing import frameTiming, saveTiming, timingFile
+        number, filename, frameRing = run['number'], run['filename'], self.frameRing
+        report = {}
+        try:
+            self.engine.endRun()
+        except IOError as err:
+            print(err)
+            self.log.error(str(err))
+            report['error'] = str(err)
+        report['openness'] = None
+        if self.eyeMonitor:
+            try:
+                report['openness'] = self.eyeMonitor.endRun()
+            except IOError as err:
+                print(err)
+                self.log.error('Run %d: %s' % (number, err))
+        if run['trace'] is not None:
+            run['trace'].save(filename)
+            self.log.info('Run %d: stage trace saved (python -m eyecam.trace %s)' % (number, filename))
+        #Timing stats, saved to the run's _timing.json:
+        timing = frameTiming(run['timestamps'], self.fps, writerDrops=len(frameRing.drops),
+                             spilled=frameRing.spilled)
+        saveTiming(timingFile(filename), timing)
+        report['timing'] = timing
+        if timing.get('estimated_dropped'):
+            self.log.warning('Run %d: about %d frames missed by the camera' % (number, timing['estimated_dropped']))
+        if frameRing.drops or frameRing.spilled:
+            self.log.warning('Run %d: %d frames dropped, %d spilled to disk' % (
+                number, len(frameRing.drops), frameRing.spilled))
+        self.store.drops(frameRing.drops)
+        for camera in self.cameras:
+            try:
+                camera.endRun()
+            except IOError as err:
+                print(err)
+                self.log.error(str(err))
+            camTiming = frameTiming(camera.timestamps, self.fps, writerDrops=len(camera.frameRing.drops),
+                                    spilled=camera.frameRing.spilled)
+            saveTiming(timingFile(camera.out_file), camTiming)
+            report['timing_' + camera.name] = camTiming
+
+        #Timestamps of the frames that made it into the video, one per video frame; with cfr pacing
+        #the writer repeats / drops frames, and the same pacing over the same frames gives its result:
+        written = np.delete(run['timestamps'], frameRing.drops)
+        if self.config.get('encoder', {}).get('pacing', 'off') == 'cfr':
+            written, pacer = pacedTimestamps(written, self.fps)
+            report['pacing'] = pacingSummary(pacer.records())
+            if pacer.count:
+                self.log.info('Run %d: constant-rate pacing repeated %d frames and dropped %d (see _pacing.npy)' % (
+                    number, report['pacing']['repeated'], report['pacing']['dropped']))
+
+        #The writer has saved the binary frame log (filename + '_frames.npy'); the text
+        #timestamp file is kept for older analysis scripts unless capture: ts_csv is 'no'.
+        if self.config.get('capture', {}).get('ts_csv', 'yes') == 'yes':
+            #Save timestamp file (rows match video frames):
+            np.savetxt(filename + '_ts.csv', written, delimiter=',', fmt='%.04f')
+
+        if self.spooling:
+            self.spooled.append(spoolFiles(filename + self.vidExt)[2])
+            self.spooled += [spoolFiles(camera.out_file)[2] for camera in self.cameras]
+            if self.spoolTranscode == 'between_runs':
+                self.transcodeSpools()
+        return report
+
+    def run(self, number, filename, duration, onWarnings=None, **info):
+        # Record run `number` for `duration` seconds from now (the clock is zeroed first), e.g.
+        # headless or from a resident process. Returns endRun's report.
+        self.clock.reset()
+        run = self.startRun(number, filename, date=datetime.datetime.now().strftime('%Y-%m-%d_%H%M%S'), **info)
+        sched = Scheduler()
+
+        def record():
+            self.spawnTasks(sched, run, onWarnings)
+            yield duration
+
+        try:
+            sched.run(record())
+        finally:
+            report = self.endRun(run)
+        return report
+
+
+def runSummary(report, cameras=()):
+    #Console lines for endRun's report:
+    from eyecam.timing import timingSummary
+    lines = timingSummary(report['timing']) if report.get('timing') else []
+    if report.get('aborted'):
+        lines.insert(0, 'Run aborted: diagnostics cover the frames recorded before the quit')
+    if report.get('pacing'):
+        lines.append('Constant-rate pacing: %d frames repeated, %d dropped' % (
+            report['pacing']['repeated'], report['pacing']['dropped']))
+    if report.get('openness'):
+        lines.append('Eye openness: %d frames measured, longest closure %.1f s' % (
+            report['openness']['frames_measured'], report['openness']['longest_closure_s']))
+    for camera in cameras:
+        camTiming = report.get('timing_' + camera.name)
+        if camTiming:
+            lines.append('Camera %s: %d frames, %.2f fps, %d dropped' % (
+                camera.name, camTiming['frames'], camTiming.get('mean_fps') or 0, camTiming['writer_drops']))
+    return lines
@@ -0,0 +1,219 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Aperture calibration for calibrate_eyecam.py: automatic proposal and the ApertureCalibration object.
+
+A short burst of frames is stacked and reduced per pixel: the standard deviation over time (motion -
+blinks, saccades, pupil changes) and the mean (intensity). The eye is where the image moves; if
+nothing moved during the burst, local contrast in the mean image (the dark pupil and lashes against
+the skin) is used instead. The proposal is the bounding box of the rows and columns with enough
+active pixels, padded by a margin and made even-sized and in bounds, in aperture format
+[top bottom left right]. The RA fine-tunes it with the arrow keys as before.
+
+ApertureCalibration holds the camera and the aperture being adjusted, without any window, so the
+calibration can be driven by calibrate_eyecam.py's keys or from another process:
+
+    calibration = ApertureCalibration(config)
+    calibration.start()                  # open the camera; config aperture, proposal or default
+    calibration.adjust('up')             # AP_MAP keys, as in calibrate_eyecam.py
+    frame = calibration.frame()          # next frame, cropped to the aperture
+    aperture = calibration.stop()
+***************************************************************************************************************
+"""
+import time
+
+import numpy as np
+
+#aperture transformations (one step of each calibration key):
+AP_MAP = {"up": [-1, -1, 0, 0],
+          "down": [1, 1, 0, 0],
+          "left": [0, 0, -1, -1],
+          "right": [0, 0, 1, 1],
+          "b": [-1, 1, -1, 1],  #bigger
+          "s": [1, -1, 1, -1]}  #smaller
+
+
+def activityMap(frames):
+    #(motion, mean) maps, one value per pixel, from a sequence of frames (color frames are averaged
+    #over channels):
+    stack = np.asarray(frames, dtype=np.float32)
+    if stack.ndim == 4:
+        stack = stack.mean(axis=3)
+    return stack.std(axis=0), stack.mean(axis=0)
+
+
+def _span(active, minPixels):
+    #First and one-past-last index whose count of active pixels reaches minPixels:
+    idx = np.flatnonzero(active >= minPixels)
+    if not len(idx):
+        return None
+    return int(idx[0]), int(idx[-1]) + 1
+
+
+def _evenSpan(lo, hi, margin, size):
+    #Pad [lo, hi) by margin on each side, clip to [0, size) and make the length even:
+    lo, hi = max(lo - margin, 0), min(hi + margin, size)
+    if (hi - lo) % 2:
+        if hi < size:
+            hi += 1
+        elif lo > 0:
+            lo -= 1
+        else:
+            hi -= 1
+    return lo, hi
+
+
+def detectAperture(frames, margin=0.15, level=0.25, minMotion=2.):
+    ''' Propose [top bottom left right] around the moving / high-contrast region of `frames`.
+
+    A pixel is active when its score is at least `level` times the score's 99.9th percentile; rows
+    and columns need 2% of their pixels active to count. margin pads the box by that fraction of its
+    size on each side. minMotion (gray levels of temporal standard deviation) is the least motion
+    taken as real rather than sensor noise. Returns None if no region stands out.'''
+    motion, mean = activityMap(frames)
+    if motion.max() >= minMotion:
+        score = motion
+    else:
+        #Nothing moved during the burst: use contrast against the typical intensity instead
+        score = np.abs(mean - np.median(mean))
+    peak = np.percentile(score, 99.9)
+    if peak <= 0:
+        return None
+    active = score >= level * peak
+    height, width = active.shape
+    rows = _span(active.sum(axis=1), max(int(0.02 * width), 1))
+    cols = _span(active.sum(axis=0), max(int(0.02 * height), 1))
+    if rows is None or cols is None:
+        return None
+    top, bottom = _evenSpan(rows[0], rows[1], int(round(margin * (rows[1] - rows[0]))), height)
+    left, right = _evenSpan(cols[0], cols[1], int(round(margin * (cols[1] - cols[0]))), width)
+    return [top, bottom, left, right]
+
+
+def closestLegalAperture(aperture, vidSize):
+    ''' return the closest aperture which is of even width and height and fully within vidSize.
+    aperture format is [top bottom left right], vidSize format is [height width]'''
+
+    def ap2size(ap):
+        size = [ap[1] - ap[0], ap[3] - ap[2]]
+        return size
+    aperture = list(aperture)
+    apSize = ap2size(aperture)
+
+    #if height and/or width are odd, expand them by one pixel to make them even
+    if apSize[0] % 2 != 0:
+        aperture[1] += 1
+        apSize = ap2size(aperture)
+    if apSize[1] % 2 != 0:
+        aperture[3] += 1
+        apSize = ap2size(aperture)
+
+    #if aperture is larger than vidSize, shrink it to the closest even size that fits
+    if apSize[0] > vidSize[0]:
+        amntOver = apSize[0] - vidSize[0]
+        shrinkCoeff = amntOver // 2 + amntOver % 2  #if vidSize is odd for some reason, this should handle it
+        aperture = [aperture[i] + shrinkCoeff * AP_MAP['s'][i] for i in range(len(aperture))]
+        apSize = ap2size(aperture)
+    if apSize[1] > vidSize[1]:
+        amntOver = apSize[1] - vidSize[1]
+        shrinkCoeff = amntOver // 2 + amntOver % 2
+        aperture = [aperture[i] + shrinkCoeff * AP_MAP['s'][i] for i in range(len(aperture))]
+        apSize = ap2size(aperture)
+
+    #if the aperture extends off the screen, bring it back on
+    if aperture[0] < 0:  #top
+        aperture = [aperture[i] - (aperture[0] * AP_MAP['down'][i]) for i in range(len(aperture))]
+    if aperture[2] < 0:  #left
+        aperture = [aperture[i] - aperture[2] * AP_MAP['right'][i] for i in range(len(aperture))]
+    if aperture[1] > vidSize[0]:  #bottom
+        aperture = [aperture[i] + (aperture[1] - vidSize[0]) * AP_MAP['up'][i] for i in range(len(aperture))]
+    if aperture[3] > vidSize[1]:  #right
+        aperture = [aperture[i] + (aperture[3] - vidSize[1]) * AP_MAP['left'][i] for i in range(len(aperture))]
+
+    return aperture
+
+
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+#Calibration session
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+class ApertureCalibration(object):
+    ''' Camera eyeCam of siteConfig `config` and the aperture being calibrated (see the module
+    docstring). shift and scale are the pixels one key press moves the aperture or grows / shrinks
+    it on each side; autoFrames is the burst length for propose().'''
+
+    def __init__(self, config, eyeCam=0, shift=5, scale=1, autoFrames=60):
+        self.config = config
+        self.eyeCam = eyeCam
+        self.autoFrames = autoFrames
+        #key dict to move & resize aperture (by pixels):
+        self.steps = dict((key, [step * (scale if key in ('b', 's') else shift) for step in ap])
+                          for key, ap in AP_MAP.items())
+        self.cap = None
+        self.vidSize = None
+        self.aperture = None
+
+    def start(self):
+        #Open the camera and set the first aperture: siteConfig's, else a proposal around the eye,
+        #else the centered 20% of the frame. Returns it.
+        from eyecam.sources import openSource
+        from eyecam.waits import POLL_S
+        #Create vid capture object (camera, or the source selected in siteConfig.yaml):
+        self.cap = openSource(self.config, self.eyeCam)
+        ret, frame = self.cap.read()
+        for attempt in range(100):
+            if ret:
+                break
+            time.sleep(POLL_S)
+            ret, frame = self.cap.read()
+        if not ret:
+            self.stop()
+            raise IOError('No frames from camera %u' % self.eyeCam)
+        self.vidSize = frame.shape[:2]
+        if 'aperture' in self.config:
+            self.aperture = closestLegalAperture(self.config['aperture'], self.vidSize)
+        elif self.propose() is None:
+            height, width = self.vidSize
+            self.aperture = [int(height // 2 - height * 0.10), int(height // 2 + height * 0.10),
+                             int(width // 2 - width * 0.10), int(width // 2 + width * 0.10)]
+        return self.aperture
+
+    def propose(self):
+        #Detect the aperture from a burst of autoFrames frames; the current aperture is kept (and
+        #None returned) if no frames could be read or no region stands out.
+        from eyecam.waits import POLL_S
+        frames = []
+        for attempt in range(2 * self.autoFrames):
+            ret, frame = self.cap.read()
+            if ret:
+                frames.append(frame)
+                if len(frames) == self.autoFrames:
+                    break
+            else:
+                time.sleep(POLL_S)
+        aperture = detectAperture(frames) if frames else None
+        if aperture is None:
+            return None
+        self.aperture = closestLegalAperture(aperture, self.vidSize)
+        return self.aperture
+
+    def adjust(self, key):
+        #Move or resize the aperture by one step of AP_MAP key `key`:
+        step = self.steps[key]
+        self.aperture = closestLegalAperture([self.aperture[i] + step[i] for i in range(len(self.aperture))],
+                                             self.vidSize)
+        return self.aperture
+
+    def frame(self):
+        #The device's next frame cropped to the aperture (None if there was none):
+        ret, frame = self.cap.read()
+        if not ret:
+            return None
+        top, bottom, left, right = self.aperture
+        return frame[top:bottom, left:right]
+
+    def stop(self):
+        #Release the camera; returns the calibrated aperture
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+        return self.aperture
@@ -0,0 +1,214 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Offline batch analysis of recorded sessions. Finds every <run>.mp4 in the given data directories
+together with its timestamps (<run>_frames.npy, or <run>_ts.csv from older releases) and design file,
+decodes the videos in a pool of worker processes and computes per frame the eye-openness measure of
+eyecam.openness and per run the timing QA of eyecam.timing.
+
+Results are cached per run under --cache (default <first directory>/.eyecam_cache), keyed by a hash of
+the run's file contents and the analysis settings, so a rerun only decodes new or changed runs. The
+study is written as one columnar table:
+    <out>.npz       one array per column, one row per video frame of every run:
+                    run (index into `runs`), frame, ts, dark, openness, closed
+    <out>_runs.csv  one row per run: files, timing QA, eye closure summary
+
+Example (from the directory containing EyeCam_Scan.py):
+    python -m eyecam.batch data --out data/eyecam_study --jobs 16
+***************************************************************************************************************
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import json
+from multiprocessing import Pool, cpu_count
+import os
+import sys
+
+import numpy as np
+
+from eyecam.framelog import frameLogFile, loadFrameLog
+from eyecam.openness import OpennessMeter
+from eyecam.timing import frameTiming
+
+#Bump when the analysis changes so cached results are recomputed:
+ANALYSIS_VERSION = 1
+COLUMNS = ('frame', 'ts', 'dark', 'openness', 'closed')
+
+
+def findRuns(paths):
+    #(video, timestamps, design) file triplets for the runs in the given directories / videos;
+    #missing files are None:
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            videos += sorted(glob.glob(os.path.join(path, '*_run*.mp4')))
+        else:
+            videos.append(path)
+    runs = []
+    for video in videos:
+        base = os.path.splitext(video)[0]
+        if '_seg' in os.path.basename(base):
+            #Unjoined segment of a segmented recording
+            continue
+        tsFile = frameLogFile(video)
+        if not os.path.exists(tsFile):
+            tsFile = base + '_ts.csv' if os.path.exists(base + '_ts.csv') else None
+        designFile = base + '_design.csv' if os.path.exists(base + '_design.csv') else None
+        runs.append((video, tsFile, designFile))
+    return runs
+
+
+def contentKey(files, options):
+    #Hash of the files' contents and the analysis settings:
+    digest = hashlib.sha1(json.dumps([ANALYSIS_VERSION, sorted(options.items())]).encode('utf-8'))
+    for path in files:
+        if path is None:
+            digest.update(b'-')
+            continue
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def loadTimestamps(tsFile):
+    if tsFile is None:
+        return None
+    if tsFile.endswith('.npy'):
+        return np.asarray(loadFrameLog(tsFile, mmap=False)['ts'])
+    return np.atleast_1d(np.loadtxt(tsFile, delimiter=','))
+
+
+def designDuration(designFile):
+    #Onset of the RunEnd event in the design file, in seconds from the trigger:
+    if designFile is None:
+        return None
+    with open(designFile) as f:
+        for row in csv.DictReader(f):
+            if row.get('condition') == 'RunEnd':
+                return float(row['onset'])
+    return None
+
+
+def closures(closed, ts):
+    #(number of closures, longest closure in seconds) from per-frame closed flags:
+    edges = np.diff(np.concatenate([[0], closed.astype(np.int8), [0]]))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1
+    if not len(starts):
+        return 0, 0.
+    return len(starts), float((ts[ends] - ts[starts]).max())
+
+
+def analyzeVideo(video, ts, fps, options):
+    #Per-frame columns for the decoded video; frames without a timestamp are placed at frame / fps:
+    import cv2
+    meter = OpennessMeter(**options)
+    cap = cv2.VideoCapture(video)
+    records = []
+    frame = 0
+    while True:
+        ret, image = cap.read()
+        if not ret:
+            break
+        t = ts[frame] if ts is not None and frame < len(ts) else frame / float(fps)
+        records += meter.measure(image, t, frame)
+        frame += 1
+    cap.release()
+    records += meter.finish()
+    rows = np.array(records, dtype=[('frame', '<u4'), ('ts', '<f8'), ('dark', '<f4'), ('openness', '<f4'),
+                                    ('closed', 'u1')])
+    return dict((name, rows[name]) for name in COLUMNS), meter
+
+
+def analyzeRun(job):
+    # Worker: (video, tsFile, designFile, cacheDir, fps, options) -> (video, summary, columns, cached)
+    video, tsFile, designFile, cacheDir, fps, options = job
+    key = contentKey([video, tsFile, designFile], dict(options, fps=fps))
+    cacheFile = os.path.join(cacheDir, key + '.npz')
+    if os.path.exists(cacheFile):
+        with np.load(cacheFile) as cached:
+            summary = json.loads(str(cached['summary']))
+            return video, summary, dict((name, cached[name]) for name in COLUMNS), True
+    ts = loadTimestamps(tsFile)
+    columns, meter = analyzeVideo(video, ts, fps, options)
+    nClosures, longest = closures(columns['closed'], columns['ts'])
+    summary = {'run': os.path.splitext(os.path.basename(video))[0], 'video': video, 'timestamps': tsFile,
+               'design': designFile, 'frames_video': len(columns['frame']),
+               'frames_ts': None if ts is None else len(ts),
+               'design_duration_s': designDuration(designFile),
+               'closed_fraction': round(float(columns['closed'].mean()), 4) if len(columns['closed']) else None,
+               'closures': nClosures, 'longest_closure_s': round(longest, 3),
+               'dark_threshold': meter.threshold and float(meter.threshold)}
+    if ts is not None:
+        timing = frameTiming(ts, fps)
+        summary.update({'mean_fps': timing.get('mean_fps'), 'estimated_dropped': timing.get('estimated_dropped'),
+                        'longest_gap_ms': timing['ifi_ms']['max'] if 'ifi_ms' in timing else None})
+        summary.update(('ifi_%s_ms' % k, v) for k, v in sorted(timing.get('ifi_ms', {}).items()))
+    #Written under a temporary name first so an interrupted run never leaves a truncated entry:
+    tmpFile = cacheFile + '.%d.tmp.npz' % os.getpid()
+    np.savez(tmpFile, summary=np.array(json.dumps(summary)), **columns)
+    os.rename(tmpFile, cacheFile)
+    return video, summary, columns, False
+
+
+def saveStudy(out, results):
+    #Columnar table of every frame of every run, plus the per-run summary csv:
+    results = sorted(results, key=lambda r: r[0])
+    runs = np.array([summary['run'] for video, summary, columns, cached in results])
+    table = {'runs': runs,
+             'run': np.concatenate([np.full(len(columns['frame']), i, dtype=np.uint32)
+                                    for i, (video, summary, columns, cached) in enumerate(results)])}
+    for name in COLUMNS:
+        table[name] = np.concatenate([columns[name] for video, summary, columns, cached in results])
+    np.savez(out + '.npz', **table)
+    fields = []
+    for video, summary, columns, cached in results:
+        fields += [k for k in summary if k not in fields]
+    with open(out + '_runs.csv', 'w') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for video, summary, columns, cached in results:
+            writer.writerow(summary)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyze recorded EyeCam runs (eye openness and timing QA)')
+    parser.add_argument('paths', nargs='+', help='data directories or .mp4 videos')
+    parser.add_argument('--out', help='output table, without extension (default <first dir>/eyecam_study)')
+    parser.add_argument('--cache', help='cache directory (default <first dir>/.eyecam_cache)')
+    parser.add_argument('--jobs', type=int, default=cpu_count(), help='worker processes (default: all cores)')
+    parser.add_argument('--fps', type=float, default=30., help='nominal recording frame rate')
+    parser.add_argument('--baseline-s', type=float, default=10., help='open-eye baseline at the start of a run')
+    parser.add_argument('--closed-below', type=float, default=0.3, help='openness below which the eye is closed')
+    args = parser.parse_args(argv)
+
+    first = args.paths[0] if os.path.isdir(args.paths[0]) else os.path.dirname(args.paths[0]) or '.'
+    out = args.out or os.path.join(first, 'eyecam_study')
+    cacheDir = args.cache or os.path.join(first, '.eyecam_cache')
+    if not os.path.isdir(cacheDir):
+        os.makedirs(cacheDir)
+    options = {'baseline_s': args.baseline_s, 'closed_below': args.closed_below}
+    jobs = [(video, tsFile, designFile, cacheDir, args.fps, options)
+            for video, tsFile, designFile in findRuns(args.paths)]
+    if not jobs:
+        sys.stderr.write('No runs found\n')
+        return 1
+    results = []
+    pool = Pool(max(1, min(args.jobs, len(jobs))))
+    try:
+        for result in pool.imap_unordered(analyzeRun, jobs):
+            results.append(result)
+            sys.stderr.write('[%d/%d] %s%s\n' % (len(results), len(jobs), result[0],
+                                                 ' (cached)' if result[3] else ''))
+    finally:
+        pool.close()
+        pool.join()
+    saveStudy(out, results)
+    sys.stderr.write('Wrote %s.npz and %s_runs.csv (%d runs)\n' % (out, out, len(results)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
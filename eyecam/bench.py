@@ -0,0 +1,346 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Capture-to-disk benchmark. Runs the recording pipeline (recFrame -> FrameRing -> writeVid process)
+headless against a SyntheticSource, sweeping frame size, aperture size, frame rate and encoder
+settings (the keys of the `encoder` section of siteConfig.yaml), and reports for each run:
+    sustained capture and write fps, per-stage latency percentiles (grab, crop+enqueue, queue wait,
+    encode, grab-to-encoded), ring high-water mark, and peak RSS and CPU time of the capture process,
+    the writer process and the writer's ffmpeg child.
+
+Example (from the directory containing EyeCam_Scan.py):
+    python -m eyecam.bench --resolution 640x480 --resolution 1920x1080 --aperture full --aperture 282x170
+        --fps 30 --fps 60 --encoder "" --encoder "codec=libx264,preset=veryfast,crf=23,segment_s=10" \
+        --duration 20 --json bench.json
+
+Sizes are WIDTHxHEIGHT; apertures are centred in the frame. Results are written as JSON (one document
+with a `machine` description and a list of `runs`) so releases and acquisition laptops can be compared.
+***************************************************************************************************************
+"""
+import argparse
+import ctypes
+import glob
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from multiprocessing import Array, Process, RawArray, Value, cpu_count
+from timeit import default_timer
+
+import numpy as np
+
+from eyecam.capture import recFrame
+from eyecam.ring import OVERFLOW_POLICIES, ringFromConfig
+from eyecam.sources import CompactSource, SyntheticSource
+from eyecam.writer import writeVid, writerOptions
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class BenchClock(object):
+    ''' Run clock zeroed by reset() (as the scan clock is at the trigger, which frame pacing relies
+    on). default_timer is system-wide on Linux and OS X, so a capture timestamp plus `start` can be
+    compared with times taken in the writer process.'''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.start = default_timer()
+
+    def getTime(self):
+        return default_timer() - self.start
+
+
+def processUsage(who='self'):
+    #Returns (peak RSS in MB, user + system CPU seconds) for this process or its waited-for children:
+    if resource is None:
+        return float('nan'), float('nan')
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    #ru_maxrss is in bytes on OS X and kilobytes elsewhere:
+    rssMB = usage.ru_maxrss / (1024. * 1024. if sys.platform == 'darwin' else 1024.)
+    return rssMB, usage.ru_utime + usage.ru_stime
+
+
+class WriterStats(object):
+    ''' Per-frame timing table filled in by writeVid inside the writer process(es), one row per
+    frame sequence number. Lives in shared memory so the benchmark can read it after the writer
+    exits.'''
+
+    def __init__(self, maxFrames):
+        self.maxFrames = int(maxFrames)
+        self._table = RawArray(ctypes.c_double, self.maxFrames * 3)
+        self._count = Value(ctypes.c_long, 0)
+        #Summed over encoding processes: peak RSS (MB), CPU (s), ffmpeg CPU (s):
+        self._usage = Array(ctypes.c_double, 3)
+
+    def table(self):
+        #Columns: capture timestamp, dequeue time, encoded time; rows of encoded frames only:
+        table = np.frombuffer(self._table, dtype=np.float64).reshape(self.maxFrames, 3)
+        return table[table[:, 2] > 0]
+
+    @property
+    def count(self):
+        return self._count.value
+
+    def record(self, seq, ts, dequeued, encoded):
+        if seq < self.maxFrames:
+            row = seq * 3
+            self._table[row:row + 3] = [ts, dequeued, encoded]
+        with self._count.get_lock():
+            self._count.value += 1
+
+    def finish(self):
+        rssMB, cpu = processUsage('self')
+        ffmpegCpu = processUsage('children')[1]
+        with self._usage.get_lock():
+            for i, value in enumerate([rssMB, cpu, ffmpegCpu]):
+                self._usage[i] += value
+
+    def usage(self):
+        return list(self._usage)
+
+
+def latencyPercentiles(seconds):
+    #p50/p90/p99/max of a latency sample, in milliseconds:
+    if not len(seconds):
+        return {}
+    ms = np.asarray(seconds) * 1000.
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return {'p50': round(p50, 3), 'p90': round(p90, 3), 'p99': round(p99, 3),
+            'max': round(float(ms.max()), 3)}
+
+
+def centredAperture(frameSize, apSize):
+    #[top bottom left right] aperture of even size apSize=(w, h) centred in frameSize=(w, h):
+    if apSize is None:
+        return None
+    w = min(apSize[0], frameSize[0]) // 2 * 2
+    h = min(apSize[1], frameSize[1]) // 2 * 2
+    top = (frameSize[1] - h) // 2
+    left = (frameSize[0] - w) // 2
+    return [top, top + h, left, left + w]
+
+
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+#One benchmark run
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+def runOnce(resolution, apSize, fps, encoder, duration, outDir, ringSlots=None, overflow='block', color='bgr',
+            ringMB=256):
+    #The ring is sized as in a scan (capture: ring_mb / ring_slots, see ringFromConfig):
+    cap = SyntheticSource(width=resolution[0], height=resolution[1], fps=fps)
+    clock = BenchClock()
+    aperture = centredAperture(resolution, apSize)
+    if color == 'gray':
+        #Compact path: crop + grayscale once at capture (capture: {color: gray}):
+        cap = CompactSource(cap, aperture)
+        aperture = None
+    ret, frame = cap.read()
+    if aperture:
+        frame = frame[aperture[0]:aperture[1], aperture[2]:aperture[3]]
+    outFile = os.path.join(outDir, 'bench_%dx%d_%s_%g_%s%s.mp4' % (
+        resolution[0], resolution[1], 'x'.join(map(str, apSize)) if apSize else 'full', fps, color,
+        ''.join('_%s-%s' % item for item in sorted(encoder.items()))))
+    captureConfig = {'ring_mb': ringMB, 'overflow': overflow}
+    if ringSlots:
+        captureConfig['ring_slots'] = ringSlots
+    frameRing = ringFromConfig({'capture': captureConfig}, frame.shape, dtype=frame.dtype,
+                               spillPath=outFile + '.spill')
+    stats = WriterStats(int(duration * fps * 1.5) + 64)
+    quit_flag = Value(ctypes.c_bool, False)
+    options = writerOptions({'encoder': encoder}, fps, duration=duration)
+    options['stats'] = stats
+    writeProc = Process(name='Write', target=writeVid, args=(frameRing, quit_flag, outFile, fps), kwargs=options)
+    writeProc.start()
+    #Give up on a put blocked on a full ring if the writer has died:
+    frameRing.writerAlive = writeProc.is_alive
+
+    rss0, cpu0 = processUsage('self')
+    grab, enqueue, timestamps = [], [], []
+    highWater = 0
+    clock.reset()
+    start = clock.start
+    error = None
+    while default_timer() - start < duration:
+        if not writeProc.is_alive():
+            error = 'the writer process stopped (exit code %s)' % writeProc.exitcode
+            break
+        before = default_timer()
+        try:
+            ts = recFrame(cap, clock, frameRing, aperture=aperture)
+        except IOError as err:
+            error = str(err)
+            break
+        enqueue.append(default_timer() - start - ts)
+        grab.append(start + ts - before)
+        timestamps.append(ts)
+        highWater = max(highWater, frameRing.depth())
+    captureEnd = default_timer()
+    captureRss, cpu1 = processUsage('self')
+
+    #Let the writer finish everything that was captured, then close the file:
+    quit_flag.value = True
+    writeProc.join()
+    if writeProc.exitcode and error is None:
+        error = 'the writer process failed (exit code %s)' % writeProc.exitcode
+    frameRing.close()
+    cap.release()
+
+    table = stats.table()
+    #Capture timestamps on the writer's time base:
+    table[:, 0] += start
+    writerRss, writerCpu, ffmpegCpu = stats.usage()
+    nCaptured = len(timestamps)
+    nWritten = stats.count
+    captureSpan = timestamps[-1] - timestamps[0] if nCaptured > 1 else float('nan')
+    writeSpan = table[:, 2].max() - table[:, 0].min() if nWritten > 1 else float('nan')
+    return {
+        'resolution': list(resolution),
+        'aperture': list(apSize) if apSize else 'full',
+        'color': color,
+        'frame_shape': list(frame.shape),
+        'frame_bytes': frame.nbytes,
+        'ring_mb': round(frameRing.frameBytes * frameRing.nSlots / 1048576., 3),
+        'fps': fps,
+        'encoder': encoder,
+        #None, or why the run stopped early (e.g. the writer could not open the encoder):
+        'error': error,
+        'duration_s': round(captureEnd - start, 3),
+        'frames_captured': nCaptured,
+        'frames_written': nWritten,
+        'capture_fps': round((nCaptured - 1) / captureSpan, 3),
+        'write_fps': round((nWritten - 1) / writeSpan, 3),
+        'latency_ms': {
+            'grab': latencyPercentiles(grab),
+            'enqueue': latencyPercentiles(enqueue),
+            'queue': latencyPercentiles(table[:, 1] - table[:, 0]),
+            'encode': latencyPercentiles(table[:, 2] - table[:, 1]),
+            'total': latencyPercentiles(table[:, 2] - table[:, 0]),
+        },
+        'ring_slots': frameRing.nSlots,
+        'overflow': overflow,
+        'queue_high_water': highWater,
+        'frames_dropped': len(frameRing.drops),
+        'frames_spilled': frameRing.spilled,
+        'drain_s': round(default_timer() - captureEnd, 3),
+        #ru_maxrss is the peak over the life of the benchmark process, not just this run:
+        'capture': {'peak_rss_mb': round(captureRss, 1), 'cpu_s': round(cpu1 - cpu0, 3),
+                    'cpu_pct': round(100. * (cpu1 - cpu0) / (captureEnd - start), 1)},
+        'writer': {'peak_rss_mb': round(writerRss, 1), 'cpu_s': round(writerCpu, 3),
+                   'ffmpeg_cpu_s': round(ffmpegCpu, 3)},
+        #Video, or raw spool in spool mode:
+        'output_mb': round(sum(os.path.getsize(f) for f in glob.glob(os.path.splitext(outFile)[0] + '.*'))
+                           / 1048576., 3),
+    }
+
+
+def machineInfo():
+    info = {'platform': platform.platform(), 'machine': platform.machine(),
+            'processor': platform.processor(), 'cpu_count': cpu_count(),
+            'python': platform.python_version(), 'numpy': np.__version__}
+    try:
+        import cv2
+        info['opencv'] = cv2.__version__
+    except ImportError:
+        pass
+    try:
+        import imageio
+        info['imageio'] = imageio.__version__
+    except ImportError:
+        pass
+    try:
+        info['git_revision'] = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip().decode('ascii')
+    except Exception:
+        info['git_revision'] = ''
+    return info
+
+
+def _size(text):
+    if text == 'full':
+        return None
+    w, h = text.lower().split('x')
+    return int(w), int(h)
+
+
+def _encoder(text):
+    #"codec=libx264,crf=23" -> {'codec': 'libx264', 'crf': 23}; "" -> imageio defaults
+    settings = {}
+    for item in filter(None, text.split(',')):
+        key, value = item.split('=', 1)
+        for cast in (int, float):
+            try:
+                value = cast(value)
+                break
+            except ValueError:
+                pass
+        settings[key.strip()] = value
+    return settings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='EyeCam capture-to-disk benchmark')
+    parser.add_argument('--resolution', action='append', type=_size,
+                        help='source frame size WxH (repeatable, default 640x480)')
+    parser.add_argument('--aperture', action='append', type=_size,
+                        help='centred aperture WxH or "full" (repeatable, default full)')
+    parser.add_argument('--fps', action='append', type=float, help='source frame rate (repeatable, default 30)')
+    parser.add_argument('--color', action='append', choices=('bgr', 'gray'),
+                        help='recorded frame format (repeatable, default bgr; gray is capture: {color: gray})')
+    parser.add_argument('--encoder', action='append', type=_encoder,
+                        help='siteConfig.yaml encoder settings, e.g. "codec=libx264,crf=23,segment_s=10" '
+                             '(repeatable)')
+    parser.add_argument('--duration', type=float, default=10., help='seconds of capture per run')
+    parser.add_argument('--ring-mb', type=float, default=256, help='frame ring memory budget (capture: ring_mb)')
+    parser.add_argument('--ring-slots', type=int, default=None,
+                        help='fixed frame ring slot count instead of --ring-mb (capture: ring_slots)')
+    parser.add_argument('--overflow', choices=OVERFLOW_POLICIES, default='block',
+                        help='frame ring overflow policy')
+    parser.add_argument('--json', default='-', help='output file for results (default stdout)')
+    parser.add_argument('--keep', action='store_true', help='keep the encoded videos')
+    args = parser.parse_args(argv)
+
+    outDir = tempfile.mkdtemp(prefix='eyecam_bench_')
+    results = {'machine': machineInfo(), 'runs': []}
+    try:
+        for resolution, apSize, fps, color, encoder in itertools.product(
+                args.resolution or [(640, 480)], args.aperture or [None],
+                args.fps or [30.], args.color or ['bgr'], args.encoder or [{}]):
+            run = runOnce(resolution, apSize, fps, encoder, args.duration, outDir, ringSlots=args.ring_slots,
+                          overflow=args.overflow, color=color, ringMB=args.ring_mb)
+            results['runs'].append(run)
+            if run['error']:
+                sys.stderr.write('%-10s %-9s %5g fps %-4s %-28s FAILED: %s\n' % (
+                    'x'.join(map(str, resolution)), run['aperture'] if apSize is None else 'x'.join(map(str, apSize)),
+                    fps, color, json.dumps(encoder), run['error']))
+                continue
+            sys.stderr.write('%-10s %-9s %5g fps %-4s %-28s capture %7.2f fps  write %7.2f fps  '
+                             'total p99 %8.1f ms  high-water %d\n' % (
+                                 'x'.join(map(str, resolution)), run['aperture'] if apSize is None
+                                 else 'x'.join(map(str, apSize)), fps, color, json.dumps(encoder),
+                                 run['capture_fps'], run['write_fps'],
+                                 run['latency_ms']['total'].get('p99', float('nan')), run['queue_high_water']))
+    finally:
+        if args.keep:
+            sys.stderr.write('Videos kept in %s\n' % outDir)
+        else:
+            shutil.rmtree(outDir, ignore_errors=True)
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Additional cameras recorded alongside the eye camera (e.g. a face or head-motion camera).
+
+Each entry of the optional `cameras` list in siteConfig.yaml describes one camera:
+    cameras:
+      - name: face                              # files: <run>_face.mp4, <run>_face_frames.npy, ...
+        source: {type: camera, device: 2}       # required; as the top-level source section
+        aperture: [top, bottom, left, right]    # optional crop
+        capture: {color: gray}                  # optional, overrides the top-level capture section
+        encoder: {preset: ultrafast}            # optional, overrides the top-level encoder section
+
+Every camera has its own source, frame ring and writer process (an AcquisitionEngine) and, during a
+run, its own capture thread. cv2 releases the GIL while it waits for a device and each writer encodes
+in its own process, so an added camera does not take grab time from the others. All frames are
+timestamped on the session clock, which is zeroed at the scanner trigger, and every camera gets the
+run's frame log and _timing.json under its own name.
+***************************************************************************************************************
+"""
+from eyecam.capture import CaptureThread
+from eyecam.engine import AcquisitionEngine
+from eyecam.frames import reFrame
+from eyecam.ring import ringFromConfig
+from eyecam.sources import PROP_FPS, CompactSource, openSource
+from eyecam.writer import writerOptions
+
+
+def cameraConfig(config, entry):
+    #siteConfig for one `cameras` entry: its source, and the top-level capture/encoder sections
+    #updated with the entry's own. The source has no default: device 0 is usually the eye camera.
+    source = entry.get('source')
+    if not source:
+        raise ValueError('cameras entry %r has no source (e.g. source: {type: camera, device: 2})'
+                         % entry.get('name'))
+    if source.get('type', 'camera') == 'camera' and 'device' not in source:
+        raise ValueError('cameras entry %r: a camera source needs its device number' % entry.get('name'))
+    camConfig = dict(config)
+    camConfig['source'] = source
+    for section in ('capture', 'encoder'):
+        camConfig[section] = dict(config.get(section, {}), **entry.get(section, {}))
+    return camConfig
+
+
+class Camera(object):
+    ''' One additional camera `name` recording at `fps` on `clock` (see the module docstring).
+
+    spillBase is the session's file base (for the frame ring's spill file), duration the run length
+    in seconds (sizes spool preallocation).'''
+
+    def __init__(self, name, config, aperture, fps, clock, spillBase, duration=None):
+        self.name = name
+        self.clock = clock
+        cap = openSource(config)
+        cap.set(PROP_FPS, fps)
+        if config.get('capture', {}).get('color', 'bgr') == 'gray':
+            cap = CompactSource(cap, aperture)
+            aperture = None
+        self.aperture = aperture
+        ret, frame = cap.read()
+        if not ret:
+            cap.release()
+            raise IOError('Camera %s: no frames from %s' % (name, config['source']))
+        if aperture:
+            frame = reFrame(frame, aperture)
+        self.frameRing = ringFromConfig(config, frame.shape, dtype=frame.dtype,
+                                        spillPath='%s_%s_spill.raw' % (spillBase, name))
+        self.engine = AcquisitionEngine(cap, self.frameRing, fps, clock, writerOptions(config, fps, duration),
+                                        aperture=aperture)
+        self.out_file = None
+        self.timestamps = []
+        self._capture = None
+
+    def outFile(self, filename, ext):
+        #This camera's video for the run filename:
+        return '%s_%s%s' % (filename, self.name, ext)
+
+    def startRun(self, out_file):
+        #Right after the trigger: frames go to out_file until stopCapture
+        self.engine.startRun(out_file)
+        self.out_file = out_file
+        self.timestamps = []
+        self._capture = CaptureThread(self.engine.cap, self.clock, aperture=self.aperture,
+                                      frameRing=self.frameRing, timestamps=self.timestamps)
+        self._capture.start()
+
+    def stopCapture(self):
+        if self._capture is not None:
+            self._capture.stop()
+            self._capture = None
+
+    def endRun(self):
+        #Stop capturing and let the writer finish the video; raises IOError if the writer failed
+        self.stopCapture()
+        self.engine.endRun()
+
+    def close(self):
+        self.stopCapture()
+        self.engine.close()
+
+
+def cameraEntries(config):
+    #(name, siteConfig, aperture) for every `cameras` entry; raises ValueError for a bad entry before
+    #any camera is opened:
+    entries = []
+    for entry in config.get('cameras') or []:
+        if not entry.get('name'):
+            raise ValueError('cameras entry %r has no name' % (entry,))
+        entries.append((entry['name'], cameraConfig(config, entry), entry.get('aperture')))
+    return entries
+
+
+def camerasFromConfig(config, fps, clock, spillBase, duration=None):
+    #Camera objects for the `cameras` section of siteConfig.yaml (empty list without one). Every
+    #entry is checked first; if a camera fails to open, the ones already opened are closed:
+    cameras = []
+    try:
+        for name, camConfig, aperture in cameraEntries(config):
+            cameras.append(Camera(name, camConfig, aperture, fps, clock, spillBase, duration))
+    except Exception:
+        for camera in cameras:
+            camera.close()
+        raise
+    return cameras
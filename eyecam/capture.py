@@ -0,0 +1,118 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Frame capture: recFrame reads one frame inside the caller's loop; CaptureThread grabs and timestamps
+frames at the device's cadence on a dedicated thread, independent of key polling and the RA preview
+running on the main thread. Both take an optional CaptureTrace (eyecam.trace) that stamps each stage.
+***************************************************************************************************************
+"""
+import threading
+import time
+
+from eyecam.frames import reFrame
+from eyecam.trace import CROP, ENQUEUE, GRAB, PREVIEW, RETRIEVE
+
+
+def recFrame(cap, clock, frameRing, aperture=None, preview=None, telemetry=None, trace=None):
+    #read a frame from the cv device `cap`, copy it into the writer's frame ring, and display it
+    #(at the preview's own refresh rate). Returns the frame's grab timestamp on `clock`, taken
+    #before the frame is decoded:
+    if trace is not None:
+        trace.begin()
+    cap.grab()
+    ts = clock.getTime()
+    if trace is not None:
+        trace.mark(GRAB)
+    ret, frame = cap.retrieve()
+    if trace is not None:
+        trace.mark(RETRIEVE)
+    if aperture:
+        frame = reFrame(frame, aperture)
+        if trace is not None:
+            trace.mark(CROP)
+    seq = frameRing.put(frame, ts)
+    if telemetry is not None:
+        telemetry.update(ts)
+    if trace is not None:
+        trace.mark(ENQUEUE)
+    if preview is not None:
+        preview.show(frame)
+    if trace is not None:
+        trace.mark(PREVIEW)
+        trace.commit(seq, ts)
+    return ts
+
+
+class CaptureThread(threading.Thread):
+    ''' Grab/timestamp/retrieve loop for a cv2.VideoCapture-like `cap`.
+
+    The timestamp is read from `clock` immediately after cap.grab() returns, before the frame is
+    decoded, cropped or queued. Every frame is copied into `frameRing` (if given), its timestamp
+    appended to `timestamps` and passed to `telemetry`; the main thread only reads the newest frame
+    through latest(). `trace` (with a frameRing) stamps each stage; the preview stage is the hand-off
+    to latest().'''
+
+    def __init__(self, cap, clock, aperture=None, frameRing=None, timestamps=None, telemetry=None,
+                 trace=None):
+        threading.Thread.__init__(self, name='Capture')
+        self.daemon = True
+        self.cap = cap
+        self.clock = clock
+        self.aperture = aperture
+        self.frameRing = frameRing
+        self.timestamps = timestamps
+        self.telemetry = telemetry
+        self.trace = trace if frameRing is not None else None
+        self.count = 0
+        self._latest = None
+        self._lock = threading.Lock()
+        self._halt = threading.Event()
+
+    def run(self):
+        trace = self.trace
+        while not self._halt.is_set():
+            if trace is not None:
+                trace.begin()
+            if not self.cap.grab():
+                #Device not ready; don't spin on it:
+                time.sleep(0.001)
+                continue
+            ts = self.clock.getTime()
+            if trace is not None:
+                trace.mark(GRAB)
+            ret, frame = self.cap.retrieve()
+            if not ret:
+                continue
+            if trace is not None:
+                trace.mark(RETRIEVE)
+            if self.aperture:
+                frame = reFrame(frame, self.aperture)
+                if trace is not None:
+                    trace.mark(CROP)
+            if self.frameRing is not None:
+                try:
+                    seq = self.frameRing.put(frame, ts)
+                except IOError:
+                    #The writer died with the ring full; nothing more can be recorded
+                    break
+            if self.timestamps is not None:
+                self.timestamps.append(ts)
+            if self.telemetry is not None:
+                self.telemetry.update(ts)
+            if trace is not None:
+                trace.mark(ENQUEUE)
+            with self._lock:
+                self._latest = frame
+                self.count += 1
+            if trace is not None:
+                trace.mark(PREVIEW)
+                trace.commit(seq, ts)
+
+    def latest(self):
+        #Returns (number of frames grabbed so far, newest frame or None):
+        with self._lock:
+            return self.count, self._latest
+
+    def stop(self):
+        self._halt.set()
+        self.join()
@@ -0,0 +1,115 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Session-scoped acquisition engine: the camera, the shared-memory frame ring and the writer process
+are set up once per session instead of once per run. Between runs the camera is kept warm by an idle
+capture thread (frames are grabbed and discarded, so the device buffer never holds stale frames) and
+the writer process waits for the next run's output file, so starting a run costs no device warm-up
+or process spawn.
+
+    engine = AcquisitionEngine(cap, frameRing, fps, clock, writerOptions(config, fps))
+    engine.startRun(out_file)    # right after the trigger; capture into engine.frameRing
+    ...
+    engine.endRun()              # writer drains the ring and closes out_file; camera goes idle
+    ...
+    engine.close()
+***************************************************************************************************************
+"""
+from ctypes import c_bool
+from multiprocessing import Process, Queue, Value
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+from eyecam.capture import CaptureThread
+from eyecam.writer import sessionWriter
+
+
+class AcquisitionEngine(object):
+    ''' Camera `cap` and a persistent writer process encoding frames from `frameRing` at `fps`.
+
+    options are the writeVid keyword arguments used for every run (see writerOptions); startRun
+    can override them for one run. clock (anything with getTime()) and aperture are used by the
+    idle thread.'''
+
+    def __init__(self, cap, frameRing, fps, clock, options=None, aperture=None):
+        self.cap = cap
+        self.frameRing = frameRing
+        self.fps = fps
+        self.options = options or {}
+        self.aperture = aperture
+        self.clock = clock
+        self.out_file = None
+        self._idle = None
+        #Set to drain the ring and close the current run's video:
+        self._quit = Value(c_bool, False)
+        self._jobs = Queue()
+        self._done = Queue()
+        self._writer = Process(name='Write', target=sessionWriter,
+                               args=(frameRing, self._quit, self._jobs, self._done))
+        self._writer.start()
+        #A capture blocked on a full ring gives up (IOError) if the writer dies:
+        frameRing.writerAlive = self.writerAlive
+        self.idle()
+
+    def idle(self):
+        #Keep the camera grabbing (frames are discarded) until the next run starts:
+        if self._idle is None:
+            self._idle = CaptureThread(self.cap, self.clock, aperture=self.aperture)
+            self._idle.start()
+
+    def stopIdle(self):
+        if self._idle is not None:
+            self._idle.stop()
+            self._idle = None
+
+    def latest(self):
+        #(count, newest frame) from the idle thread, for a preview between runs:
+        if self._idle is None:
+            return 0, None
+        return self._idle.latest()
+
+    def startRun(self, out_file, **options):
+        #Stop idling and hand out_file to the writer; frames put into frameRing from now on go to it:
+        self.stopIdle()
+        self.frameRing.newRun()
+        self._quit.value = False
+        runOptions = dict(self.options, **options)
+        self._jobs.put((out_file, self.fps, runOptions))
+        self.out_file = out_file
+
+    def writerAlive(self):
+        return self._writer.is_alive()
+
+    def endRun(self, idle=True):
+        # Let the writer encode everything still in the ring and close the video; returns once the
+        # file is complete. Raises IOError if the writer failed on this run.
+        if self.out_file is None:
+            return
+        self._quit.value = True
+        while True:
+            try:
+                out_file, error = self._done.get(timeout=0.5)
+                break
+            except Empty:
+                #A writer process that died will never report:
+                if not self.writerAlive():
+                    out_file, error = self.out_file, 'the writer process stopped'
+                    break
+        self.out_file = None
+        if idle:
+            self.idle()
+        if error:
+            raise IOError('Writing %s failed: %s' % (out_file, error))
+
+    def close(self):
+        #Finish any run in progress, stop the writer process and release the camera:
+        self.stopIdle()
+        try:
+            self.endRun(idle=False)
+        finally:
+            self._jobs.put(None)
+            self._writer.join()
+            self.frameRing.close()
+            self.cap.release()
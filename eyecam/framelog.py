@@ -0,0 +1,79 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Per-run frame log: one fixed-size binary record per frame in the video, in video frame order, saved
+as <run>_frames.npy next to the video. Record N describes video frame N:
+    frame    video frame number (== N)
+    seq      capture sequence number of the frame (counts every frame grabbed in the run)
+    ts       grab timestamp, seconds from the scanner trigger
+    dropped  number of captured frames dropped immediately before this one (0 = no drop)
+With constant-rate pacing (eyecam.pacing) a repeated frame has consecutive records with the same seq.
+
+Analysis code can memory-map it instead of parsing text:
+    frames = loadFrameLog('data/REST_X_run1_DATE_frames.npy')
+    frames['ts'][1000]    # grab time of video frame 1000
+
+With fragmented video output the records are also streamed to <run>_frames.part as they are written,
+so a run that was aborted or crashed keeps its frame log; loadFrameLog falls back to the .part file
+when the .npy is missing.
+***************************************************************************************************************
+"""
+import os
+
+import numpy as np
+
+FRAME_DTYPE = np.dtype([('frame', '<u4'), ('seq', '<u4'), ('ts', '<f8'), ('dropped', '<u4')])
+
+
+def frameLogFile(out_file):
+    #Frame log path for the video out_file:
+    return os.path.splitext(out_file)[0] + '_frames.npy'
+
+
+def _partFile(path):
+    return os.path.splitext(path)[0] + '.part'
+
+
+class FrameLog(object):
+    ''' Accumulates frame records in the writer, in the order frames are written to the video.
+
+    With streamTo (the run's frame log path), records are also appended to its .part file, which is
+    flushed every flushEvery records and removed once the log is saved.'''
+
+    def __init__(self, capacity=16384, streamTo=None, flushEvery=30):
+        self._records = np.zeros(capacity, dtype=FRAME_DTYPE)
+        self.count = 0
+        self._lastSeq = -1
+        self._part = open(_partFile(streamTo), 'wb') if streamTo else None
+        self._flushEvery = max(int(flushEvery), 1)
+
+    def add(self, seq, ts):
+        if self.count == len(self._records):
+            self._records = np.concatenate([self._records, np.zeros_like(self._records)])
+        self._records[self.count] = (self.count, seq, ts, max(seq - self._lastSeq - 1, 0))
+        self._lastSeq = seq
+        self.count += 1
+        if self._part is not None:
+            self._records[self.count - 1:self.count].tofile(self._part)
+            if self.count % self._flushEvery == 0:
+                self._part.flush()
+
+    def records(self):
+        return self._records[:self.count]
+
+    def save(self, path):
+        np.save(path, self.records())
+        if self._part is not None:
+            self._part.close()
+            self._part = None
+            os.remove(_partFile(path))
+
+
+def loadFrameLog(path, mmap=True):
+    #Frame records of a run (memory-mapped unless mmap is False); the streamed .part file of an
+    #aborted run if there is no .npy:
+    if not os.path.exists(path) and os.path.exists(_partFile(path)):
+        if mmap:
+            return np.memmap(_partFile(path), dtype=FRAME_DTYPE, mode='r')
+        return np.fromfile(_partFile(path), dtype=FRAME_DTYPE)
+    return np.load(path, mmap_mode='r' if mmap else None)
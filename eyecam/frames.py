@@ -0,0 +1,13 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Frame helpers shared by the capture loop, capture thread and video writer
+***************************************************************************************************************
+"""
+
+
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+#Image cropping function
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+def reFrame(fr, aperture):
+    return fr[aperture[0]:aperture[1], aperture[2]:aperture[3]]
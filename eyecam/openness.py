@@ -0,0 +1,289 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Online eye-openness metric, computed in its own worker process while a run is recorded.
+
+In the IR eye video the pupil is the darkest structure in the aperture and disappears when the lid
+closes. For every frame the worker measures the fraction of (subsampled) aperture pixels darker than
+a threshold; the threshold and the open-eye reference fraction are learned from the first
+`baseline_s` seconds of the run (the countdown, when the eyes should be open):
+    threshold = p1 + contrast * (p50 - p1)        of the baseline pixels
+    openness  = dark fraction / median baseline dark fraction
+A frame with openness below `closed_below` counts as closed; closure lasting `alert_s` seconds raises
+an alert on the RA window. Per-frame records are streamed to <run>_openness.part and saved as
+<run>_openness.npy at the end of the run:
+    seq       capture sequence number (frames skipped under load are missing)
+    ts        grab timestamp, seconds from the scanner trigger
+    dark      fraction of dark pixels
+    openness  dark / baseline reference (NaN during the baseline)
+    closed    1 if the eye was judged closed
+
+The capture side only offers frames (FrameRing.onPut): a frame is copied into a single shared slot if
+the worker is not reading it, otherwise skipped, so the metric never slows capture.
+***************************************************************************************************************
+"""
+import ctypes
+from multiprocessing import Event, Lock, Process, Queue, RawArray, Value
+import os
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+import traceback
+from timeit import default_timer
+
+import numpy as np
+
+OPENNESS_DTYPE = np.dtype([('seq', '<u4'), ('ts', '<f8'), ('dark', '<f4'), ('openness', '<f4'), ('closed', 'u1')])
+#Settings of the `openness` section of siteConfig.yaml besides `enabled`:
+OPENNESS_OPTIONS = ('alert_s', 'baseline_s', 'closed_below', 'step', 'contrast')
+
+
+def opennessFiles(out_file):
+    #(streamed records, final .npy) paths for the video out_file:
+    base = os.path.splitext(out_file)[0]
+    return base + '_openness.part', base + '_openness.npy'
+
+
+def loadOpenness(path):
+    return np.load(path)
+
+
+class OpennessMeter(object):
+    ''' Frame-by-frame openness with a baseline learned from the first baseline_s seconds.'''
+
+    def __init__(self, baseline_s=10., closed_below=0.3, alert_s=5., step=2, contrast=0.3):
+        self.baseline_s = baseline_s
+        self.closedBelow = closed_below
+        self.alertS = alert_s
+        self.step = max(int(step), 1)
+        self.contrast = contrast
+        self.threshold = None
+        self.reference = None
+        self._baseline = []
+        self._start = None
+        self.closedSince = None
+
+    def _gray(self, frame):
+        small = frame[::self.step, ::self.step]
+        if small.ndim == 3:
+            return small.mean(axis=2)
+        return small.astype(np.float32)
+
+    def _learn(self, frames):
+        #Set threshold and reference from the baseline frames; returns their dark fractions
+        stack = np.asarray(frames)
+        p1, p50 = np.percentile(stack, [1, 50])
+        self.threshold = p1 + self.contrast * (p50 - p1)
+        dark = (stack < self.threshold).mean(axis=(1, 2))
+        self.reference = float(np.median(dark))
+        return dark
+
+    def measure(self, frame, ts, seq):
+        # Returns a list of OPENNESS_DTYPE tuples ready to be written (empty while the baseline is
+        # collected; the baseline frames are returned together once it is complete).
+        gray = self._gray(frame)
+        if self.reference is None:
+            if self._start is None:
+                self._start = ts
+            self._baseline.append((seq, ts, gray))
+            if ts - self._start < self.baseline_s:
+                return []
+            dark = self._learn([b[2] for b in self._baseline])
+            records = [(s, t, d, np.nan, 0) for (s, t, g), d in zip(self._baseline, dark)]
+            self._baseline = []
+            return records
+        dark = float((gray < self.threshold).mean())
+        openness = dark / self.reference if self.reference > 0 else np.nan
+        closed = openness < self.closedBelow
+        if closed:
+            if self.closedSince is None:
+                self.closedSince = ts
+        else:
+            self.closedSince = None
+        return [(seq, ts, dark, openness, int(closed))]
+
+    def finish(self):
+        #Records still held back when the run ends before the baseline is complete:
+        if self.reference is not None or not self._baseline:
+            return []
+        dark = self._learn([b[2] for b in self._baseline])
+        records = [(s, t, d, np.nan, 0) for (s, t, g), d in zip(self._baseline, dark)]
+        self._baseline = []
+        return records
+
+    def closedFor(self, ts):
+        return 0. if self.closedSince is None else ts - self.closedSince
+
+
+def _checkOptions(options):
+    #An unknown setting would only fail inside the worker, so it is rejected before it is started:
+    unknown = sorted(set(options) - set(OPENNESS_OPTIONS))
+    if unknown:
+        raise ValueError('Unknown openness setting(s) %s (use enabled, %s)' % (
+            ', '.join(unknown), ', '.join(OPENNESS_OPTIONS)))
+
+
+def _measureRun(frames, lock, ready, latest, closedFor, running, out_file, options):
+    #Measure the newest offered frame until `running` is cleared, then save the records; returns the
+    #run's summary:
+    partFile, npyFile = opennessFiles(out_file)
+    meter = OpennessMeter(**options)
+    lastSeq = -1
+    processed, longest = 0, 0.
+    with open(partFile, 'wb') as part:
+        while running.is_set() or latest[2] != lastSeq:
+            if not ready.wait(0.1):
+                continue
+            with lock:
+                ready.clear()
+                frame = frames.copy()
+                ts, seq = latest[1], int(latest[2])
+            if seq == lastSeq:
+                continue
+            lastSeq = seq
+            records = meter.measure(frame, ts, seq)
+            if records:
+                np.array(records, dtype=OPENNESS_DTYPE).tofile(part)
+                part.flush()
+            processed += 1
+            closedFor.value = meter.closedFor(ts)
+            longest = max(longest, closedFor.value)
+        records = meter.finish()
+        if records:
+            np.array(records, dtype=OPENNESS_DTYPE).tofile(part)
+    np.save(npyFile, np.fromfile(partFile, dtype=OPENNESS_DTYPE))
+    os.remove(partFile)
+    return {'frames_measured': processed, 'longest_closure_s': round(longest, 2),
+            'threshold': meter.threshold and float(meter.threshold), 'reference': meter.reference}
+
+
+def _opennessWorker(buf, shape, dtype, lock, ready, latest, closedFor, running, jobs, done, options):
+    #Worker process: for each run ((run id, output path) from `jobs`) put (run id, summary, error) on
+    #`done`; a failed run is reported and the worker waits for the next one. None ends it.
+    frames = np.frombuffer(buf, dtype=dtype).reshape(shape)
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        runId, out_file = job
+        try:
+            done.put((runId, _measureRun(frames, lock, ready, latest, closedFor, running, out_file, options),
+                      None))
+        except Exception:
+            done.put((runId, None, traceback.format_exc()))
+        closedFor.value = 0.
+
+
+class EyeMonitor(object):
+    ''' Session-scoped openness worker for frames of `shape`/`dtype`.
+
+    Set frameRing.onPut = monitor.offer so every captured frame is offered; startRun/endRun bracket
+    each run like AcquisitionEngine. warnings() returns the alert text while the eyes have been
+    closed for alert_s seconds or more. options are OpennessMeter's; unknown ones raise ValueError
+    here, before the worker is started.'''
+
+    def __init__(self, shape, dtype=np.uint8, alert_s=5., **options):
+        _checkOptions(options)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.alertS = alert_s
+        self._buf = RawArray(ctypes.c_uint8, int(np.prod(self.shape)) * self.dtype.itemsize)
+        self._frame = np.frombuffer(self._buf, dtype=self.dtype).reshape(self.shape)
+        self._lock = Lock()
+        self._ready = Event()
+        self._running = Event()
+        #(unused, ts, seq) of the frame in the shared slot:
+        self._latest = RawArray(ctypes.c_double, [0., 0., -1.])
+        self._closedFor = Value(ctypes.c_double, 0.)
+        self._jobs = Queue()
+        self._done = Queue()
+        self.offered, self.skipped = 0, 0
+        self._proc = Process(name='Openness', target=_opennessWorker,
+                             args=(self._buf, self.shape, self.dtype, self._lock, self._ready, self._latest,
+                                   self._closedFor, self._running, self._jobs, self._done,
+                                   dict(options, alert_s=alert_s)))
+        self._proc.daemon = True
+        self._proc.start()
+        self.out_file = None
+        #Numbers the runs, so a summary that arrives too late is not taken for the next run's:
+        self._runId = 0
+
+    def offer(self, frame, ts, seq):
+        #Capture side; never waits: the frame is skipped if the worker is copying the slot
+        if not self._running.is_set():
+            return
+        self.offered += 1
+        if not self._lock.acquire(False):
+            self.skipped += 1
+            return
+        try:
+            self._frame[...] = frame
+            self._latest[1] = ts
+            self._latest[2] = seq
+            self._ready.set()
+        finally:
+            self._lock.release()
+
+    def startRun(self, out_file):
+        self.offered, self.skipped = 0, 0
+        self._latest[2] = -1
+        self._runId += 1
+        self._running.set()
+        self._jobs.put((self._runId, out_file))
+        self.out_file = out_file
+
+    def endRun(self, timeout=10.):
+        # Stop measuring and wait for the run's records to be saved; returns the worker's summary.
+        # Raises IOError if the worker failed on this run, stopped, or did not finish in time.
+        if self.out_file is None:
+            return None
+        self._running.clear()
+        out_file, self.out_file = self.out_file, None
+        deadline = default_timer() + timeout
+        while True:
+            try:
+                runId, summary, error = self._done.get(timeout=min(0.5, max(deadline - default_timer(), 0.)))
+            except Empty:
+                if not self._proc.is_alive():
+                    raise IOError('Eye openness for %s: the worker process stopped' % out_file)
+                if default_timer() >= deadline:
+                    raise IOError('Eye openness for %s: no result within %g s' % (out_file, timeout))
+                continue
+            #(a late summary of an earlier run is dropped)
+            if runId == self._runId:
+                break
+        if error:
+            raise IOError('Eye openness for %s failed:\n%s' % (out_file, error))
+        return summary
+
+    def warnings(self):
+        closedFor = self._closedFor.value
+        if closedFor >= self.alertS:
+            return ['Eyes closed for %.0f s' % closedFor]
+        return []
+
+    def close(self):
+        try:
+            self.endRun()
+        finally:
+            self._jobs.put(None)
+            self._proc.join(5)
+
+
+def opennessOptions(config):
+    #EyeMonitor options from the optional `openness` section of siteConfig.yaml, or None unless
+    #enabled; raises ValueError for an unknown setting:
+    options = dict(config.get('openness', {}))
+    if options.pop('enabled', 'no') != 'yes':
+        return None
+    _checkOptions(options)
+    return options
+
+
+def eyeMonitorFromConfig(config, shape, dtype=np.uint8):
+    #EyeMonitor from the optional `openness` section of siteConfig.yaml, or None unless enabled:
+    options = opennessOptions(config)
+    if options is None:
+        return None
+    return EyeMonitor(shape, dtype, **options)
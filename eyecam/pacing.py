@@ -0,0 +1,229 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Frame pacing: make the video's time base follow the capture timestamps instead of assuming the
+grabber delivered exactly the nominal frame rate. Set with `encoder: {pacing: ...}` in siteConfig.yaml:
+
+    off   frames are written as they arrive and the file is stamped at the nominal rate (as before);
+          a grabber running at 27 or 33 fps makes the video drift from the scan
+    cfr   constant rate: video frame N shows the capture nearest N / fps seconds after the scanner
+          trigger. A capture whose grid slot is already filled is dropped (the grabber ran fast); when
+          slots were missed (it ran slow, or frames were dropped) the next capture is repeated to
+          fill them. Every correction is saved as <run>_pacing.npy:
+              frame    first video frame of the capture (or the frame it would have been)
+              seq      capture sequence number
+              ts       capture timestamp, seconds from the scanner trigger
+              copies   times the capture was written: 0 = dropped, 2 or more = repeated; 1 marks a
+                       first capture more than MAX_FIRST_S after the trigger (timestamps not taken
+                       from the trigger), where the grid is restarted instead of repeating it
+    vfr   variable rate: every capture is written once and the .mp4 is stamped with the real
+          timestamps (its sample durations are rewritten from the frame log once the file is
+          closed). Needs an .mp4 without B-frames (set automatically) and fragment_s: 0.
+
+The frame log (eyecam.framelog) has one record per video frame in every mode; with cfr a repeated
+capture appears as consecutive records with the same seq.
+***************************************************************************************************************
+"""
+import math
+import os
+import struct
+
+import numpy as np
+
+PACING_MODES = ('off', 'cfr', 'vfr')
+CORRECTION_DTYPE = np.dtype([('frame', '<u4'), ('seq', '<u4'), ('ts', '<f8'), ('copies', '<u4')])
+#A first capture later than this after the trigger starts the grid at itself:
+MAX_FIRST_S = 60.
+
+
+def pacingFile(out_file):
+    #Correction log path for the video out_file:
+    return os.path.splitext(out_file)[0] + '_pacing.npy'
+
+
+class Pacer(object):
+    ''' Constant-rate pacing against the grid 0, 1 / fps, 2 / fps, ... seconds from the trigger.
+    copies(seq, ts) is called for every capture, in order, and returns how many times to write it.
+    A first capture more than maxFirst seconds after the trigger is taken as a clock that was not
+    zeroed at the trigger: the grid starts at that capture instead of repeating it up to it.'''
+
+    def __init__(self, fps, capacity=1024, maxFirst=MAX_FIRST_S):
+        self.fps = float(fps)
+        self.maxFirst = maxFirst
+        #Time of grid slot 0, and video frames written so far (i.e. the next empty grid slot):
+        self.origin = 0.
+        self.frames = 0
+        self._first = True
+        self._records = np.zeros(capacity, dtype=CORRECTION_DTYPE)
+        self.count = 0
+
+    def _record(self, seq, ts, n):
+        if self.count == len(self._records):
+            self._records = np.concatenate([self._records, np.zeros_like(self._records)])
+        self._records[self.count] = (self.frames, seq, ts, n)
+        self.count += 1
+
+    def copies(self, seq, ts):
+        if self._first:
+            self._first = False
+            if ts > self.maxFirst:
+                self.origin = ts
+                self._record(seq, ts, 1)
+                self.frames = 1
+                return 1
+        #Empty grid slots up to and including the one nearest ts:
+        n = max(int(math.floor((ts - self.origin) * self.fps + 0.5)) + 1 - self.frames, 0)
+        if n != 1:
+            self._record(seq, ts, n)
+        self.frames += n
+        return n
+
+    def records(self):
+        return self._records[:self.count]
+
+    def save(self, out_file):
+        np.save(pacingFile(out_file), self.records())
+
+
+def pacingSummary(corrections):
+    #{'repeated': extra video frames, 'dropped': captures left out} for a correction log:
+    copies = np.asarray(corrections['copies'], dtype=int)
+    return {'repeated': int(np.sum(copies[copies > 1] - 1)), 'dropped': int(np.count_nonzero(copies == 0))}
+
+
+def pacedTimestamps(ts, fps):
+    #(capture timestamp of every video frame, Pacer) for captures ts written with cfr pacing:
+    pacer = Pacer(fps)
+    copies = [pacer.copies(seq, t) for seq, t in enumerate(ts)]
+    return np.repeat(np.asarray(ts, dtype=float), copies), pacer
+
+
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+#Variable frame rate: MP4 sample durations from timestamps
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+#Boxes on the way from moov to the sample tables:
+_CONTAINERS = (b'moov', b'trak', b'edts', b'mdia', b'minf', b'stbl')
+
+
+def _readBoxes(data):
+    #[type, payload or child list] for the boxes in data:
+    boxes, pos = [], 0
+    while pos + 8 <= len(data):
+        size, kind = struct.unpack('>I4s', data[pos:pos + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', data[pos + 8:pos + 16])[0]
+            header = 16
+        elif size == 0:
+            size = len(data) - pos
+        payload = data[pos + header:pos + size]
+        boxes.append([kind, _readBoxes(payload) if kind in _CONTAINERS else payload])
+        pos += size
+    return boxes
+
+
+def _writeBoxes(boxes):
+    parts = []
+    for kind, payload in boxes:
+        if isinstance(payload, list):
+            payload = _writeBoxes(payload)
+        parts.append(struct.pack('>I4s', len(payload) + 8, kind) + payload)
+    return b''.join(parts)
+
+
+def _find(boxes, kind):
+    return [box for box in boxes if box[0] == kind]
+
+
+def _setDuration(payload, offsets, duration):
+    #Rewrite the duration field of a full box (mvhd / tkhd / mdhd); offsets are (v0, v1) byte positions:
+    version = bytearray(payload[:1])[0]
+    pos = offsets[version == 1]
+    fmt = '>Q' if version == 1 else '>I'
+    return payload[:pos] + struct.pack(fmt, duration) + payload[pos + struct.calcsize(fmt):]
+
+
+def _timescale(payload):
+    #Timescale (ticks per second) of an mvhd / mdhd box:
+    return struct.unpack('>I', payload[20:24] if bytearray(payload[:1])[0] == 1 else payload[12:16])[0]
+
+
+def _topLevelBoxes(f):
+    #(offset, size, type) of the top-level boxes of the open file f:
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    boxes, pos = [], 0
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+        elif size == 0:
+            size = end - pos
+        if size < 8:
+            break
+        boxes.append((pos, size, kind))
+        pos += size
+    return boxes
+
+
+def retimeMp4(path, ts):
+    ''' Stamp the video track of the .mp4 at path with one timestamp per frame (seconds, increasing;
+    frame 0 plays at time 0). Sample durations are rewritten from the timestamp differences (the
+    last frame keeps the median one) and the track and movie durations updated. The moov box must
+    follow the media data (ffmpeg's default layout) and the track must have no B-frame reordering.'''
+    ts = np.asarray(ts, dtype=float)
+    with open(path, 'r+b') as f:
+        top = _topLevelBoxes(f)
+        moovs = [box for box in top if box[2] == b'moov']
+        if not moovs:
+            raise IOError('%s: no moov box (not an mp4, or written as fragments)' % path)
+        offset, size = moovs[0][:2]
+        #The rewritten moov grows, so it has to be the last box (chunk offsets stay valid):
+        if moovs[0] != top[-1]:
+            raise IOError('%s: moov box is not at the end of the file; cannot retime in place' % path)
+        f.seek(offset)
+        moov = _readBoxes(f.read(size))[0][1]
+        mvhd = _find(moov, b'mvhd')[0]
+        movieScale = _timescale(mvhd[1])
+        movieDuration = 0
+        for trak in _find(moov, b'trak'):
+            mdia = _find(trak[1], b'mdia')[0][1]
+            if b'vide' not in _find(mdia, b'hdlr')[0][1][:16]:
+                continue
+            mdhd = _find(mdia, b'mdhd')[0]
+            mediaScale = _timescale(mdhd[1])
+            stbl = _find(_find(mdia, b'minf')[0][1], b'stbl')[0][1]
+            if _find(stbl, b'ctts'):
+                raise IOError('%s: frames are reordered (B-frames); cannot retime' % path)
+            stts = _find(stbl, b'stts')[0]
+            entries = struct.unpack('>I', stts[1][4:8])[0]
+            counts = struct.unpack('>%dI' % (2 * entries), stts[1][8:8 + 8 * entries])[0::2]
+            if sum(counts) != len(ts):
+                raise IOError('%s has %d frames, %d timestamps given' % (path, sum(counts), len(ts)))
+            ticks = np.round((ts - ts[0]) * mediaScale).astype(np.int64)
+            deltas = np.maximum(np.diff(ticks), 1)
+            deltas = np.append(deltas, int(np.median(deltas)) if len(deltas) else int(round(mediaScale / 30.)))
+            #Run-length encoded (count, delta) entries:
+            starts = np.flatnonzero(np.diff(np.concatenate([[-1], deltas])) != 0)
+            runs = np.diff(np.append(starts, len(deltas)))
+            table = np.empty(2 * len(starts), dtype='>u4')
+            table[0::2], table[1::2] = runs, deltas[starts]
+            stts[1] = stts[1][:4] + struct.pack('>I', len(starts)) + table.tobytes()
+            mediaDuration = int(deltas.sum())
+            mdhd[1] = _setDuration(mdhd[1], (16, 24), mediaDuration)
+            trackDuration = int(round(mediaDuration * float(movieScale) / mediaScale))
+            trak[1] = [[kind, _setDuration(payload, (20, 28), trackDuration) if kind == b'tkhd' else payload]
+                       for kind, payload in trak[1]]
+            for edts in _find(trak[1], b'edts'):
+                elst = _find(edts[1], b'elst')[0]
+                if struct.unpack('>I', elst[1][4:8])[0] != 1:
+                    raise IOError('%s: edit list has more than one entry; cannot retime' % path)
+                #The single edit spans the whole track:
+                fmt = '>Q' if bytearray(elst[1][:1])[0] == 1 else '>I'
+                elst[1] = elst[1][:8] + struct.pack(fmt, trackDuration) + elst[1][8 + struct.calcsize(fmt):]
+            movieDuration = max(movieDuration, trackDuration)
+        mvhd[1] = _setDuration(mvhd[1], (16, 24), movieDuration)
+        f.seek(offset)
+        f.write(_writeBoxes([[b'moov', moov]]))
+        f.truncate()
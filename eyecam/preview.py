@@ -0,0 +1,51 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Throttled, downscaled RA preview. HighGUI draws are only issued at the configured refresh rate, so
+the recording loop can run at full frame rate while the RA View updates at 10-15 fps.
+***************************************************************************************************************
+"""
+from timeit import default_timer
+
+import cv2
+
+
+class Preview(object):
+    ''' Rate-limited cv2.imshow for the RA View window.
+
+    rate is the maximum number of draws per second (0 or None draws every frame); scale is the
+    downscale factor applied before drawing (1.0 draws at full size). overlay is a list of
+    (text, isWarning) lines drawn over the image (see eyecam.telemetry).'''
+
+    def __init__(self, windowName='RA View', rate=15, scale=1.0):
+        self.windowName = windowName
+        self.interval = 1. / rate if rate else 0.
+        self.scale = scale
+        self._nextDraw = 0.
+        self.overlay = []
+
+    def show(self, frame):
+        #Draw `frame` if the refresh interval has elapsed; returns whether it was drawn:
+        now = default_timer()
+        if now < self._nextDraw:
+            return False
+        self._nextDraw = now + self.interval
+        if self.scale != 1:
+            frame = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        if self.overlay:
+            #Never draw on the caller's frame (grayscale frames get colour for the warnings):
+            if frame.ndim == 2:
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+            elif self.scale == 1:
+                frame = frame.copy()
+            for i, (text, warn) in enumerate(self.overlay):
+                cv2.putText(frame, text, (4, 14 + 14 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.4,
+                            (0, 0, 255) if warn else (0, 255, 0), 1)
+        cv2.imshow(self.windowName, frame)
+        return True
+
+
+def previewFromConfig(config, windowName='RA View'):
+    #Build a Preview from the optional `preview` section of siteConfig.yaml:
+    previewConfig = config.get('preview', {})
+    return Preview(windowName, rate=previewConfig.get('rate', 15), scale=previewConfig.get('scale', 1.0))
@@ -0,0 +1,239 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Shared-memory frame ring used to hand frames from the capture loop to the video writer process.
+
+Frames are copied once into a preallocated slot; only the slot index, the timestamp and the frame's
+sequence number travel through a multiprocessing Queue, so nothing is pickled per frame. Free slots
+are kept in a shared-memory stack counted by a semaphore, so returning a slot never goes through a
+pipe (a queue of thousands of free-slot tokens can fill its pipe and keep the writer process from
+exiting). The ring is
+bounded (by slot count or a memory budget), so memory stays flat if the writer falls behind; what
+happens to a frame that arrives while every slot is taken is set by the overflow policy:
+    block        wait for the writer to free a slot (capture stalls)
+    drop_oldest  discard the oldest frame still waiting to be encoded and reuse its slot
+    spill        append the frame to a spill file on disk; the writer reads it back in order
+***************************************************************************************************************
+"""
+import ctypes
+from multiprocessing import Lock, Queue, RawArray, RawValue, Semaphore, Value
+import os
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+import numpy as np
+
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'spill')
+#Most slots ringFromConfig sizes a ring to (a few seconds more of frames buy nothing, and some
+#platforms cap semaphore counts):
+MAX_SLOTS = 512
+#How often a put blocked on a full ring checks that the writer is still there:
+CLAIM_POLL_S = 0.5
+
+
+class FrameRing(object):
+    ''' Preallocated ring of fixed-shape frame slots in shared memory.
+
+    Must be created before the writer Process is started and passed to it as an argument so the
+    shared buffer is inherited by the child. shape is the shape of a single (already cropped) frame.
+    spillPath is required for the 'spill' policy. onDrop(seq, ts), if set, is called on the capture
+    side for every frame discarded by the 'drop_oldest' policy; onPut(frame, ts, seq), if set, for
+    every frame put (it must not block). writerAlive(), if set, is checked while a 'block' put waits
+    for a slot; the put raises IOError once it returns False, since the slot would never come.'''
+
+    def __init__(self, shape, dtype=np.uint8, nSlots=60, overflow='block', spillPath=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy "%s" (use %s)' % (overflow, ', '.join(OVERFLOW_POLICIES)))
+        if overflow == 'spill' and not spillPath:
+            raise ValueError('The spill overflow policy needs a spillPath')
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.nSlots = max(int(nSlots), 2)
+        self.frameBytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.overflow = overflow
+        self.spillPath = spillPath
+        self.onDrop = None
+        self.onPut = None
+        self.writerAlive = None
+        self._buf = RawArray(ctypes.c_uint8, self.frameBytes * self.nSlots)
+        #Slots the capture side may write into (stack of slot indices, counted by the semaphore) /
+        #slots waiting for the writer (FIFO):
+        self._freeSlots = RawArray(ctypes.c_int, list(range(self.nSlots)))
+        self._freeTop = RawValue(ctypes.c_int, self.nSlots)
+        self._freeLock = Lock()
+        self._freeCount = Semaphore(self.nSlots)
+        self._filled = Queue()
+        #Frames put but not yet released by the writer (Queue.qsize is not available on OS X):
+        self._depth = Value(ctypes.c_int, 0)
+        #Timestamp of the last frame the writer finished with (for writer lag):
+        self._writtenTs = RawValue(ctypes.c_double, float('nan'))
+        self._slots = None
+        #Capture-side bookkeeping:
+        self.seq = 0
+        self.drops = []
+        self.spilled = 0
+        self._spillWriter = None
+        self._spillReader = None
+
+    def __getstate__(self):
+        #numpy views and spill file handles are rebuilt on first use in the child process:
+        state = self.__dict__.copy()
+        state['_slots'] = None
+        state['_spillWriter'] = None
+        state['_spillReader'] = None
+        state['onDrop'] = None
+        state['onPut'] = None
+        state['writerAlive'] = None
+        return state
+
+    def _view(self):
+        if self._slots is None:
+            self._slots = np.frombuffer(self._buf, dtype=self.dtype).reshape(
+                (self.nSlots,) + self.shape)
+        return self._slots
+
+    def _takeFree(self, block=True, timeout=None):
+        #Pop a free slot; None if there is none (block False) or none came within timeout:
+        if not self._freeCount.acquire(block, timeout):
+            return None
+        with self._freeLock:
+            self._freeTop.value -= 1
+            return self._freeSlots[self._freeTop.value]
+
+    def _putFree(self, slot):
+        with self._freeLock:
+            self._freeSlots[self._freeTop.value] = slot
+            self._freeTop.value += 1
+        self._freeCount.release()
+
+    def _claimSlot(self):
+        #Returns a free slot, or None if the frame should be spilled, following the overflow policy:
+        if self.overflow == 'block':
+            if self.writerAlive is None:
+                return self._takeFree()
+            slot = self._takeFree(timeout=CLAIM_POLL_S)
+            while slot is None:
+                if not self.writerAlive():
+                    raise IOError('the writer process stopped; no frame ring slot will be freed')
+                slot = self._takeFree(timeout=CLAIM_POLL_S)
+            return slot
+        while True:
+            slot = self._takeFree(block=False)
+            if slot is not None:
+                return slot
+            if self.overflow == 'spill':
+                return None
+            #drop_oldest: take the oldest queued frame away from the writer and reuse its slot
+            try:
+                slot, ts, seq = self._filled.get(timeout=0.005)
+            except Empty:
+                continue
+            if slot < 0:
+                #Spilled frames don't hold a slot; account for it and keep looking
+                self._release(slot)
+                self._recordDrop(seq, ts)
+                continue
+            self._release(slot, reuse=True)
+            self._recordDrop(seq, ts)
+            return slot
+
+    def _recordDrop(self, seq, ts):
+        self.drops.append(seq)
+        if self.onDrop is not None:
+            self.onDrop(seq, ts)
+
+    def _spill(self, frame):
+        #Append frame to the spill file; returns the (negative) token standing in for a slot:
+        if self._spillWriter is None:
+            self._spillWriter = open(self.spillPath, 'wb')
+        np.ascontiguousarray(frame, dtype=self.dtype).tofile(self._spillWriter)
+        self._spillWriter.flush()
+        self.spilled += 1
+        return -self.spilled
+
+    def put(self, frame, ts):
+        #Queue frame (copied into a slot or spilled) with its timestamp; returns its sequence number:
+        seq = self.seq
+        self.seq += 1
+        slot = self._claimSlot()
+        if slot is None:
+            slot = self._spill(frame)
+        else:
+            self._view()[slot][...] = frame
+        with self._depth.get_lock():
+            self._depth.value += 1
+        self._filled.put((slot, ts, seq))
+        if self.onPut is not None:
+            self.onPut(frame, ts, seq)
+        return seq
+
+    def get(self, timeout=None):
+        #Next (slot, timestamp, sequence number) in capture order:
+        return self._filled.get(timeout=timeout)
+
+    def frame(self, slot):
+        #Zero-copy view of a slot (valid until the slot is released), or a spilled frame read back:
+        if slot >= 0:
+            return self._view()[slot]
+        if self._spillReader is None:
+            self._spillReader = open(self.spillPath, 'rb')
+        self._spillReader.seek((-slot - 1) * self.frameBytes)
+        return np.fromfile(self._spillReader, dtype=self.dtype,
+                           count=self.frameBytes // self.dtype.itemsize).reshape(self.shape)
+
+    def _release(self, slot, reuse=False):
+        with self._depth.get_lock():
+            self._depth.value -= 1
+        if slot >= 0 and not reuse:
+            self._putFree(slot)
+
+    def release(self, slot, ts=None):
+        #Writer side, once the frame is written; ts is the frame's timestamp:
+        if ts is not None:
+            self._writtenTs.value = ts
+        self._release(slot)
+
+    def writtenTs(self):
+        #Timestamp of the frame most recently written, or None before the first:
+        ts = self._writtenTs.value
+        return None if ts != ts else ts
+
+    def newRun(self):
+        #Capture side, before the first put of a run when the ring is reused across runs (the writer
+        #has drained the previous run): restart sequence numbers and drop/spill bookkeeping
+        self.close()
+        self.seq = 0
+        self.drops = []
+        self.spilled = 0
+
+    def endRun(self):
+        #Writer side, once a run is drained: the next run starts a new spill file
+        if self._spillReader is not None:
+            self._spillReader.close()
+            self._spillReader = None
+
+    def depth(self):
+        #Number of frames queued or being encoded:
+        return self._depth.value
+
+    def close(self):
+        #Capture side, once the writer has finished: remove the spill file
+        if self._spillWriter is not None:
+            self._spillWriter.close()
+            self._spillWriter = None
+        if self.spillPath and os.path.exists(self.spillPath):
+            os.remove(self.spillPath)
+
+
+def ringFromConfig(config, shape, dtype=np.uint8, spillPath=None):
+    #Build a FrameRing from the optional `capture` section of siteConfig.yaml. The slot count is
+    #ring_slots if given, otherwise as many frames as fit in ring_mb megabytes, at most MAX_SLOTS:
+    captureConfig = config.get('capture', {})
+    if 'ring_slots' in captureConfig:
+        nSlots = captureConfig['ring_slots']
+    else:
+        frameBytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        nSlots = min(int(captureConfig.get('ring_mb', 256) * 1048576 // frameBytes), MAX_SLOTS)
+    return FrameRing(shape, dtype=dtype, nSlots=nSlots, overflow=captureConfig.get('overflow', 'block'),
+                     spillPath=spillPath)
@@ -0,0 +1,221 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Per-session container: one directory (<data>/<scan>_<sessionID>_session) holding every run's design
+events, frame timestamps and diagnostics as columns, instead of a handful of small files per run.
+
+    session.json        session info (expInfo, git revision), the design condition names and one
+                        entry per run: run number, date, video, trigger wall time, row ranges into
+                        each table and the run's diagnostics (frame timing, eye openness)
+    events/<column>.npy run, onset, duration, condition (index into the condition names)
+    frames/<column>.npy run, seq, ts             one row per captured frame
+    drops/<column>.npy  run, seq                 frames dropped by the writer ring
+
+`run` is the row's index into session.json's runs. Columns are ordinary .npy files whose header is
+rewritten as rows are appended (events when they happen, frames about once a second), so they can
+be memory-mapped at any time, also while a run is being recorded, and a session that is run again
+(e.g. after the scanner stopped) appends to the same container. Rows of a table are in run order;
+the row ranges in session.json are filled in when a run ends, so the rows of an interrupted run are
+found through the `run` column.
+
+    session = loadSession('data/REST_X_session')
+    frames = session['frames']
+    run = session['runs'][0]
+    ts = frames['ts'][run['frames'][0]:run['frames'][1]]
+
+A summary of a container is printed by:
+    python -m eyecam.session data/REST_X_session
+***************************************************************************************************************
+"""
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+TABLES = {'events': [('run', '<u2'), ('onset', '<f8'), ('duration', '<f8'), ('condition', '<u1')],
+          'frames': [('run', '<u2'), ('seq', '<u4'), ('ts', '<f8')],
+          'drops': [('run', '<u2'), ('seq', '<u4')]}
+#Fixed .npy header size, so the shape can be rewritten in place:
+HEADER_BYTES = 128
+
+
+def sessionPath(filebase):
+    return filebase + '_session'
+
+
+class _Column(object):
+    ''' Appendable 1-D .npy file.'''
+
+    def __init__(self, path, dtype):
+        self.dtype = np.dtype(dtype)
+        if os.path.exists(path):
+            self._f = open(path, 'r+b')
+            np.lib.format.read_magic(self._f)
+            shape = np.lib.format.read_array_header_1_0(self._f)[0]
+            if self._f.tell() != HEADER_BYTES:
+                raise IOError('%s was not written by eyecam.session' % path)
+            self.count = shape[0]
+        else:
+            self._f = open(path, 'w+b')
+            self.count = 0
+        self.flush()
+
+    def _header(self):
+        header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (self.dtype.str, self.count)
+        header = header.ljust(HEADER_BYTES - 11) + '\n'
+        return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+    def append(self, values):
+        values = np.ascontiguousarray(values, dtype=self.dtype).ravel()
+        self._f.seek(HEADER_BYTES + self.count * self.dtype.itemsize)
+        self._f.write(values.tobytes())
+        self.count += len(values)
+
+    def truncate(self, count):
+        self.count = count
+        self._f.truncate(HEADER_BYTES + count * self.dtype.itemsize)
+
+    def flush(self):
+        #Rows past the header's count (an interrupted append) are cut off, then the count is written:
+        self._f.truncate(HEADER_BYTES + self.count * self.dtype.itemsize)
+        self._f.seek(0)
+        self._f.write(self._header())
+        self._f.flush()
+
+    def close(self):
+        self.flush()
+        self._f.close()
+
+
+class _Table(object):
+    ''' Columns of equal length in one directory.'''
+
+    def __init__(self, directory, columns):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.columns = [(name, _Column(os.path.join(directory, name + '.npy'), dtype)) for name, dtype in columns]
+        #Columns of a crashed append can differ in length; keep the rows every column has:
+        self.count = min(column.count for name, column in self.columns)
+        for name, column in self.columns:
+            if column.count != self.count:
+                column.truncate(self.count)
+                column.flush()
+
+    def append(self, **values):
+        n = max(len(np.atleast_1d(value)) for value in values.values())
+        for name, column in self.columns:
+            #(a single value fills the column for every row)
+            column.append(np.resize(np.asarray(values[name], dtype=column.dtype), n))
+        self.count += n
+
+    def flush(self):
+        for name, column in self.columns:
+            column.flush()
+
+    def close(self):
+        for name, column in self.columns:
+            column.close()
+
+
+class SessionStore(object):
+    ''' Writer for a session container at `path` (created, or appended to if it exists). info (e.g.
+    expInfo and the git revision) is stored in session.json.'''
+
+    def __init__(self, path, info=None):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._metaFile = os.path.join(path, 'session.json')
+        if os.path.exists(self._metaFile):
+            with open(self._metaFile) as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {'info': {}, 'conditions': [], 'runs': []}
+        self.meta['info'].update(info or {})
+        self.tables = dict((name, _Table(os.path.join(path, name), columns)) for name, columns in TABLES.items())
+        self.run = None
+        self._saveMeta()
+
+    def _saveMeta(self):
+        tmpFile = self._metaFile + '.tmp'
+        with open(tmpFile, 'w') as f:
+            json.dump(self.meta, f, indent=1, sort_keys=True)
+        if os.path.exists(self._metaFile):
+            os.remove(self._metaFile)
+        os.rename(tmpFile, self._metaFile)
+
+    def startRun(self, number, **info):
+        #Rows appended from now on belong to run `number`; info goes into its session.json entry:
+        entry = dict(info, run=number)
+        for name, table in self.tables.items():
+            entry[name] = [table.count, table.count]
+        self.meta['runs'].append(entry)
+        self.run = len(self.meta['runs']) - 1
+        self._saveMeta()
+        return self.run
+
+    def event(self, condition, onset, duration=0):
+        if condition not in self.meta['conditions']:
+            self.meta['conditions'].append(condition)
+            self._saveMeta()
+        table = self.tables['events']
+        table.append(run=self.run, onset=onset, duration=duration,
+                     condition=self.meta['conditions'].index(condition))
+        table.flush()
+
+    def frames(self, ts, firstSeq):
+        #Timestamps of frames firstSeq, firstSeq + 1, ... of the current run:
+        if len(ts):
+            self.tables['frames'].append(run=self.run, seq=np.arange(firstSeq, firstSeq + len(ts)), ts=ts)
+            self.tables['frames'].flush()
+
+    def drops(self, seqs):
+        if len(seqs):
+            self.tables['drops'].append(run=self.run, seq=seqs)
+            self.tables['drops'].flush()
+
+    def endRun(self, **diagnostics):
+        #Close the run's row ranges and store its diagnostics (JSON-serialisable values):
+        entry = self.meta['runs'][self.run]
+        for name, table in self.tables.items():
+            entry[name][1] = table.count
+        entry.update(diagnostics)
+        self._saveMeta()
+        self.run = None
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+
+
+def loadSession(path, mmap=True):
+    #session.json contents plus {table: {column: array}} (memory-mapped unless mmap is False):
+    with open(os.path.join(path, 'session.json')) as f:
+        session = json.load(f)
+    for name, columns in TABLES.items():
+        session[name] = dict((column, np.load(os.path.join(path, name, column + '.npy'),
+                                              mmap_mode='r' if mmap else None))
+                             for column, dtype in columns)
+    return session
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        sys.stderr.write('usage: python -m eyecam.session <session directory>\n')
+        return 2
+    session = loadSession(argv[0])
+    print('%s: %d runs, %d events, %d frames, %d drops' % (
+        argv[0], len(session['runs']), len(session['events']['run']), len(session['frames']['run']),
+        len(session['drops']['run'])))
+    for entry in session['runs']:
+        print('run %s %s: %d frames, %d events' % (entry['run'], entry.get('date', ''),
+                                                 entry['frames'][1] - entry['frames'][0],
+                                                 entry['events'][1] - entry['events'][0]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
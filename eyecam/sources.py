@@ -0,0 +1,290 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Frame sources. Every source exposes the subset of the cv2.VideoCapture interface the scripts use
+(read, grab, retrieve, set, get, isOpened, release), so the capture loop does not care whether frames
+come from the frame grabber, a synthetic generator or a recorded run.
+
+Selected with the optional `source` section of siteConfig.yaml:
+    source: {type: camera}                                    (default; live frame grabber/webcam)
+    source: {type: camera, device: 2}                         (a given device instead of dualCam's)
+    source: {type: synthetic, width: 1920, height: 1080, fps: 30}   (fps: a fixed rate; without it
+                                                              the recording's frame rate is used)
+    source: {type: replay, path: data/REST_X_run1_DATE.mp4, loop: 'yes'}
+
+CompactSource wraps any source so frames come out as the aperture crop in contiguous single-channel
+grayscale (capture: {color: gray}); capture: {device_size: [w, h]} asks the device for a smaller
+frame size where the backend supports it.
+***************************************************************************************************************
+"""
+from abc import ABCMeta, abstractmethod
+import os
+import time
+from timeit import default_timer
+
+import cv2
+import numpy as np
+
+from eyecam.framelog import frameLogFile, loadFrameLog
+
+
+def _capProp(name):
+    #OpenCV 3+ names the property constants cv2.CAP_PROP_*, OpenCV 2.4 uses cv2.cv.CV_CAP_PROP_*:
+    try:
+        return getattr(cv2, 'CAP_PROP_' + name)
+    except AttributeError:
+        return getattr(cv2.cv, 'CV_CAP_PROP_' + name)
+
+
+PROP_FPS = _capProp('FPS')
+PROP_WIDTH = _capProp('FRAME_WIDTH')
+PROP_HEIGHT = _capProp('FRAME_HEIGHT')
+
+
+#Abstract base class that works on Python 2 and 3 (no metaclass syntax is common to both):
+_Abstract = ABCMeta('_Abstract', (object,), {})
+
+
+class _PacedSource(_Abstract):
+    ''' Base for sources that deliver frames on a schedule: grab() blocks until the next frame is
+    due, like a real device would. Subclasses say when each frame is due and produce it.'''
+
+    def __init__(self):
+        self._start = None
+        self._index = 0
+        self._opened = True
+
+    @abstractmethod
+    def _due(self, index):
+        #Seconds after the first grab at which frame `index` is delivered
+        pass
+
+    @abstractmethod
+    def _next(self):
+        #Advance to the next frame; returns False when the source is exhausted
+        pass
+
+    @abstractmethod
+    def _frame(self):
+        #The current frame
+        pass
+
+    def grab(self):
+        if not self._opened:
+            return False
+        if self._start is None:
+            self._start = default_timer()
+        wait = self._start + self._due(self._index) - default_timer()
+        if wait > 0:
+            time.sleep(wait)
+        if not self._next():
+            return False
+        self._index += 1
+        return True
+
+    def retrieve(self):
+        return True, self._frame()
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def isOpened(self):
+        return self._opened
+
+    def release(self):
+        self._opened = False
+
+
+class SyntheticSource(_PacedSource):
+    ''' Generates frames of a configurable size at a fixed rate.
+
+    The image is a gradient with a dark disk drifting across it, shifted every frame, so the encoder
+    sees realistic motion rather than a static or pure-noise image. With fixedRate, set(PROP_FPS)
+    is refused (as by a device with a fixed rate), so a source configured to run slow or fast keeps
+    its rate whatever the recording asks for.'''
+
+    def __init__(self, width=640, height=480, fps=30, channels=3, fixedRate=False):
+        _PacedSource.__init__(self)
+        self.fps = float(fps)
+        self.fixedRate = fixedRate
+        self.channels = channels
+        self._makeBase(width, height)
+
+    def _makeBase(self, width, height):
+        self.width, self.height = int(width), int(height)
+        yy, xx = np.mgrid[0:self.height, 0:self.width]
+        base = (96 + 64 * xx / max(self.width - 1, 1) + 32 * yy / max(self.height - 1, 1)).astype(np.uint8)
+        radius = max(min(self.width, self.height) // 8, 1)
+        disk = (yy - self.height // 2) ** 2 + (xx - self.width // 2) ** 2 < radius ** 2
+        base[disk] = 16
+        if self.channels > 1:
+            base = np.repeat(base[:, :, None], self.channels, axis=2)
+        self._base = base
+        self._current = base
+
+    def _due(self, index):
+        return index / self.fps
+
+    def grab(self):
+        #Like a live device, frames that fell due while nobody was grabbing are skipped, not queued:
+        if self._start is not None:
+            behind = int((default_timer() - self._start) * self.fps) - self._index
+            if behind > 0:
+                self._index += behind
+        return _PacedSource.grab(self)
+
+    def _next(self):
+        self._current = np.roll(self._base, (self._index * 3) % self.width, axis=1)
+        return True
+
+    def _frame(self):
+        return self._current
+
+    def set(self, propId, value):
+        if propId == PROP_FPS:
+            if self.fixedRate:
+                return False
+            self.fps = float(value)
+        elif propId == PROP_WIDTH:
+            self._makeBase(value, self.height)
+        elif propId == PROP_HEIGHT:
+            self._makeBase(self.width, value)
+        else:
+            return False
+        return True
+
+    def get(self, propId):
+        return {PROP_FPS: self.fps, PROP_WIDTH: self.width, PROP_HEIGHT: self.height}.get(propId, 0)
+
+
+class ReplaySource(_PacedSource):
+    ''' Plays back a recorded run at its original timing.
+
+    Frames are decoded from `path` and delivered at the offsets in the run's frame log
+    (`<run>_frames.npy`) or timestamp file (`<run>_ts.csv`) next to the video, unless tsFile is
+    given. Without either the container's frame rate is used. With loop=True the recording restarts
+    when it runs out.'''
+
+    def __init__(self, path, tsFile=None, loop=False):
+        _PacedSource.__init__(self)
+        self.path = path
+        self.loop = loop
+        self._video = cv2.VideoCapture(path)
+        if not self._video.isOpened():
+            raise IOError('Could not open replay video "%s"' % path)
+        if tsFile is None:
+            tsFile = frameLogFile(path)
+            if not os.path.exists(tsFile):
+                tsFile = os.path.splitext(path)[0] + '_ts.csv'
+        if os.path.exists(tsFile):
+            if tsFile.endswith('.npy'):
+                ts = np.asarray(loadFrameLog(tsFile)['ts'])
+            else:
+                ts = np.atleast_1d(np.loadtxt(tsFile, delimiter=','))
+            self._offsets = ts - ts[0]
+        else:
+            fps = self._video.get(PROP_FPS) or 30.
+            self._offsets = None
+            self._period = 1. / fps
+        self._loopOffset = 0.
+        self._frameNumber = 0
+
+    def _due(self, index):
+        if self._offsets is None:
+            return index * self._period
+        #Keep the original timing across loops:
+        return self._loopOffset + self._offsets[min(self._frameNumber, len(self._offsets) - 1)]
+
+    def _next(self):
+        if self._offsets is not None and self._frameNumber >= len(self._offsets):
+            ok = False
+        else:
+            ok = self._video.grab()
+        if not ok and self.loop and self._frameNumber > 0:
+            if self._offsets is not None:
+                self._loopOffset += self._offsets[-1] + np.median(np.diff(self._offsets))
+            self._video.release()
+            self._video = cv2.VideoCapture(self.path)
+            self._frameNumber = 0
+            ok = self._video.grab()
+        if ok:
+            self._frameNumber += 1
+        return ok
+
+    def _frame(self):
+        return self._video.retrieve()[1]
+
+    def set(self, propId, value):
+        #Playback rate is fixed by the recording:
+        return False
+
+    def get(self, propId):
+        return self._video.get(propId)
+
+    def release(self):
+        _PacedSource.release(self)
+        self._video.release()
+
+
+class CompactSource(object):
+    ''' Wraps a source so read()/retrieve() return the aperture crop ([top bottom left right] or None)
+    as one contiguous single-channel (grayscale) frame. The conversion happens once, at capture, so
+    the ring, encoder and preview all carry a third of the bytes of BGR frames. Everything else is
+    passed through to the wrapped source.'''
+
+    def __init__(self, cap, aperture=None):
+        self.cap = cap
+        self.aperture = aperture
+
+    def compact(self, frame):
+        if self.aperture:
+            frame = frame[self.aperture[0]:self.aperture[1], self.aperture[2]:self.aperture[3]]
+        if frame.ndim == 3:
+            return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return np.ascontiguousarray(frame)
+
+    def grab(self):
+        return self.cap.grab()
+
+    def retrieve(self):
+        ret, frame = self.cap.retrieve()
+        if not ret:
+            return ret, frame
+        return ret, self.compact(frame)
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def __getattr__(self, name):
+        return getattr(self.cap, name)
+
+
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+#Open the frame source selected in siteConfig.yaml
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+def openSource(config, eyeCam=0):
+    sourceConfig = config.get('source', {})
+    sourceType = sourceConfig.get('type', 'camera')
+    if sourceType == 'camera':
+        cap = cv2.VideoCapture(sourceConfig.get('device', eyeCam))
+    elif sourceType == 'synthetic':
+        cap = SyntheticSource(width=sourceConfig.get('width', 640),
+                              height=sourceConfig.get('height', 480),
+                              fps=sourceConfig.get('fps', 30),
+                              channels=sourceConfig.get('channels', 3),
+                              fixedRate='fps' in sourceConfig)
+    elif sourceType == 'replay':
+        cap = ReplaySource(sourceConfig['path'], tsFile=sourceConfig.get('ts_file'),
+                           loop=sourceConfig.get('loop', 'no') == 'yes')
+    else:
+        raise ValueError('Unknown frame source type "%s" (use camera, synthetic or replay)' % sourceType)
+    #Smaller device frames where the backend allows it (the aperture is in these coordinates):
+    deviceSize = config.get('capture', {}).get('device_size')
+    if deviceSize:
+        cap.set(PROP_WIDTH, deviceSize[0])
+        cap.set(PROP_HEIGHT, deviceSize[1])
+    return cap
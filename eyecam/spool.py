@@ -0,0 +1,213 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Raw spool recording with deferred transcoding.
+
+With `encoder: {mode: spool}` the writer process does no encoding during the scan: it appends raw
+frames to a preallocated memory-mapped spool file next to the video, with a binary frame index
+(sequence number and timestamp per frame) and a small JSON description. transcodeSpool later encodes
+the spool into the run's .mp4 with the configured encoder settings, checks the frame count and only
+then deletes the spool. This trades disk space (frame bytes x frames) for near-zero CPU use during
+acquisition. The spool keeps every captured frame; encoder pacing (eyecam.pacing) is applied when it
+is transcoded.
+
+Pending spools can be transcoded by hand with:
+    python -m eyecam.spool data
+***************************************************************************************************************
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+import numpy as np
+
+from eyecam.framelog import FrameLog, frameLogFile
+from eyecam.pacing import Pacer, retimeMp4
+
+INDEX_DTYPE = np.dtype([('seq', '<i8'), ('ts', '<f8')])
+#Spool capacity is grown by this many seconds of frames when a run outlasts the preallocation:
+GROW_SECONDS = 60
+
+
+def spoolFiles(out_file):
+    #(raw frames, frame index, description) paths for the video out_file:
+    base = os.path.splitext(out_file)[0]
+    return base + '.spool', base + '.spool.idx', base + '.spool.json'
+
+
+class _Spool(object):
+    ''' Memory-mapped raw frame file plus index, growable in place.'''
+
+    def __init__(self, out_file, shape, dtype, capacity):
+        self.rawFile, self.indexFile, self.metaFile = spoolFiles(out_file)
+        self.shape, self.dtype = tuple(shape), np.dtype(dtype)
+        self.frameBytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.count = 0
+        self.capacity = 0
+        self._grow(max(int(capacity), 1))
+
+    def _grow(self, capacity):
+        #(Re)map both files at the new capacity; existing frames are kept:
+        self.frames, self.index = None, None
+        for path, recordBytes in ((self.rawFile, self.frameBytes), (self.indexFile, INDEX_DTYPE.itemsize)):
+            with open(path, 'ab') as f:
+                f.truncate(capacity * recordBytes)
+        self.frames = np.memmap(self.rawFile, dtype=self.dtype, mode='r+', shape=(capacity,) + self.shape)
+        self.index = np.memmap(self.indexFile, dtype=INDEX_DTYPE, mode='r+', shape=(capacity,))
+        #Unused index records are marked so a crashed run's frame count can be recovered:
+        self.index['seq'][self.capacity:] = -1
+        self.capacity = capacity
+
+    def append(self, frame, seq, ts):
+        if self.count == self.capacity:
+            self._grow(self.capacity * 2)
+        self.frames[self.count] = frame
+        self.index[self.count] = (seq, ts)
+        self.count += 1
+
+    def close(self):
+        #Flush and trim the files to the frames actually recorded:
+        self.frames.flush()
+        self.index.flush()
+        self.frames, self.index = None, None
+        for path, recordBytes in ((self.rawFile, self.frameBytes), (self.indexFile, INDEX_DTYPE.itemsize)):
+            with open(path, 'ab') as f:
+                f.truncate(self.count * recordBytes)
+
+
+def _writeMeta(spool, out_file, fps, writerKwargs, complete, pacing='off'):
+    meta = {'out_file': os.path.basename(out_file), 'shape': list(spool.shape), 'dtype': spool.dtype.str,
+            'fps': fps, 'writer_kwargs': writerKwargs or {}, 'frames': spool.count, 'complete': complete,
+            'pacing': pacing}
+    with open(spool.metaFile, 'w') as f:
+        json.dump(meta, f)
+
+
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+#Spool writing function
+#Runs in the writer process in place of writeVid's encoder loop
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+def spoolVid(frame_ring, quit_flag, out_file, fps=30, writerKwargs=None, stats=None, capacity=0, pacing='off'):
+    #capacity is the number of frames to preallocate (from the run duration); writerKwargs and
+    #pacing are stored for the transcode step. Drains like writeVid once quit_flag is set.
+    from timeit import default_timer
+    spool = _Spool(out_file, frame_ring.shape, frame_ring.dtype, capacity or GROW_SECONDS * fps)
+    _writeMeta(spool, out_file, fps, writerKwargs, complete=False, pacing=pacing)
+    #Spool order is the order frames will have in the transcoded video (without cfr pacing):
+    frameLog = FrameLog()
+    while True:
+        try:
+            slot, ts, seq = frame_ring.get(timeout=0.1)
+        except Empty:
+            if quit_flag.value and frame_ring.depth() == 0:
+                break
+            continue
+        dequeued = default_timer()
+        spool.append(frame_ring.frame(slot), seq, ts)
+        frame_ring.release(slot, ts)
+        frameLog.add(seq, ts)
+        if stats is not None:
+            stats.record(seq, ts, dequeued, default_timer())
+    spool.close()
+    _writeMeta(spool, out_file, fps, writerKwargs, complete=True, pacing=pacing)
+    frameLog.save(frameLogFile(out_file))
+    if stats is not None:
+        stats.finish()
+
+
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+#Deferred transcoding
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+def videoFrameCount(path):
+    import cv2
+    try:
+        prop = cv2.CAP_PROP_FRAME_COUNT
+    except AttributeError:
+        prop = cv2.cv.CV_CAP_PROP_FRAME_COUNT
+    cap = cv2.VideoCapture(path)
+    count = int(cap.get(prop))
+    cap.release()
+    return count
+
+
+def transcodeSpool(metaFile, remove=True):
+    # Encode the spool described by metaFile (<run>.spool.json) into its .mp4, verify the frame
+    # count and delete the spool files. Returns the video path.
+    import imageio
+    with open(metaFile) as f:
+        meta = json.load(f)
+    directory = os.path.dirname(os.path.abspath(metaFile))
+    out_file = os.path.join(directory, meta['out_file'])
+    rawFile, indexFile, metaFile = spoolFiles(out_file)
+    shape, dtype = tuple(meta['shape']), np.dtype(meta['dtype'])
+    nFrames = meta['frames']
+    pacing = meta.get('pacing', 'off')
+    index = np.fromfile(indexFile, dtype=INDEX_DTYPE)
+    if not meta['complete']:
+        #Writer did not finish (crash or kill): count the frames that reached the index
+        nFrames = int(np.count_nonzero(index['seq'] >= 0))
+    index = index[:nFrames]
+    #Times each spooled frame goes into the video (cfr pacing repeats or drops some):
+    pacer = Pacer(meta['fps']) if pacing == 'cfr' else None
+    copies = [pacer.copies(seq, ts) for seq, ts in index] if pacer is not None else [1] * nFrames
+    if not meta['complete'] or pacer is not None:
+        #Rebuild the frame log (the writer never saved one, or it lists the spool's frames):
+        frameLog = FrameLog()
+        for (seq, ts), n in zip(index, copies):
+            for copy in range(n):
+                frameLog.add(seq, ts)
+        frameLog.save(frameLogFile(out_file))
+    if pacer is not None:
+        pacer.save(out_file)
+    frames = np.memmap(rawFile, dtype=dtype, mode='r', shape=(nFrames,) + shape) if nFrames else []
+    out = imageio.get_writer(out_file, fps=meta['fps'], **meta['writer_kwargs'])
+    for frame, n in zip(frames, copies):
+        for copy in range(n):
+            out.append_data(np.asarray(frame))
+    out.close()
+    frames = None
+    written = videoFrameCount(out_file)
+    if written != sum(copies):
+        raise IOError('Transcoded %s has %d frames, expected %d; spool kept' % (out_file, written, sum(copies)))
+    if pacing == 'vfr' and nFrames:
+        retimeMp4(out_file, index['ts'])
+    if remove:
+        for path in (rawFile, indexFile, metaFile):
+            os.remove(path)
+    return out_file
+
+
+def findSpools(paths):
+    #Spool descriptions in the given directories / .spool.json files:
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found += sorted(glob.glob(os.path.join(path, '*.spool.json')))
+        else:
+            found.append(path)
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Transcode EyeCam raw spools into .mp4 videos')
+    parser.add_argument('paths', nargs='+', help='data directories or .spool.json files')
+    parser.add_argument('--keep', action='store_true', help='keep the spool files after transcoding')
+    args = parser.parse_args(argv)
+    failed = 0
+    for metaFile in findSpools(args.paths):
+        try:
+            print('Wrote %s' % transcodeSpool(metaFile, remove=not args.keep))
+        except (IOError, OSError, ValueError) as err:
+            failed += 1
+            sys.stderr.write('%s: %s\n' % (metaFile, err))
+    return failed
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,41 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Startup timing for the task scripts. Run a script with --import-times (or EYECAM_IMPORT_TIMES=1 in the
+environment) to print how long each startup stage takes and the time until the session dialog is
+shown, e.g.
+    python EyeCam_Scan.py --import-times
+***************************************************************************************************************
+"""
+import os
+import sys
+from timeit import default_timer
+
+
+def importTimesRequested(argv=None):
+    argv = sys.argv if argv is None else argv
+    return '--import-times' in argv or os.environ.get('EYECAM_IMPORT_TIMES', '') not in ('', '0')
+
+
+class StartupTimer(object):
+    ''' Prints each startup stage's duration and the running total since `start` to stderr when
+    enabled. Time spent waiting for the user is left out with pause().'''
+
+    def __init__(self, enabled=False, start=None):
+        self.enabled = enabled
+        self.start = default_timer() if start is None else start
+        self._last = self.start
+        self._paused = 0.
+
+    def mark(self, stage):
+        now = default_timer()
+        if self.enabled:
+            sys.stderr.write('%-32s %8.1f ms   total %8.1f ms\n' % (
+                stage, 1000. * (now - self._last), 1000. * (now - self.start - self._paused)))
+        self._last = now
+
+    def pause(self):
+        #Call after a stage that waits for the user (the dialog); that time is not counted:
+        now = default_timer()
+        self._paused += now - self._last
+        self._last = now
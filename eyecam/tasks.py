@@ -0,0 +1,121 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Cooperative task scheduler for the run lifecycle (trigger wait, countdown, capture feed, preview,
+telemetry, writer supervision).
+
+PsychoPy 1.83 runs on Python 2, which has no asyncio, so tasks are plain generators. A task yields
+    a number    to sleep that many seconds (0: run again after the other due tasks)
+    a Task      to wait until that task has finished
+and finishes by returning. Scheduler.run(main) runs until `main` finishes, then cancels every task
+still running (each generator is closed, so its `finally` blocks run). If any task raises - e.g.
+QuitRequested when the RA presses escape - all tasks are cancelled the same way and the exception is
+re-raised to the caller, which can then drain and finalize once. While every task is sleeping the
+scheduler sleeps too, so waiting costs no CPU.
+
+stats() gives, per task, how late it was resumed relative to when it asked to be (scheduling latency)
+and how long each step took, in milliseconds.
+***************************************************************************************************************
+"""
+import heapq
+import itertools
+import time
+from timeit import default_timer
+
+
+class QuitRequested(Exception):
+    ''' Raised by a task to end the session (escape key).'''
+
+
+class Task(object):
+    def __init__(self, name, gen):
+        self.name = name
+        self.gen = gen
+        self.done = False
+        self.waiters = []
+        self.late = []
+        self.steps = []
+
+
+def _percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+    return {'p50': round(1000. * pick(0.5), 3), 'p99': round(1000. * pick(0.99), 3),
+            'max': round(1000. * ordered[-1], 3)}
+
+
+class Scheduler(object):
+    ''' Runs generator tasks on the calling thread; see the module docstring.'''
+
+    def __init__(self, now=default_timer):
+        self.now = now
+        self.tasks = []
+        self._queue = []
+        self._order = itertools.count()
+
+    def spawn(self, name, gen):
+        task = Task(name, gen)
+        self.tasks.append(task)
+        self._schedule(task, self.now())
+        return task
+
+    def _schedule(self, task, due):
+        heapq.heappush(self._queue, (due, next(self._order), task))
+
+    def _finish(self, task):
+        task.done = True
+        now = self.now()
+        for waiter in task.waiters:
+            self._schedule(waiter, now)
+        task.waiters = []
+
+    def _step(self, task, due):
+        start = self.now()
+        task.late.append(max(start - due, 0.))
+        try:
+            value = next(task.gen)
+        except StopIteration:
+            self._finish(task)
+            return
+        end = self.now()
+        task.steps.append(end - start)
+        if isinstance(value, Task):
+            if value.done:
+                self._schedule(task, end)
+            else:
+                value.waiters.append(task)
+        else:
+            self._schedule(task, end + (value or 0))
+
+    def cancel(self, task):
+        #Close a task's generator (its finally blocks run); tasks waiting for it are resumed:
+        if task.done:
+            return
+        self._queue = [item for item in self._queue if item[2] is not task]
+        heapq.heapify(self._queue)
+        task.gen.close()
+        self._finish(task)
+
+    def cancelAll(self):
+        #Most recently spawned first, so stages are torn down in the reverse order they were started:
+        for task in reversed(self.tasks):
+            self.cancel(task)
+
+    def run(self, main, name='main'):
+        main = self.spawn(name, main)
+        try:
+            while not main.done:
+                due, order, task = heapq.heappop(self._queue)
+                wait = due - self.now()
+                if wait > 0:
+                    time.sleep(wait)
+                self._step(task, due)
+        finally:
+            self.cancelAll()
+
+    def stats(self):
+        #{task name: {'steps', 'late_ms', 'step_ms'}} for the tasks run so far:
+        return dict((task.name, {'steps': len(task.steps), 'late_ms': _percentiles(task.late),
+                                 'step_ms': _percentiles(task.steps)}) for task in self.tasks)
@@ -0,0 +1,138 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Live acquisition telemetry: rolling frame rate, inter-frame interval (IFI) p50/p99, dropped frames,
+writer queue depth and writer lag, updated in O(1) per frame and shown on the RA View a few times a
+second, with warnings when the thresholds in the `telemetry` section of siteConfig.yaml are crossed.
+***************************************************************************************************************
+"""
+from timeit import default_timer
+
+#Warning thresholds (overridable in siteConfig.yaml):
+DEFAULT_THRESHOLDS = {'min_fps': 27., 'max_ifi_ms': 100., 'max_dropped': 0, 'max_queue': 0.5, 'max_lag_s': 2.}
+
+
+class Telemetry(object):
+    ''' Streaming frame statistics over the last `window` inter-frame intervals.
+
+    update(ts) is O(1): intervals are kept in a circular buffer with a running sum and a
+    fixed-width histogram (binWidth seconds, up to maxIfi), so percentiles are read from the
+    histogram instead of sorting. Call poll() from the display loop.'''
+
+    def __init__(self, fps=30., window=150, binWidth=0.001, maxIfi=1., rate=4., thresholds=None):
+        self.fps = float(fps)
+        self.window = int(window)
+        self.binWidth = binWidth
+        self.interval = 1. / rate if rate else 0.
+        self.thresholds = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+        self._ifis = [0.] * self.window
+        self._hist = [0] * (int(maxIfi / binWidth) + 1)
+        self._pos = 0
+        self._n = 0
+        self._sum = 0.
+        self.lastTs = None
+        self.frames = 0
+        #Frames the device never delivered, estimated from intervals longer than 1.5 frame periods:
+        self.missed = 0
+        self._nextPoll = 0.
+        self._warnings = []
+        #Other monitors whose warnings() are shown with these (e.g. eyecam.openness.EyeMonitor):
+        self.sources = []
+
+    def _bin(self, ifi):
+        return min(int(ifi / self.binWidth), len(self._hist) - 1)
+
+    def update(self, ts):
+        #Add one frame's timestamp (seconds):
+        if self.lastTs is not None:
+            ifi = ts - self.lastTs
+            if self._n == self.window:
+                old = self._ifis[self._pos]
+                self._hist[self._bin(old)] -= 1
+                self._sum -= old
+            else:
+                self._n += 1
+            self._ifis[self._pos] = ifi
+            self._hist[self._bin(ifi)] += 1
+            self._sum += ifi
+            self._pos = (self._pos + 1) % self.window
+            if ifi > 1.5 / self.fps:
+                self.missed += int(round(ifi * self.fps)) - 1
+        self.lastTs = ts
+        self.frames += 1
+
+    def _percentile(self, q):
+        target = q * self._n
+        seen = 0
+        for i, count in enumerate(self._hist):
+            seen += count
+            if seen >= target and seen:
+                return (i + 0.5) * self.binWidth
+        return float('nan')
+
+    def snapshot(self, frameRing=None):
+        snap = {'frames': self.frames,
+                'fps': self._n / self._sum if self._sum > 0 else float('nan'),
+                'ifi_p50_ms': 1000. * self._percentile(0.5),
+                'ifi_p99_ms': 1000. * self._percentile(0.99),
+                'missed': self.missed,
+                'dropped': self.missed,
+                'queue': 0, 'queue_frac': 0., 'lag_s': 0.}
+        if frameRing is not None:
+            snap['dropped'] += len(frameRing.drops)
+            snap['queue'] = frameRing.depth()
+            snap['queue_frac'] = snap['queue'] / float(frameRing.nSlots)
+            written = frameRing.writtenTs()
+            #An empty queue means the writer has caught up:
+            if snap['queue'] and written is not None and self.lastTs is not None:
+                snap['lag_s'] = max(self.lastTs - written, 0.)
+        return snap
+
+    def warnings(self, snap):
+        limits = self.thresholds
+        found = []
+        if self._n >= self.window // 2 and snap['fps'] < limits['min_fps']:
+            found.append('Low frame rate: %.1f fps' % snap['fps'])
+        if snap['ifi_p99_ms'] > limits['max_ifi_ms']:
+            found.append('Frame gaps: p99 interval %.0f ms' % snap['ifi_p99_ms'])
+        if snap['dropped'] > limits['max_dropped']:
+            found.append('Dropped frames: %d' % snap['dropped'])
+        if snap['queue_frac'] > limits['max_queue']:
+            found.append('Writer queue %d%% full' % (100 * snap['queue_frac']))
+        if snap['lag_s'] > limits['max_lag_s']:
+            found.append('Writer %.1f s behind' % snap['lag_s'])
+        return found
+
+    def lines(self, snap):
+        #Text lines for the preview overlay:
+        return ['%5.1f fps  IFI p50 %.0f / p99 %.0f ms' % (snap['fps'], snap['ifi_p50_ms'], snap['ifi_p99_ms']),
+                'dropped %d  queue %d  lag %.2f s' % (snap['dropped'], snap['queue'], snap['lag_s'])]
+
+    def poll(self, frameRing=None, preview=None):
+        # At most `rate` times a second: refresh the preview overlay and re-check the thresholds.
+        # Returns the new list of warnings when it has changed since the last poll, else None.
+        now = default_timer()
+        if now < self._nextPoll:
+            return None
+        self._nextPoll = now + self.interval
+        snap = self.snapshot(frameRing)
+        found = self.warnings(snap)
+        for source in self.sources:
+            found += source.warnings()
+        if preview is not None:
+            preview.overlay = [(line, bool(found)) for line in self.lines(snap)] + [(w, True) for w in found]
+        if found != self._warnings:
+            self._warnings = found
+            return found
+        return None
+
+
+def telemetryFromConfig(config, fps):
+    #Build Telemetry from the optional `telemetry` section of siteConfig.yaml (enabled unless
+    #telemetry: {enabled: 'no'}); returns None when disabled:
+    telemetryConfig = dict(config.get('telemetry', {}))
+    if telemetryConfig.pop('enabled', 'yes') != 'yes':
+        return None
+    rate = telemetryConfig.pop('rate', 4.)
+    window = telemetryConfig.pop('window', 150)
+    return Telemetry(fps=fps, window=window, rate=rate, thresholds=telemetryConfig)
@@ -0,0 +1,84 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+End-of-run frame timing diagnostics, computed with NumPy over the run's timestamp array:
+frames-per-second distribution, inter-frame interval (IFI) distribution, the longest gaps and the
+number of frames the device is estimated to have dropped relative to the nominal frame rate. Saved as
+<run>_timing.json next to the video; a short summary is printed at the end of each run.
+***************************************************************************************************************
+"""
+import json
+import os
+
+import numpy as np
+
+#IFI percentiles reported (%):
+IFI_PERCENTILES = (1, 5, 50, 95, 99)
+
+
+def timingFile(out_file):
+    #Timing report path for the video (or run base name) out_file:
+    return os.path.splitext(out_file)[0] + '_timing.json'
+
+
+def frameTiming(ts, fps, nGaps=5, writerDrops=0, spilled=0):
+    # Timing statistics for grab timestamps ts (seconds) at nominal rate fps. An interval longer
+    # than 1.5 frame periods counts as round(ifi * fps) - 1 frames the device never delivered.
+    # writerDrops / spilled are the FrameRing counts, reported alongside.
+    ts = np.asarray(ts, dtype=np.float64)
+    report = {'frames': int(len(ts)), 'nominal_fps': fps, 'writer_drops': writerDrops, 'spilled': spilled}
+    if len(ts) < 2:
+        return report
+    ifi = np.diff(ts)
+    period = 1. / fps
+    duration = ts[-1] - ts[0]
+    #Frames within each clock second, and how many seconds had each count:
+    second = np.floor(ts).astype(np.int64)
+    perSecond = np.bincount(second - second[0])
+    secondsWith = np.bincount(perSecond)
+    long_ = ifi > 1.5 * period
+    missed = np.rint(ifi[long_] * fps).astype(np.int64) - 1
+    nGaps = min(nGaps, len(ifi))
+    gapIdx = np.argpartition(ifi, len(ifi) - nGaps)[len(ifi) - nGaps:]
+    gapIdx = gapIdx[np.argsort(ifi[gapIdx])[::-1]]
+    ms = ifi * 1000.
+    report.update({
+        'duration_s': round(float(duration), 4),
+        'mean_fps': round(float((len(ts) - 1) / duration), 3) if duration > 0 else None,
+        'ifi_ms': dict([('mean', round(float(ms.mean()), 3)), ('sd', round(float(ms.std()), 3)),
+                        ('min', round(float(ms.min()), 3)), ('max', round(float(ms.max()), 3))] +
+                       [('p%d' % q, round(float(v), 3))
+                        for q, v in zip(IFI_PERCENTILES, np.percentile(ms, IFI_PERCENTILES))]),
+        #{frames in a second: number of seconds}:
+        'frames_per_second': dict((str(n), int(c)) for n, c in enumerate(secondsWith) if c),
+        'longest_gaps': [{'frame': int(i + 1), 'ts': round(float(ts[i + 1]), 4),
+                          'ifi_ms': round(float(ms[i]), 3)} for i in gapIdx],
+        'late_intervals': int(long_.sum()),
+        'estimated_dropped': int(missed.sum()),
+    })
+    return report
+
+
+def saveTiming(path, report):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+
+
+def timingSummary(report):
+    #Lines for the console at the end of a run:
+    if report['frames'] < 2:
+        return ['Frames captured: %d' % report['frames']]
+    ifi = report['ifi_ms']
+    #(no rate for frames that all share one timestamp)
+    fps = 'n/a' if report['mean_fps'] is None else '%.2f' % report['mean_fps']
+    lines = ['Frames captured: %d in %.2f s (%s fps, nominal %g)' % (
+                 report['frames'], report['duration_s'], fps, report['nominal_fps']),
+             'Frame interval (ms): median %.1f, p99 %.1f, max %.1f' % (ifi['p50'], ifi['p99'], ifi['max']),
+             'Frequency: Frames Within Each Second ' + ', '.join(
+                 '%s: %d s' % (n, c) for n, c in sorted(report['frames_per_second'].items(), key=lambda i: int(i[0]))),
+             'Longest gaps (ms): ' + ', '.join('%.1f at %.2f s' % (g['ifi_ms'], g['ts'])
+                                              for g in report['longest_gaps']),
+             'Frames dropped by the device (estimated): %d' % report['estimated_dropped'],
+             'Frames dropped (writer ring full): %d' % report['writer_drops'],
+             'Frames spilled to disk: %d' % report['spilled']]
+    return lines
@@ -0,0 +1,222 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Opt-in per-frame stage timing for the acquisition pipeline.
+
+Enabled with `trace: {enabled: 'yes'}` in siteConfig.yaml or EYECAM_TRACE=1 in the environment; when
+off the capture loop only tests `trace is not None` a few times per frame. When on, every frame's
+stage boundaries are stamped (timeit.default_timer, the same clock in every process) into a
+preallocated array:
+    capture side (recFrame / CaptureThread)   begin, grab, retrieve, crop, enqueue, preview
+    writer side (writeVid's stats hook)       dequeue, encode
+and saved at the end of the run as <run>_trace_capture.npy and <run>_trace_writer_<process>.npy (one
+per encoding process). Frames are matched across the two by sequence number.
+
+With `profile_writer: 'yes'` the writer process is also sampled every sample_ms milliseconds; the
+stack counts are saved as <run>_writer_profile.txt in collapsed-stack format (one "a;b;c count" line
+per stack, as read by flamegraph tools).
+
+Summarise a run's trace with:
+    python -m eyecam.trace data/REST_X_run1_DATE [--worst 10]
+***************************************************************************************************************
+"""
+import argparse
+import glob
+import os
+import sys
+import threading
+from multiprocessing import current_process
+from timeit import default_timer
+
+import numpy as np
+
+#Capture-side stamps, in order; each stage's duration is its stamp minus the previous one:
+CAPTURE_STAGES = ('begin', 'grab', 'retrieve', 'crop', 'enqueue', 'preview')
+GRAB, RETRIEVE, CROP, ENQUEUE, PREVIEW = range(1, len(CAPTURE_STAGES))
+CAPTURE_DTYPE = np.dtype([('seq', '<i8'), ('ts', '<f8')] + [(stage, '<f8') for stage in CAPTURE_STAGES])
+WRITER_DTYPE = np.dtype([('seq', '<i8'), ('dequeue', '<f8'), ('encode', '<f8')])
+
+
+def traceFiles(out_file):
+    #(capture trace, writer trace glob, writer profile) paths for the run's video or base name:
+    base = os.path.splitext(out_file)[0]
+    return base + '_trace_capture.npy', base + '_trace_writer_*.npy', base + '_writer_profile.txt'
+
+
+class CaptureTrace(object):
+    ''' Stage stamps for every captured frame: begin() before the grab, mark(stage) after each stage
+    and commit(seq, ts) once the frame is done. Stages a frame skips keep the previous stamp.'''
+
+    def __init__(self, capacity=16384):
+        self._records = np.zeros(max(int(capacity), 1), dtype=CAPTURE_DTYPE)
+        self._stamps = [0.] * len(CAPTURE_STAGES)
+        self.count = 0
+
+    def begin(self):
+        self._stamps[0] = default_timer()
+
+    def mark(self, stage):
+        self._stamps[stage] = default_timer()
+
+    def commit(self, seq, ts):
+        stamps = self._stamps
+        for i in range(1, len(stamps)):
+            if stamps[i] < stamps[i - 1]:
+                stamps[i] = stamps[i - 1]
+        if self.count == len(self._records):
+            self._records = np.concatenate([self._records, np.zeros_like(self._records)])
+        self._records[self.count] = tuple([seq, ts] + stamps)
+        self.count += 1
+        self._stamps = [0.] * len(CAPTURE_STAGES)
+
+    def records(self):
+        return self._records[:self.count]
+
+    def save(self, out_file):
+        np.save(traceFiles(out_file)[0], self.records())
+
+
+class WriterTrace(object):
+    ''' writeVid stats hook (record / finish) keeping dequeue and encode stamps per frame. It is
+    pickled into the writer process with the run's options; the array is allocated there, and
+    every encoding process saves its own file from finish().'''
+
+    def __init__(self, out_file, capacity=16384):
+        self.out_file = out_file
+        self.capacity = max(int(capacity), 1)
+        self._records = None
+        self.count = 0
+
+    def record(self, seq, ts, dequeued, encoded):
+        if self._records is None:
+            self._records = np.zeros(self.capacity, dtype=WRITER_DTYPE)
+        elif self.count == len(self._records):
+            self._records = np.concatenate([self._records, np.zeros_like(self._records)])
+        self._records[self.count] = (seq, dequeued, encoded)
+        self.count += 1
+
+    def finish(self):
+        records = self._records[:self.count] if self._records is not None else np.zeros(0, WRITER_DTYPE)
+        np.save(traceFiles(self.out_file)[1].replace('*', current_process().name), records)
+
+
+class Sampler(threading.Thread):
+    ''' Samples the stack of `thread` (default: the thread that creates the sampler) every interval
+    seconds and counts each distinct stack.'''
+
+    def __init__(self, interval=0.005, thread=None):
+        threading.Thread.__init__(self, name='Sampler')
+        self.daemon = True
+        self.interval = interval
+        self.target = (thread or threading.current_thread()).ident
+        self.counts = {}
+        self._halt = threading.Event()
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.counts.items(), key=lambda item: -item[1]):
+                f.write('%s %d\n' % (stack, count))
+
+
+def traceRequested(config):
+    return (config.get('trace', {}).get('enabled', 'no') == 'yes' or
+            os.environ.get('EYECAM_TRACE', '') not in ('', '0'))
+
+
+def traceFromConfig(config, frames):
+    #A CaptureTrace sized for `frames` frames if tracing is on (siteConfig.yaml or EYECAM_TRACE), else None:
+    return CaptureTrace(frames) if traceRequested(config) else None
+
+
+def writerTraceOptions(config, out_file, frames):
+    #Extra writeVid/sessionWriter options for one run: the writer trace and, if asked for, the
+    #sampling profiler ({} when tracing is off):
+    if not traceRequested(config):
+        return {}
+    traceConfig = config.get('trace', {})
+    options = {'stats': WriterTrace(out_file, frames)}
+    if traceConfig.get('profile_writer', 'no') == 'yes':
+        options['profile'] = (traceFiles(out_file)[2], traceConfig.get('sample_ms', 5) / 1000.)
+    return options
+
+
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+#Trace summary
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+def loadTrace(out_file):
+    #(capture records, writer records joined from every encoding process, sorted by seq):
+    captureFile, writerGlob = traceFiles(out_file)[:2]
+    capture = np.load(captureFile) if os.path.exists(captureFile) else np.zeros(0, CAPTURE_DTYPE)
+    parts = [np.load(path) for path in sorted(glob.glob(writerGlob))]
+    writer = np.concatenate(parts) if parts else np.zeros(0, WRITER_DTYPE)
+    return capture, writer[np.argsort(writer['seq'], kind='mergesort')]
+
+
+def stageTimes(capture, writer):
+    #{stage: per-frame milliseconds}; queue is enqueue to dequeue and encode is dequeue to encoded,
+    #for the frames found in both traces:
+    stages = {}
+    for i in range(1, len(CAPTURE_STAGES)):
+        stages[CAPTURE_STAGES[i]] = 1000. * (capture[CAPTURE_STAGES[i]] - capture[CAPTURE_STAGES[i - 1]])
+    if len(capture) and len(writer):
+        order = np.argsort(capture['seq'])
+        idx = np.searchsorted(capture['seq'][order], writer['seq'])
+        idx = np.clip(idx, 0, len(capture) - 1)
+        found = capture['seq'][order][idx] == writer['seq']
+        enqueued = capture['enqueue'][order][idx][found]
+        stages['queue'] = 1000. * (writer['dequeue'][found] - enqueued)
+    stages['encode'] = 1000. * (writer['encode'] - writer['dequeue'])
+    return stages
+
+
+def summary(capture, writer, worst=0):
+    #Lines: p50/p95/p99/max per stage, then the `worst` slowest captured frames by stage:
+    stages = stageTimes(capture, writer)
+    names = list(CAPTURE_STAGES[1:]) + [name for name in ('queue', 'encode') if name in stages]
+    lines = ['%d frames captured, %d written' % (len(capture), len(writer)),
+             '%-10s %9s %9s %9s %9s' % ('stage (ms)', 'p50', 'p95', 'p99', 'max')]
+    for name in names:
+        ms = stages[name]
+        if not len(ms):
+            continue
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        lines.append('%-10s %9.3f %9.3f %9.3f %9.3f' % (name, p50, p95, p99, ms.max()))
+    if worst and len(capture):
+        total = 1000. * (capture['preview'] - capture['begin'])
+        lines.append('slowest frames (ms): seq ts ' + ' '.join(CAPTURE_STAGES[1:]))
+        for i in np.argsort(total)[::-1][:worst]:
+            lines.append('%d %.4f ' % (capture['seq'][i], capture['ts'][i]) +
+                         ' '.join('%.3f' % stages[name][i] for name in CAPTURE_STAGES[1:]))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Summarise an EyeCam run trace')
+    parser.add_argument('run', help='run video or base name, e.g. data/REST_X_run1_DATE')
+    parser.add_argument('--worst', type=int, default=0, help='also list the N slowest frames')
+    args = parser.parse_args(argv)
+    capture, writer = loadTrace(args.run)
+    if not len(capture) and not len(writer):
+        sys.stderr.write('No trace found for %s\n' % args.run)
+        return 1
+    print('\n'.join(summary(capture, writer, args.worst)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Low-CPU waiting for the task scripts. Instead of spinning on event.getKeys()/core.getTime(), the wait
+loops sleep between key polls, leaving the CPU to the capture loop and the video writer. Deadlines
+within a run (countdown, run end) are slept to by the eyecam.tasks scheduler.
+
+Keys are polled every POLL_S seconds while nothing time-critical is pending. The scanner trigger is
+polled every TRIGGER_POLL_S seconds and timestamped with the time its key event was received, and
+the task clocks are zeroed at that time rather than at the moment the poll loop noticed it.
+***************************************************************************************************************
+"""
+import time
+from timeit import default_timer
+
+#Key polling interval while waiting for the RA or for a deadline:
+POLL_S = 0.01
+#Key polling interval while waiting for the scanner trigger:
+TRIGGER_POLL_S = 0.001
+
+
+def waitKeys(getKeys, until=None, interval=POLL_S, idle=None, now=default_timer):
+    # Calls getKeys() every `interval` seconds, sleeping in between, until it returns something or
+    # the deadline `until` (on the `now` clock) passes. idle(), if given, is called on every poll
+    # (e.g. to refresh the RA View). Returns the keys, or [] at the deadline.
+    while True:
+        keys = getKeys()
+        if keys:
+            return keys
+        if idle is not None:
+            idle()
+        left = None if until is None else until - now()
+        if left is not None and left <= 0:
+            return []
+        time.sleep(interval if left is None else min(interval, left))
+
+
+def zeroClocksAt(clocks, eventTime, now):
+    # Reset psychopy Clocks/CountdownTimers so they read zero at the (past) time eventTime on the
+    # `now` clock, not at the moment this is called:
+    lag = now() - eventTime
+    for clock in clocks:
+        clock.reset()
+        clock.add(-lag)
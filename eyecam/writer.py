@@ -0,0 +1,309 @@
+"""
+Part of the Human Connectome - Lifespan Project Task fMRI Battery
+***************************************************************************************************************
+Video writing process. Run in parallel with the data collection loop; pops frames from the
+shared-memory FrameRing and encodes them with imageio/ffmpeg.
+
+Encoder settings come from the optional `encoder` section of siteConfig.yaml. With segment_s set,
+the stream is cut into segments of that many seconds which are encoded by a small pool of worker
+processes (segment k goes to worker k % workers), so a segment that is still encoding does not hold
+up the next one. The segments are joined without re-encoding (ffmpeg concat, stream copy) once the
+run has been drained. sessionWriter keeps one writer process for a whole session, rolling over to
+the next run's file (see eyecam.engine). With fragment_s set, the .mp4 is written as a fragmented
+MP4 (a keyframe and a self-contained fragment every fragment_s seconds, flushed as it is written), so
+closing it at the end of a run takes constant time and everything up to an abort or crash plays
+back; the frame log is streamed alongside (see eyecam.framelog). Every mode saves the run's frame log (eyecam.framelog) next to the video,
+one record per video frame. With mode: spool, frames are only written raw to disk during the scan and
+encoded afterwards (see eyecam.spool). With pacing set, the video follows the capture timestamps:
+constant rate by repeating / dropping frames against the nominal grid (cfr), or the real timestamps
+written into the .mp4 (vfr); see eyecam.pacing.
+***************************************************************************************************************
+"""
+from multiprocessing import Process, Queue
+import os
+import traceback
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+import subprocess
+from timeit import default_timer
+
+from eyecam.framelog import FrameLog, frameLogFile
+from eyecam.pacing import PACING_MODES, Pacer, retimeMp4
+
+
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+#Encoder settings from siteConfig.yaml
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+def encoderKwargs(config):
+    # Translate the `encoder` section (codec, preset, crf, bitrate, threads, pixel_format) into
+    # imageio.get_writer keyword arguments. Missing keys keep imageio's defaults.
+    encoderConfig = config.get('encoder', {})
+    kwargs = {}
+    ffmpegParams = []
+    if encoderConfig.get('codec'):
+        kwargs['codec'] = encoderConfig['codec']
+    if encoderConfig.get('pixel_format'):
+        kwargs['pixelformat'] = encoderConfig['pixel_format']
+    if encoderConfig.get('bitrate'):
+        kwargs['bitrate'] = encoderConfig['bitrate']
+    elif encoderConfig.get('crf') is not None:
+        #An explicit CRF replaces imageio's quality setting:
+        kwargs['quality'] = None
+        ffmpegParams += ['-crf', str(encoderConfig['crf'])]
+    if encoderConfig.get('preset'):
+        ffmpegParams += ['-preset', str(encoderConfig['preset'])]
+    if encoderConfig.get('threads') is not None:
+        ffmpegParams += ['-threads', str(encoderConfig['threads'])]
+    if ffmpegParams:
+        kwargs['ffmpeg_params'] = ffmpegParams
+    return kwargs
+
+
+def writerOptions(config, fps, duration=None):
+    #Keyword arguments for writeVid from siteConfig.yaml. duration (s) sizes the spool preallocation:
+    encoderConfig = config.get('encoder', {})
+    options = {'writerKwargs': encoderKwargs(config),
+               'segmentFrames': int(round(encoderConfig.get('segment_s', 0) * fps)),
+               'workers': encoderConfig.get('workers', 2)}
+    fragmentFrames = int(round(encoderConfig.get('fragment_s', 0) * fps))
+    if fragmentFrames > 0:
+        #A keyframe starts every fragment; each fragment is written out as soon as it is complete:
+        kwargs = options['writerKwargs']
+        kwargs['ffmpeg_params'] = kwargs.get('ffmpeg_params', []) + [
+            '-g', str(fragmentFrames), '-movflags', '+frag_keyframe+empty_moov+default_base_moof',
+            '-flush_packets', '1']
+        options['fragmentFrames'] = fragmentFrames
+    pacing = encoderConfig.get('pacing', 'off')
+    if pacing not in PACING_MODES:
+        raise ValueError('encoder pacing must be one of %s, not %r' % ('/'.join(PACING_MODES), pacing))
+    if pacing == 'vfr':
+        if fragmentFrames > 0:
+            raise ValueError('encoder pacing: vfr needs fragment_s: 0 (fragments cannot be retimed)')
+        #Sample durations are rewritten after encoding, which needs frames in display order:
+        kwargs = options['writerKwargs']
+        kwargs['ffmpeg_params'] = kwargs.get('ffmpeg_params', []) + ['-bf', '0']
+    if pacing != 'off':
+        options['pacing'] = pacing
+    if encoderConfig.get('mode', 'live') == 'spool':
+        #Room for the run plus countdown and some margin; the spool grows if this runs out:
+        options['spoolFrames'] = int(((duration or 60) + 10) * fps * 1.1)
+    return options
+
+
+def _ffmpegExe():
+    #imageio >= 2.5 ships ffmpeg through imageio_ffmpeg; older versions through the ffmpeg plugin:
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except ImportError:
+        from imageio.plugins import ffmpeg
+        return ffmpeg.get_exe()
+
+
+def segmentFile(out_file, segment):
+    base, ext = os.path.splitext(out_file)
+    return '%s_seg%03d%s' % (base, segment, ext)
+
+
+def concatSegments(segmentFiles, out_file):
+    #Join segment files into out_file without re-encoding; segments are removed once it succeeds.
+    listFile = out_file + '.segments.txt'
+    with open(listFile, 'w') as f:
+        for seg in segmentFiles:
+            f.write("file '%s'\n" % os.path.abspath(seg).replace("'", "'\\''"))
+    cmd = [_ffmpegExe(), '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', listFile,
+           '-c', 'copy', out_file]
+    returncode = subprocess.call(cmd)
+    if returncode != 0 or not os.path.exists(out_file):
+        raise IOError('Joining %d video segments into %s failed; segments were kept' % (
+            len(segmentFiles), out_file))
+    for seg in segmentFiles + [listFile]:
+        os.remove(seg)
+
+
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+#Video writing function
+#To be run in parallel with data collection loop in main
+#::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+def writeVid(frame_ring, quit_flag, out_file, fps=30, writerKwargs=None, stats=None, segmentFrames=0,
+             workers=2, spoolFrames=0, fragmentFrames=0, pacing='off'):
+    # writerKwargs are passed on to imageio.get_writer (see encoderKwargs).
+    # stats, if given, receives record(seq, captureTs, dequeueTime, encodedTime) for every frame and
+    # finish() from each encoding process once its file is closed (used by eyecam.bench).
+    # segmentFrames > 0 encodes segments of that many frames in `workers` processes (see above).
+    # spoolFrames > 0 writes a raw spool preallocated for that many frames instead of encoding.
+    # fragmentFrames > 0 (fragmented output, see writerOptions) streams the frame log to disk,
+    # flushed once per fragment.
+    # pacing 'cfr' repeats / drops frames against the nominal grid (corrections saved as
+    # <run>_pacing.npy), 'vfr' stamps the closed .mp4 with the capture timestamps (see eyecam.pacing).
+    # Setting quit_flag asks the writer to drain: everything already in the ring is encoded before
+    # the file is closed.
+    # The frame log (<run>_frames.npy) is written once the video is closed.
+    if spoolFrames > 0:
+        from eyecam.spool import spoolVid
+        return spoolVid(frame_ring, quit_flag, out_file, fps, writerKwargs, stats, capacity=spoolFrames,
+                        pacing=pacing)
+    if segmentFrames > 0:
+        return _writeSegmented(frame_ring, quit_flag, out_file, fps, writerKwargs, stats, segmentFrames, workers,
+                               pacing)
+    #CV2 does not like to run in two processes simultaneously:
+    import imageio
+    #Create video writer object:
+    out = imageio.get_writer(out_file, fps=fps, **(writerKwargs or {}))
+    if fragmentFrames > 0:
+        frameLog = FrameLog(streamTo=frameLogFile(out_file), flushEvery=fragmentFrames)
+    else:
+        frameLog = FrameLog()
+    pacer = Pacer(fps) if pacing == 'cfr' else None
+    while True:
+        #Keep popping slots and encoding straight from shared memory; the timeout lets the
+        #quit_flag be noticed while the ring is empty:
+        try:
+            slot, ts, seq = frame_ring.get(timeout=0.1)
+        except Empty:
+            if quit_flag.value and frame_ring.depth() == 0:
+                break
+            continue
+        dequeued = default_timer()
+        #Once per frame, or as many times as the pacer says (0 drops it):
+        for copy in range(pacer.copies(seq, ts) if pacer is not None else 1):
+            out.append_data(frame_ring.frame(slot))
+            frameLog.add(seq, ts)
+        frame_ring.release(slot, ts)
+        if stats is not None:
+            stats.record(seq, ts, dequeued, default_timer())
+    #Finishes file IO once quit_flag is True and the ring is drained:
+    out.close()
+    _finishPacing(out_file, pacing, pacer, frameLog)
+    frameLog.save(frameLogFile(out_file))
+    if stats is not None:
+        stats.finish()
+
+
+def _finishPacing(out_file, pacing, pacer, frameLog):
+    #Save cfr corrections / stamp a vfr video with the frame log's timestamps, once the video is closed:
+    if pacer is not None:
+        pacer.save(out_file)
+    if pacing == 'vfr' and frameLog.count:
+        retimeMp4(out_file, frameLog.records()['ts'])
+
+
+def sessionWriter(frame_ring, quit_flag, jobs, done):
+    # Persistent writer process: for every (out_file, fps, options) job from `jobs`, runs writeVid
+    # until quit_flag is set and the ring is drained, then reports (out_file, error or None) on
+    # `done`. A None job ends the process. options['profile'] = (path, interval) samples this
+    # process during the run (see eyecam.trace).
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        out_file, fps, options = job
+        profile = options.pop('profile', None)
+        if profile:
+            from eyecam.trace import Sampler
+            sampler = Sampler(profile[1])
+            sampler.start()
+        error = None
+        try:
+            writeVid(frame_ring, quit_flag, out_file, fps, **options)
+        except Exception as err:
+            traceback.print_exc()
+            error = str(err)
+            #Keep freeing slots so capture is not blocked for the rest of the run:
+            _discard(frame_ring, quit_flag)
+        if profile:
+            sampler.stop()
+            sampler.save(profile[0])
+        frame_ring.endRun()
+        done.put((out_file, error))
+
+
+def _discard(frame_ring, quit_flag):
+    while True:
+        try:
+            slot, ts, seq = frame_ring.get(timeout=0.1)
+        except Empty:
+            if quit_flag.value and frame_ring.depth() == 0:
+                break
+            continue
+        frame_ring.release(slot)
+
+
+def _encodeSegments(frame_ring, tokens, out_file, fps, writerKwargs, stats):
+    #Segment worker: encode (segment, slot, ts, seq) tokens, starting a new file for each segment,
+    #until a None token arrives.
+    import imageio
+    out, current = None, None
+    while True:
+        token = tokens.get()
+        if token is None:
+            break
+        dequeued = default_timer()
+        segment, slot, ts, seq, copies = token
+        if segment != current:
+            if out is not None:
+                out.close()
+            out = imageio.get_writer(segmentFile(out_file, segment), fps=fps, **(writerKwargs or {}))
+            current = segment
+        for copy in range(copies):
+            out.append_data(frame_ring.frame(slot))
+        frame_ring.release(slot, ts)
+        if stats is not None:
+            stats.record(seq, ts, dequeued, default_timer())
+    if out is not None:
+        out.close()
+    if stats is not None:
+        stats.finish()
+
+
+def _writeSegmented(frame_ring, quit_flag, out_file, fps, writerKwargs, stats, segmentFrames, workers,
+                    pacing='off'):
+    #Dispatch frames to segment workers in capture order, then join the segments:
+    workers = max(int(workers), 1)
+    queues = [Queue() for i in range(workers)]
+    procs = [Process(name='Encode%d' % i, target=_encodeSegments,
+                     args=(frame_ring, queues[i], out_file, fps, writerKwargs, stats))
+             for i in range(workers)]
+    for proc in procs:
+        proc.start()
+    #Frames are numbered here, in the order the segments will be joined:
+    frameLog = FrameLog()
+    pacer = Pacer(fps) if pacing == 'cfr' else None
+    nFrames = 0
+    #(a repeated frame stays in the segment of its first copy, so numbers can be skipped)
+    segments = []
+    while True:
+        try:
+            slot, ts, seq = frame_ring.get(timeout=0.1)
+        except Empty:
+            #Slots are released by the workers, so depth reaches 0 once they have caught up:
+            if quit_flag.value and frame_ring.depth() == 0:
+                break
+            #A worker that died (e.g. the encoder could not be opened) would never free its slots:
+            for proc in procs:
+                if not proc.is_alive():
+                    for q in queues:
+                        q.put(None)
+                    raise IOError('Segment encoder %s stopped (exit code %s)' % (proc.name, proc.exitcode))
+            continue
+        copies = pacer.copies(seq, ts) if pacer is not None else 1
+        if not copies:
+            frame_ring.release(slot, ts)
+            continue
+        segment = nFrames // segmentFrames
+        if not segments or segments[-1] != segment:
+            segments.append(segment)
+        queues[segment % workers].put((segment, slot, ts, seq, copies))
+        for copy in range(copies):
+            frameLog.add(seq, ts)
+        nFrames += copies
+    for q in queues:
+        q.put(None)
+    for proc in procs:
+        proc.join()
+    if segments:
+        concatSegments([segmentFile(out_file, k) for k in segments], out_file)
+    _finishPacing(out_file, pacing, pacer, frameLog)
+    frameLog.save(frameLogFile(out_file))
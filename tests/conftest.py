@@ -0,0 +1,5 @@
+import os
+import sys
+
+#The eyecam package is imported from the task directory (there is no installed package):
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,25 @@
+import multiprocessing
+
+import pytest
+
+from eyecam.acquisition import EyeCamSession
+
+
+def test_bad_config_fails_before_anything_starts(tmp_path):
+    session = EyeCamSession({'source': {'type': 'synthetic'}, 'cameras': [{'name': 'face'}]},
+                            dataDir=str(tmp_path), headless=True)
+    with pytest.raises(ValueError):
+        session.open()
+    assert session.cap is None and session.engine is None
+    assert multiprocessing.active_children() == []
+
+
+def test_failed_open_stops_the_writer(tmp_path):
+    #The eye camera's writer is already running when the extra camera fails to open
+    config = {'source': {'type': 'synthetic'},
+              'cameras': [{'name': 'face', 'source': {'type': 'replay', 'path': str(tmp_path / 'missing.mp4')}}]}
+    session = EyeCamSession(config, dataDir=str(tmp_path), headless=True)
+    with pytest.raises(IOError):
+        session.open()
+    assert session.engine is None
+    assert multiprocessing.active_children() == []
@@ -0,0 +1,80 @@
+import numpy as np
+
+import eyecam.sources
+from eyecam.aperture import ApertureCalibration, closestLegalAperture, detectAperture
+
+
+def _isLegal(aperture, vidSize):
+    top, bottom, left, right = aperture
+    return (all(isinstance(v, int) for v in aperture) and (bottom - top) % 2 == 0 and (right - left) % 2 == 0
+            and top >= 0 and left >= 0 and bottom <= vidSize[0] and right <= vidSize[1])
+
+
+def test_odd_sizes_grow_to_even():
+    assert closestLegalAperture([10, 21, 10, 31], [480, 640]) == [10, 22, 10, 32]
+    assert closestLegalAperture([10, 20, 10, 30], [480, 640]) == [10, 20, 10, 30]
+
+
+def test_oversized_aperture_shrinks_to_fit():
+    #Even overflow: 4 rows too many, shrunk by 2 on each side and moved back on screen
+    assert closestLegalAperture([0, 484, 0, 600], [480, 640]) == [0, 480, 2, 598]
+    #Odd overflow on an odd-sized video: the closest even size that fits, in whole pixels
+    aperture = closestLegalAperture([0, 482, 0, 100], [479, 639])
+    assert aperture == [1, 479, 2, 98] and _isLegal(aperture, [479, 639])
+    aperture = closestLegalAperture([0, 100, 0, 642], [480, 639])
+    assert aperture == [2, 98, 1, 639] and _isLegal(aperture, [480, 639])
+
+
+def test_off_screen_aperture_is_moved_back():
+    assert closestLegalAperture([-10, 90, -4, 96], [480, 640]) == [0, 100, 0, 100]
+    assert closestLegalAperture([400, 500, 600, 700], [480, 640]) == [380, 480, 540, 640]
+
+
+def _blinkingEye(nFrames=30, shape=(121, 161)):
+    #Bright frames (with sensor noise) and a pupil at rows 50-70, cols 70-100 that blinks
+    rng = np.random.RandomState(0)
+    frames = []
+    for i in range(nFrames):
+        frame = (180 + rng.randint(0, 2, shape)).astype(np.uint8)
+        if i % 6 < 4:
+            frame[50:70, 70:100] = 20
+        frames.append(frame)
+    return frames
+
+
+def test_detected_aperture_covers_the_moving_region():
+    aperture = detectAperture(_blinkingEye())
+    top, bottom, left, right = aperture
+    assert top <= 50 and bottom >= 70 and left <= 70 and right >= 100
+    assert bottom - top < 40 and right - left < 50
+    assert _isLegal(aperture, (121, 161))
+
+
+def test_static_contrast_is_used_when_nothing_moves():
+    frames = _blinkingEye(nFrames=1) * 10
+    top, bottom, left, right = detectAperture(frames)
+    assert top <= 50 and bottom >= 70 and left <= 70 and right >= 100
+
+
+def test_uniform_frames_give_no_proposal():
+    assert detectAperture([np.full((60, 80), 128, dtype=np.uint8)] * 5) is None
+
+
+def test_calibration_crops_frames_to_the_detected_aperture(monkeypatch):
+    class Source(object):
+        def __init__(self):
+            self.frames = _blinkingEye(nFrames=200)
+
+        def read(self):
+            return True, self.frames.pop(0)
+
+        def release(self):
+            pass
+
+    monkeypatch.setattr(eyecam.sources, 'openSource', lambda config, eyeCam=0: Source())
+    calibration = ApertureCalibration({}, autoFrames=30)
+    top, bottom, left, right = calibration.start()
+    assert _isLegal([top, bottom, left, right], (121, 161))
+    assert calibration.frame().shape == (bottom - top, right - left)
+    assert calibration.adjust('b') == [top - 1, bottom + 1, left - 1, right + 1]
+    assert calibration.stop() == [top - 1, bottom + 1, left - 1, right + 1]
@@ -0,0 +1,70 @@
+import csv
+import ctypes
+import os
+from multiprocessing import Value
+
+import numpy as np
+import pytest
+
+from eyecam.batch import findRuns, main
+from eyecam.ring import FrameRing
+from eyecam.writer import writeVid
+
+pytest.importorskip('imageio')
+pytest.importorskip('cv2')
+
+
+def _eye(closed=False):
+    #Bright aperture with a dark pupil, unless the eye is closed
+    frame = np.full((64, 64), 200, dtype=np.uint8)
+    if not closed:
+        frame[24:40, 24:40] = 10
+    return frame
+
+
+def _recordRun(out_file, closedFrames=()):
+    #60 frames through the writer, with the design file the scan script saves next to the video
+    frameRing = FrameRing((64, 64), nSlots=61)
+    for seq in range(60):
+        frameRing.put(_eye(closed=seq in closedFrames), seq / 30.)
+    writeVid(frameRing, Value(ctypes.c_bool, True), out_file, 30)
+    with open(os.path.splitext(out_file)[0] + '_design.csv', 'w') as f:
+        f.write('condition,onset\nScanStart,0\nRunEnd,2\n')
+
+
+def _runRows(out):
+    with open(out + '_runs.csv') as f:
+        return dict((row['run'], row) for row in csv.DictReader(f))
+
+
+def test_study_table_and_cache(tmp_path, capsys):
+    data = str(tmp_path)
+    _recordRun(os.path.join(data, 'REST_X_run1.mp4'))
+    _recordRun(os.path.join(data, 'REST_X_run2.mp4'), closedFrames=range(30, 45))
+    #A segment left behind by an interrupted join is not a run
+    open(os.path.join(data, 'REST_X_run3_seg000.mp4'), 'w').close()
+    assert [os.path.basename(run[0]) for run in findRuns([data])] == ['REST_X_run1.mp4', 'REST_X_run2.mp4']
+
+    out = os.path.join(data, 'study')
+    args = [data, '--out', out, '--jobs', '2', '--baseline-s', '0.5']
+    assert main(args) == 0
+    table = np.load(out + '.npz')
+    assert list(table['runs']) == ['REST_X_run1', 'REST_X_run2']
+    assert len(table['frame']) == 120 and list(np.bincount(table['run'])) == [60, 60]
+    closed = table['closed'][table['run'] == 1]
+    assert closed[30:45].all() and not closed[:30].any()
+    rows = _runRows(out)
+    assert rows['REST_X_run1']['closures'] == '0'
+    assert rows['REST_X_run2']['closures'] == '1'
+    assert rows['REST_X_run2']['frames_video'] == rows['REST_X_run2']['frames_ts'] == '60'
+    assert float(rows['REST_X_run2']['design_duration_s']) == 2.
+    assert float(rows['REST_X_run2']['mean_fps']) == 30.
+    assert '(cached)' not in capsys.readouterr().err
+
+    #A rerun decodes only the run whose files changed
+    _recordRun(os.path.join(data, 'REST_X_run1.mp4'), closedFrames=range(50, 60))
+    assert main(args) == 0
+    err = capsys.readouterr().err
+    assert 'REST_X_run2.mp4 (cached)' in err and 'REST_X_run1.mp4 (cached)' not in err
+    assert _runRows(out)['REST_X_run1']['closures'] == '1'
+    assert len(os.listdir(os.path.join(data, '.eyecam_cache'))) == 3
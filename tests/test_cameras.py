@@ -0,0 +1,53 @@
+import pytest
+
+import eyecam.cameras
+from eyecam.cameras import cameraConfig
+
+
+def test_entry_without_source_is_rejected():
+    with pytest.raises(ValueError) as error:
+        cameraConfig({}, {'name': 'face'})
+    assert 'face' in str(error.value)
+
+
+def test_camera_source_needs_a_device():
+    with pytest.raises(ValueError):
+        cameraConfig({}, {'name': 'face', 'source': {'type': 'camera'}})
+
+
+def test_entry_sections_override_the_top_level_ones():
+    config = {'source': {'type': 'camera', 'device': 0}, 'encoder': {'preset': 'veryfast', 'crf': 23}}
+    camConfig = cameraConfig(config, {'name': 'face', 'source': {'type': 'camera', 'device': 2},
+                                      'encoder': {'preset': 'ultrafast'}})
+    assert camConfig['source'] == {'type': 'camera', 'device': 2}
+    assert camConfig['encoder'] == {'preset': 'ultrafast', 'crf': 23}
+    assert config['source']['device'] == 0
+
+
+def test_bad_entry_is_found_before_any_camera_opens(monkeypatch):
+    opened = []
+    monkeypatch.setattr(eyecam.cameras, 'Camera', lambda *args: opened.append(args))
+    config = {'cameras': [{'name': 'face', 'source': {'type': 'synthetic'}}, {'name': 'head'}]}
+    with pytest.raises(ValueError):
+        eyecam.cameras.camerasFromConfig(config, 30, None, 'data/X')
+    assert opened == []
+
+
+def test_opened_cameras_are_closed_when_a_later_one_fails(monkeypatch):
+    closed = []
+
+    class FakeCamera(object):
+        def __init__(self, name, *args):
+            if name == 'head':
+                raise IOError('Camera head: no frames')
+            self.name = name
+
+        def close(self):
+            closed.append(self.name)
+
+    monkeypatch.setattr(eyecam.cameras, 'Camera', FakeCamera)
+    config = {'cameras': [{'name': 'face', 'source': {'type': 'synthetic'}},
+                          {'name': 'head', 'source': {'type': 'synthetic'}}]}
+    with pytest.raises(IOError):
+        eyecam.cameras.camerasFromConfig(config, 30, None, 'data/X')
+    assert closed == ['face']
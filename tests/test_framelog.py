@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+
+from eyecam.framelog import FRAME_DTYPE, FrameLog, frameLogFile, loadFrameLog
+from eyecam.ring import FrameRing
+
+
+def test_record_layout():
+    assert FRAME_DTYPE.names == ('frame', 'seq', 'ts', 'dropped')
+    assert FRAME_DTYPE.itemsize == 20
+    assert frameLogFile('data/REST_X_run1.mp4') == 'data/REST_X_run1_frames.npy'
+
+
+def test_round_trip_with_drops(tmp_path):
+    path = str(tmp_path / 'run1_frames.npy')
+    seqs = [0, 1, 4, 5, 6, 9]
+    frameLog = FrameLog(capacity=2)
+    for seq in seqs:
+        frameLog.add(seq, seq / 30.)
+    frameLog.save(path)
+    for mmap in (True, False):
+        records = loadFrameLog(path, mmap=mmap)
+        assert records.dtype == FRAME_DTYPE
+        assert list(records['frame']) == list(range(len(seqs)))
+        assert list(records['seq']) == seqs
+        assert list(records['dropped']) == [0, 0, 2, 0, 0, 2]
+        assert np.allclose(records['ts'], np.array(seqs) / 30.)
+
+
+def test_streamed_part_file(tmp_path):
+    path = str(tmp_path / 'run1_frames.npy')
+    frameLog = FrameLog(streamTo=path, flushEvery=2)
+    for seq in range(5):
+        frameLog.add(seq, seq / 30.)
+    #An aborted run: no .npy, the streamed records are read instead
+    assert list(loadFrameLog(path)['seq'][:4]) == [0, 1, 2, 3]
+    frameLog.save(path)
+    assert not os.path.exists(str(tmp_path / 'run1_frames.part'))
+    assert len(loadFrameLog(path)) == 5
+
+
+def _writeRun(frameRing, nFrames):
+    #Capture nFrames into frameRing, then write them all as the writer would; returns (ts, frame log)
+    ts = np.arange(nFrames) / 30.
+    for t in ts:
+        frameRing.put(np.zeros(frameRing.shape, dtype=frameRing.dtype), t)
+    frameLog = FrameLog()
+    while frameRing.depth():
+        slot, t, seq = frameRing.get(timeout=1)
+        frameRing.frame(slot)
+        frameLog.add(seq, t)
+        frameRing.release(slot, t)
+    return ts, frameLog.records()
+
+
+def test_ring_drops_match_the_log():
+    #_finishRecording builds _ts.csv as the timestamps less the ring's drops; it must match the log
+    frameRing = FrameRing((4, 4), nSlots=3, overflow='drop_oldest')
+    ts, records = _writeRun(frameRing, 10)
+    assert frameRing.drops == list(range(7))
+    assert np.array_equal(records['ts'], np.delete(ts, frameRing.drops))
+    assert records['dropped'].sum() == len(frameRing.drops)
+
+
+def test_spilled_frames_are_all_logged(tmp_path):
+    frameRing = FrameRing((4, 4), nSlots=2, overflow='spill', spillPath=str(tmp_path / 'spill.raw'))
+    ts, records = _writeRun(frameRing, 8)
+    assert frameRing.spilled == 6 and frameRing.drops == []
+    assert list(records['seq']) == list(range(8)) and records['dropped'].sum() == 0
+    assert np.array_equal(records['ts'], ts)
+    frameRing.close()
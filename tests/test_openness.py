@@ -0,0 +1,83 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+
+from eyecam.acquisition import eyeAlertTask
+from eyecam.openness import EyeMonitor, OpennessMeter, eyeMonitorFromConfig, loadOpenness, opennessFiles
+
+
+def _eye(closed=False):
+    #Bright aperture with a dark pupil, unless the eye is closed
+    frame = np.full((40, 40), 200, dtype=np.uint8)
+    if not closed:
+        frame[15:25, 15:25] = 10
+    return frame
+
+
+def test_meter_learns_the_baseline_then_detects_closure():
+    meter = OpennessMeter(baseline_s=1., closed_below=0.3, step=1)
+    assert meter.measure(_eye(), 0., 0) == []
+    baseline = meter.measure(_eye(), 1., 1)
+    assert [record[0] for record in baseline] == [0, 1]
+    assert np.isnan(baseline[0][3])
+    seq, ts, dark, openness, closed = meter.measure(_eye(), 1.5, 2)[0]
+    assert np.isclose(openness, 1.) and not closed
+    assert meter.measure(_eye(closed=True), 2., 3)[0][4] == 1
+    meter.measure(_eye(closed=True), 4., 4)
+    assert meter.closedFor(4.) == 2.
+    meter.measure(_eye(), 4.5, 5)
+    assert meter.closedFor(4.5) == 0.
+
+
+def test_unknown_setting_is_rejected_before_the_worker_starts():
+    with pytest.raises(ValueError):
+        eyeMonitorFromConfig({'openness': {'enabled': 'yes', 'baseline': 10}}, (40, 40))
+    assert multiprocessing.active_children() == []
+    assert eyeMonitorFromConfig({'openness': {'baseline': 10}}, (40, 40)) is None
+
+
+def _record(monitor, out_file, nFrames=20):
+    monitor.startRun(out_file)
+    for seq in range(nFrames):
+        monitor.offer(_eye(), seq / 30., seq)
+    return monitor.endRun()
+
+
+def test_runs_are_saved_and_failures_reported(tmp_path):
+    monitor = EyeMonitor((40, 40), baseline_s=0.1)
+    try:
+        #A summary left over from an earlier run is not taken for this one
+        monitor._done.put((0, {'frames_measured': -1}, None))
+        summary = _record(monitor, str(tmp_path / 'run1.mp4'))
+        assert summary['frames_measured'] >= 1
+        records = loadOpenness(opennessFiles(str(tmp_path / 'run1.mp4'))[1])
+        assert len(records) >= 1 and records['seq'][-1] <= 19
+        with pytest.raises(IOError):
+            _record(monitor, str(tmp_path / 'missing' / 'run2.mp4'))
+        #The worker carries on with the next run
+        assert _record(monitor, str(tmp_path / 'run3.mp4'))['frames_measured'] >= 1
+    finally:
+        monitor.close()
+    assert not os.path.exists(opennessFiles(str(tmp_path / 'run3.mp4'))[0])
+
+
+def test_alert_is_shown_without_telemetry():
+    class Monitor(object):
+        found = []
+
+        def warnings(self):
+            return self.found
+
+    class Preview(object):
+        overlay = []
+
+    monitor, preview, reported = Monitor(), Preview(), []
+    task = eyeAlertTask({'number': 1}, monitor, preview, lambda run, found: reported.append(found))
+    next(task)
+    monitor.found = ['Eyes closed for 6 s']
+    next(task)
+    next(task)
+    assert preview.overlay == [('Eyes closed for 6 s', True)]
+    assert reported == [['Eyes closed for 6 s']]
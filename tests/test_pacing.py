@@ -0,0 +1,68 @@
+import struct
+
+import numpy as np
+import pytest
+
+from eyecam.pacing import Pacer, _find, _readBoxes, pacedTimestamps, pacingSummary, retimeMp4
+
+
+def test_cfr_on_time_captures_are_written_once():
+    ts = np.arange(30) / 30.
+    pacer = Pacer(30)
+    assert [pacer.copies(seq, t) for seq, t in enumerate(ts)] == [1] * 30
+    assert pacer.frames == 30
+    assert pacer.count == 0
+
+
+def test_cfr_repeats_after_a_gap_and_drops_a_fast_capture():
+    #Captures 2 and 3 missing; an extra capture right after frame 6
+    ts = [0., 1 / 30., 4 / 30., 5 / 30., 6 / 30., 6.2 / 30., 7 / 30.]
+    pacer = Pacer(30)
+    copies = [pacer.copies(seq, t) for seq, t in enumerate(ts)]
+    assert copies == [1, 1, 3, 1, 1, 0, 1]
+    assert pacer.frames == sum(copies) == 8
+    corrections = pacer.records()
+    assert list(corrections['seq']) == [2, 5]
+    assert list(corrections['frame']) == [2, 7]
+    assert pacingSummary(corrections) == {'repeated': 2, 'dropped': 1}
+
+
+def test_cfr_late_first_capture_restarts_the_grid():
+    #Timestamps not zeroed at the trigger (e.g. an absolute clock)
+    pacer = Pacer(30)
+    assert pacer.copies(0, 5000.) == 1
+    assert pacer.origin == 5000.
+    assert [pacer.copies(seq, 5000. + seq / 30.) for seq in range(1, 10)] == [1] * 9
+    assert list(pacer.records()['copies']) == [1]
+
+
+def test_paced_timestamps_follow_the_grid():
+    ts = [0., 1 / 30., 3 / 30.]
+    paced, pacer = pacedTimestamps(ts, 30)
+    assert list(paced) == [ts[0], ts[1], ts[2], ts[2]]
+    assert pacer.frames == len(paced)
+
+
+def test_vfr_stamps_the_video_with_the_capture_times(tmp_path):
+    imageio = pytest.importorskip('imageio')
+    path = str(tmp_path / 'vfr.mp4')
+    out = imageio.get_writer(path, fps=30, codec='libx264', ffmpeg_params=['-bf', '0'], macro_block_size=1)
+    for i in range(10):
+        out.append_data(np.full((64, 64, 3), 20 * i, dtype=np.uint8))
+    out.close()
+    ts = np.array([0., .05, .1, .2, .25, .3, .4, .45, .5, .6])
+    retimeMp4(path, ts)
+    with open(path, 'rb') as f:
+        boxes = _readBoxes(f.read())
+    moov = _find(boxes, b'moov')[0][1]
+    mdia = _find(_find(moov, b'trak')[0][1], b'mdia')[0][1]
+    mdhd = _find(mdia, b'mdhd')[0][1]
+    scale = struct.unpack('>I', mdhd[12:16])[0]
+    stts = _find(_find(_find(mdia, b'minf')[0][1], b'stbl')[0][1], b'stts')[0][1]
+    entries = struct.unpack('>I', stts[4:8])[0]
+    table = struct.unpack('>%dI' % (2 * entries), stts[8:8 + 8 * entries])
+    deltas = np.repeat(table[1::2], table[0::2])
+    assert len(deltas) == len(ts)
+    assert np.allclose(np.cumsum(deltas)[:-1] / float(scale), ts[1:], atol=1e-3)
+    with pytest.raises(IOError):
+        retimeMp4(path, ts[:-1])
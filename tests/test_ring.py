@@ -0,0 +1,115 @@
+import ctypes
+from multiprocessing import Process, Value
+import os
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+import numpy as np
+
+from eyecam.ring import MAX_SLOTS, FrameRing, ringFromConfig
+
+
+def _drain(frameRing, quit_flag):
+    #Writer stand-in: release every frame until quit_flag is set and the ring is empty
+    while True:
+        try:
+            slot, ts, seq = frameRing.get(timeout=0.1)
+        except Empty:
+            if quit_flag.value and frameRing.depth() == 0:
+                break
+            continue
+        frameRing.frame(slot)
+        frameRing.release(slot, ts)
+
+
+def _runWriter(frameRing, nFrames):
+    #Put nFrames through frameRing to a draining process; returns its exit code (None if it hung)
+    quit_flag = Value(ctypes.c_bool, False)
+    writer = Process(target=_drain, args=(frameRing, quit_flag))
+    writer.start()
+    frame = np.zeros(frameRing.shape, dtype=frameRing.dtype)
+    for i in range(nFrames):
+        frameRing.put(frame, i / 30.)
+    quit_flag.value = True
+    writer.join(30)
+    if writer.is_alive():
+        writer.terminate()
+        return None
+    return writer.exitcode
+
+
+def test_small_aperture_ring_is_capped():
+    frameRing = ringFromConfig({}, (100, 100, 3))
+    assert frameRing.nSlots == MAX_SLOTS
+    assert ringFromConfig({'capture': {'ring_mb': 4}}, (480, 640, 3)).nSlots == 4
+
+
+def test_small_aperture_ring_shuts_down():
+    #A compact gray aperture: the writer must exit once every frame is released
+    frameRing = ringFromConfig({'capture': {'overflow': 'block'}}, (240, 320), dtype=np.uint8)
+    assert _runWriter(frameRing, 3 * frameRing.nSlots) == 0
+    assert frameRing.depth() == 0
+
+
+def test_many_slots_shut_down():
+    #Thousands of slots (as sized before the cap) no longer fill a pipe with free-slot tokens
+    frameRing = FrameRing((10, 10), nSlots=9000)
+    assert _runWriter(frameRing, 20000) == 0
+
+
+def test_blocked_put_gives_up_when_writer_is_gone():
+    frameRing = FrameRing((4, 4), nSlots=2, overflow='block')
+    frameRing.writerAlive = lambda: False
+    frame = np.zeros((4, 4), dtype=np.uint8)
+    frameRing.put(frame, 0.)
+    frameRing.put(frame, 0.1)
+    try:
+        frameRing.put(frame, 0.2)
+    except IOError:
+        pass
+    else:
+        raise AssertionError('put on a full ring with no writer did not raise')
+
+
+def _queued(frameRing):
+    #(seq, first pixel) of every frame still queued, released as the writer would
+    queued = []
+    while frameRing.depth():
+        slot, ts, seq = frameRing.get(timeout=1)
+        queued.append((seq, int(frameRing.frame(slot).flat[0])))
+        frameRing.release(slot, ts)
+    return queued
+
+
+def test_drop_oldest_keeps_the_newest_frames():
+    frameRing = FrameRing((4, 4), nSlots=2, overflow='drop_oldest')
+    dropped = []
+    frameRing.onDrop = lambda seq, ts: dropped.append(seq)
+    for i in range(5):
+        frameRing.put(np.full((4, 4), i, dtype=np.uint8), i / 30.)
+    assert frameRing.drops == dropped == [0, 1, 2]
+    assert _queued(frameRing) == [(3, 3), (4, 4)]
+
+
+def test_spill_keeps_every_frame_in_order(tmp_path):
+    spillPath = str(tmp_path / 'ring.spill')
+    frameRing = FrameRing((4, 4), nSlots=2, overflow='spill', spillPath=spillPath)
+    for i in range(6):
+        frameRing.put(np.full((4, 4), i, dtype=np.uint8), i / 30.)
+    assert frameRing.spilled == 4 and frameRing.drops == []
+    assert _queued(frameRing) == [(i, i) for i in range(6)]
+    frameRing.endRun()
+    frameRing.close()
+    assert not os.path.exists(spillPath)
+
+
+def test_unknown_policy_and_spill_without_path_are_rejected():
+    for kwargs in ({'overflow': 'wait'}, {'overflow': 'spill'}):
+        try:
+            FrameRing((4, 4), **kwargs)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('FrameRing accepted %r' % kwargs)
@@ -0,0 +1,65 @@
+import numpy as np
+
+from eyecam.session import SessionStore, loadSession
+
+
+def _recordRun(store, number, nFrames, drops=()):
+    store.startRun(number, video='run%d.mp4' % number)
+    store.event('ScanStart', 0.)
+    store.frames(np.arange(nFrames) / 30., 0)
+    store.drops(list(drops))
+    store.event('RunEnd', nFrames / 30.)
+    store.endRun(timing={'frames': nFrames})
+
+
+def test_runs_round_trip(tmp_path):
+    path = str(tmp_path / 'REST_X_session')
+    store = SessionStore(path, {'sessionID': 'X'})
+    _recordRun(store, 1, 90, drops=[4, 7])
+    _recordRun(store, 2, 60)
+    store.close()
+
+    session = loadSession(path, mmap=False)
+    assert session['info'] == {'sessionID': 'X'}
+    assert session['conditions'] == ['ScanStart', 'RunEnd']
+    first, second = session['runs']
+    assert (first['run'], first['video'], first['timing']) == (1, 'run1.mp4', {'frames': 90})
+    assert first['frames'] == [0, 90] and second['frames'] == [90, 150]
+    frames = session['frames']
+    assert np.allclose(frames['ts'][90:150], np.arange(60) / 30.)
+    assert list(frames['seq'][88:92]) == [88, 89, 0, 1]
+    assert list(frames['run'][88:92]) == [0, 0, 1, 1]
+    assert list(session['drops']['seq']) == [4, 7]
+    events = session['events']
+    assert list(events['run']) == [0, 0, 1, 1]
+    assert list(events['condition']) == [0, 1, 0, 1]
+    assert np.isclose(events['onset'][3], 2.)
+
+
+def test_reopened_container_appends(tmp_path):
+    path = str(tmp_path / 'REST_X_session')
+    store = SessionStore(path, {'sessionID': 'X'})
+    _recordRun(store, 1, 30)
+    store.close()
+    store = SessionStore(path, {'rerun': True})
+    _recordRun(store, 2, 10)
+    store.close()
+
+    session = loadSession(path)
+    assert session['info'] == {'sessionID': 'X', 'rerun': True}
+    assert [run['run'] for run in session['runs']] == [1, 2]
+    assert session['runs'][1]['frames'] == [30, 40]
+    assert len(session['frames']['ts']) == 40
+
+
+def test_interrupted_run_rows_are_kept(tmp_path):
+    #A run that never reached endRun: its rows are found through the run column
+    path = str(tmp_path / 'REST_X_session')
+    store = SessionStore(path)
+    store.startRun(1)
+    store.frames(np.arange(15) / 30., 0)
+    store.close()
+
+    session = loadSession(path)
+    assert session['runs'][0]['frames'] == [0, 0]
+    assert np.count_nonzero(session['frames']['run'] == 0) == 15
@@ -0,0 +1,41 @@
+import time
+
+import pytest
+
+from eyecam.sources import PROP_FPS, SyntheticSource, _PacedSource, openSource
+
+
+def _frameRate(cap, seconds=1.):
+    #Frames delivered per second by cap over `seconds`
+    cap.read()
+    start, count = time.time(), 0
+    while time.time() - start < seconds:
+        cap.read()
+        count += 1
+    return count / (time.time() - start)
+
+
+def test_configured_synthetic_rate_is_kept():
+    cap = openSource({'source': {'type': 'synthetic', 'width': 64, 'height': 48, 'fps': 27}})
+    assert not cap.set(PROP_FPS, 30)
+    assert cap.get(PROP_FPS) == 27
+    assert abs(_frameRate(cap) - 27) < 2
+
+
+def test_synthetic_rate_follows_the_recording_when_not_configured():
+    cap = openSource({'source': {'type': 'synthetic', 'width': 64, 'height': 48}})
+    assert cap.set(PROP_FPS, 60)
+    assert cap.get(PROP_FPS) == 60
+
+
+def test_paced_source_needs_its_schedule():
+    with pytest.raises(TypeError):
+        _PacedSource()
+
+    class Incomplete(_PacedSource):
+        def _due(self, index):
+            return 0.
+
+    with pytest.raises(TypeError):
+        Incomplete()
+    assert SyntheticSource(8, 8).read()[1].shape == (8, 8, 3)
@@ -0,0 +1,52 @@
+import ctypes
+import json
+import os
+from multiprocessing import Value
+
+import numpy as np
+import pytest
+
+from eyecam.framelog import frameLogFile, loadFrameLog
+from eyecam.ring import FrameRing
+from eyecam.spool import findSpools, main, spoolFiles, videoFrameCount
+from eyecam.writer import writeVid, writerOptions
+
+pytest.importorskip('imageio')
+
+
+def _spoolRun(out_file, nFrames, shape=(64, 64)):
+    #Record nFrames through the writer in spool mode; returns the live frame log
+    frameRing = FrameRing(shape, nSlots=nFrames + 1)
+    for i in range(nFrames):
+        frameRing.put(np.full(shape, 5 * i, dtype=np.uint8), i / 30.)
+    options = writerOptions({'encoder': {'mode': 'spool'}}, 30, duration=1)
+    writeVid(frameRing, Value(ctypes.c_bool, True), out_file, 30, **options)
+    return loadFrameLog(frameLogFile(out_file), mmap=False)
+
+
+def test_transcoded_spool_matches_the_live_count(tmp_path):
+    out_file = str(tmp_path / 'run1.mp4')
+    live = _spoolRun(out_file, 40)
+    assert len(live) == 40 and not os.path.exists(out_file)
+    assert findSpools([str(tmp_path)]) == [spoolFiles(out_file)[2]]
+    assert main([str(tmp_path)]) == 0
+    assert videoFrameCount(out_file) == len(live)
+    assert sorted(os.listdir(str(tmp_path))) == ['run1.mp4', 'run1_frames.npy']
+    assert np.array_equal(loadFrameLog(frameLogFile(out_file)), live)
+
+
+def test_unfinished_spool_keeps_the_indexed_frames(tmp_path):
+    #A writer killed mid-run leaves the description marked incomplete
+    out_file = str(tmp_path / 'run1.mp4')
+    _spoolRun(out_file, 25)
+    metaFile = spoolFiles(out_file)[2]
+    with open(metaFile) as f:
+        meta = json.load(f)
+    meta.update(complete=False, frames=0)
+    with open(metaFile, 'w') as f:
+        json.dump(meta, f)
+    os.remove(frameLogFile(out_file))
+    assert main([metaFile, '--keep']) == 0
+    assert videoFrameCount(out_file) == 25
+    assert list(loadFrameLog(frameLogFile(out_file))['seq']) == list(range(25))
+    assert os.path.exists(metaFile)
@@ -0,0 +1,66 @@
+import pytest
+
+from eyecam.tasks import QuitRequested, Scheduler
+
+
+def _worker(log, name, pause=0.01):
+    log.append(name + ' start')
+    try:
+        while True:
+            yield pause
+    finally:
+        log.append(name + ' cancelled')
+
+
+def test_finished_main_cancels_the_rest_in_reverse_spawn_order():
+    log = []
+    sched = Scheduler()
+
+    def main():
+        sched.spawn('capture', _worker(log, 'capture'))
+        sched.spawn('telemetry', _worker(log, 'telemetry'))
+        yield 0.05
+
+    sched.run(main())
+    assert log == ['capture start', 'telemetry start', 'telemetry cancelled', 'capture cancelled']
+    assert all(task.done for task in sched.tasks)
+
+
+def test_quit_cancels_every_task_and_reaches_the_caller():
+    log = []
+    sched = Scheduler()
+
+    def quitter():
+        yield 0.02
+        raise QuitRequested()
+
+    def main():
+        sched.spawn('capture', _worker(log, 'capture'))
+        yield sched.spawn('quit', quitter())
+        log.append('main resumed')
+
+    with pytest.raises(QuitRequested):
+        sched.run(main())
+    assert log == ['capture start', 'capture cancelled']
+    assert all(task.done for task in sched.tasks)
+
+
+def test_cancel_resumes_waiting_tasks():
+    log = []
+    sched = Scheduler()
+
+    def canceller(task):
+        yield 0.02
+        sched.cancel(task)
+
+    def main():
+        capture = sched.spawn('capture', _worker(log, 'capture'))
+        sched.spawn('watch', canceller(capture))
+        yield capture
+        log.append('main resumed')
+
+    sched.run(main())
+    assert log == ['capture start', 'capture cancelled', 'main resumed']
+    stats = sched.stats()
+    assert stats['capture']['steps'] >= 1
+    assert set(stats['main']) == {'steps', 'late_ms', 'step_ms'}
@@ -0,0 +1,51 @@
+import math
+
+import numpy as np
+
+from eyecam.telemetry import Telemetry, telemetryFromConfig
+
+
+def _feed(telemetry, ifis, start=0.):
+    ts = start + np.concatenate([[0.], np.cumsum(ifis)])
+    for t in ts:
+        telemetry.update(t)
+    return ts
+
+
+def test_percentiles_match_numpy_within_a_bin():
+    rng = np.random.RandomState(1)
+    ifis = rng.uniform(0.025, 0.045, 150)
+    ifis[::30] = 0.12
+    telemetry = Telemetry(fps=30, window=150)
+    _feed(telemetry, ifis)
+    for q in (0.01, 0.5, 0.95, 0.99):
+        assert abs(telemetry._percentile(q) - np.percentile(ifis, 100 * q)) <= telemetry.binWidth
+    snap = telemetry.snapshot()
+    assert abs(snap['ifi_p99_ms'] - 1000 * np.percentile(ifis, 99)) <= 1000 * telemetry.binWidth
+    assert np.isclose(snap['fps'], len(ifis) / ifis.sum())
+
+
+def test_only_the_window_counts():
+    telemetry = Telemetry(fps=30, window=50)
+    ts = _feed(telemetry, [0.1] * 100)
+    _feed(telemetry, [1 / 30.] * 50, start=ts[-1] + 1 / 30.)
+    assert abs(telemetry._percentile(0.99) - 1 / 30.) <= telemetry.binWidth
+    assert np.isclose(telemetry.snapshot()['fps'], 30.)
+
+
+def test_empty_window():
+    telemetry = Telemetry(fps=30)
+    snap = telemetry.snapshot()
+    assert math.isnan(snap['fps']) and math.isnan(snap['ifi_p50_ms']) and math.isnan(snap['ifi_p99_ms'])
+    assert telemetry.warnings(snap) == []
+    telemetry.update(0.)
+    assert math.isnan(telemetry.snapshot()['ifi_p50_ms'])
+
+
+def test_missed_frames_and_warnings():
+    telemetry = telemetryFromConfig({'telemetry': {'min_fps': 29}}, 30)
+    _feed(telemetry, [1 / 30.] * 100 + [0.2])
+    snap = telemetry.snapshot()
+    assert snap['missed'] == 5
+    assert 'Dropped frames: 5' in telemetry.warnings(snap)
+    assert telemetryFromConfig({'telemetry': {'enabled': 'no'}}, 30) is None
@@ -0,0 +1,40 @@
+import numpy as np
+
+from eyecam.timing import frameTiming, timingSummary
+
+
+def test_steady_run():
+    ts = np.arange(300) / 30.
+    report = frameTiming(ts, 30)
+    assert report['frames'] == 300
+    assert report['mean_fps'] == 30.
+    assert report['estimated_dropped'] == report['late_intervals'] == 0
+    assert report['frames_per_second'] == {'30': 10}
+    assert np.isclose(report['ifi_ms']['p50'], 1000. / 30, atol=1e-3)
+
+
+def test_gaps_count_the_missed_frames():
+    #Frames 10-12 and 100 never arrived
+    seq = np.delete(np.arange(150), [10, 11, 12, 100])
+    report = frameTiming(seq / 30., 30, nGaps=2, writerDrops=1, spilled=2)
+    assert report['late_intervals'] == 2
+    assert report['estimated_dropped'] == 4
+    assert [gap['frame'] for gap in report['longest_gaps']] == [10, 97]
+    assert np.isclose(report['ifi_ms']['max'], 4000. / 30, atol=1e-3)
+    lines = timingSummary(report)
+    assert 'Frames dropped by the device (estimated): 4' in lines
+    assert 'Frames dropped (writer ring full): 1' in lines
+    assert 'Frames spilled to disk: 2' in lines
+
+
+def test_short_and_empty_runs():
+    for ts in ([], [1.5]):
+        report = frameTiming(ts, 30)
+        assert report['frames'] == len(ts) and 'mean_fps' not in report
+        assert timingSummary(report) == ['Frames captured: %d' % len(ts)]
+
+
+def test_frames_with_one_timestamp():
+    report = frameTiming([2., 2., 2.], 30)
+    assert report['mean_fps'] is None
+    assert timingSummary(report)[0] == 'Frames captured: 3 in 0.00 s (n/a fps, nominal 30)'
@@ -0,0 +1,79 @@
+import ctypes
+import glob
+import threading
+from multiprocessing import Value
+
+import numpy as np
+import pytest
+
+from eyecam.ring import FrameRing
+from eyecam.trace import (CAPTURE_STAGES, CaptureTrace, Sampler, loadTrace, main, summary, traceFiles,
+                          traceFromConfig, writerTraceOptions)
+from eyecam.writer import writeVid, writerOptions
+
+TRACE_ON = {'trace': {'enabled': 'yes'}}
+
+
+def test_trace_is_off_unless_asked_for(monkeypatch):
+    monkeypatch.delenv('EYECAM_TRACE', raising=False)
+    assert traceFromConfig({}, 100) is None
+    assert writerTraceOptions({}, 'run1.mp4', 100) == {}
+    monkeypatch.setenv('EYECAM_TRACE', '1')
+    assert isinstance(traceFromConfig({}, 100), CaptureTrace)
+    options = writerTraceOptions({'trace': {'profile_writer': 'yes', 'sample_ms': 2}}, 'run1.mp4', 100)
+    assert options['profile'] == ('run1_writer_profile.txt', 0.002)
+
+
+def test_segmented_run_is_traced_end_to_end(tmp_path):
+    pytest.importorskip('imageio')
+    out_file = str(tmp_path / 'run1.mp4')
+    capture = traceFromConfig(TRACE_ON, 4)
+    frameRing = FrameRing((64, 64), nSlots=26)
+    for seq in range(25):
+        capture.begin()
+        for stage in range(1, len(CAPTURE_STAGES)):
+            capture.mark(stage)
+        frameRing.put(np.zeros((64, 64), dtype=np.uint8), seq / 30.)
+        capture.commit(seq, seq / 30.)
+    capture.save(out_file)
+    options = writerOptions({'encoder': {'segment_s': 1 / 3., 'workers': 2}}, 30)
+    options.update(writerTraceOptions(TRACE_ON, out_file, 4))
+    writeVid(frameRing, Value(ctypes.c_bool, True), out_file, 30, **options)
+    #One writer trace per encoding process, joined back in capture order
+    assert len(glob.glob(traceFiles(out_file)[1])) == 2
+    captured, written = loadTrace(out_file)
+    assert list(captured['seq']) == list(written['seq']) == list(range(25))
+    assert (written['encode'] >= written['dequeue']).all()
+    lines = summary(captured, written, worst=3)
+    assert lines[0] == '25 frames captured, 25 written'
+    assert [line.split()[0] for line in lines[2:9]] == list(CAPTURE_STAGES[1:]) + ['queue', 'encode']
+    assert len(lines) == 9 + 1 + 3
+    assert main([out_file]) == 0
+    assert main([str(tmp_path / 'run2')]) == 1
+
+
+def _busy(halt):
+    while not halt.is_set():
+        sum(range(100))
+
+
+def test_sampler_counts_the_target_threads_stacks(tmp_path):
+    halt = threading.Event()
+    worker = threading.Thread(target=_busy, args=(halt,))
+    worker.start()
+    sampler = Sampler(0.001, thread=worker)
+    sampler.start()
+    try:
+        halt.wait(0.1)
+    finally:
+        sampler.stop()
+        halt.set()
+        worker.join()
+    assert '_busy (test_trace.py:' in max(sampler.counts, key=sampler.counts.get)
+    path = str(tmp_path / 'run1_writer_profile.txt')
+    sampler.save(path)
+    with open(path) as f:
+        lines = f.read().splitlines()
+    #Collapsed stacks, most frequent first
+    counts = [int(line.rsplit(' ', 1)[1]) for line in lines]
+    assert counts == sorted(counts, reverse=True) and sum(counts) == sum(sampler.counts.values())
@@ -0,0 +1,83 @@
+import ctypes
+import os
+import struct
+from multiprocessing import Value
+
+import numpy as np
+import pytest
+
+from eyecam.framelog import frameLogFile, loadFrameLog
+from eyecam.ring import FrameRing
+from eyecam.writer import writeVid, writerOptions
+
+pytest.importorskip('imageio')
+
+
+def _capture(nFrames, shape=(64, 64)):
+    #A ring holding nFrames captures, each a different grey level; the writer can drain it straight away
+    frameRing = FrameRing(shape, nSlots=nFrames + 1)
+    for i in range(nFrames):
+        frameRing.put(np.full(shape, 5 * i, dtype=np.uint8), i / 30.)
+    return frameRing, Value(ctypes.c_bool, True)
+
+
+def _greyLevels(path):
+    import imageio
+    reader = imageio.get_reader(path)
+    levels = [float(frame.mean()) for frame in reader]
+    reader.close()
+    return levels
+
+
+def test_segments_join_into_every_frame_in_order(tmp_path):
+    out_file = str(tmp_path / 'run1.mp4')
+    frameRing, quit_flag = _capture(35)
+    options = writerOptions({'encoder': {'segment_s': 1 / 3., 'workers': 2}}, 30)
+    assert options['segmentFrames'] == 10
+    writeVid(frameRing, quit_flag, out_file, 30, **options)
+    assert sorted(os.listdir(str(tmp_path))) == ['run1.mp4', 'run1_frames.npy']
+    levels = _greyLevels(out_file)
+    assert len(levels) == 35
+    assert np.allclose(levels, 5 * np.arange(35), atol=2)
+    records = loadFrameLog(frameLogFile(out_file))
+    assert list(records['seq']) == list(range(35)) and records['dropped'].sum() == 0
+
+
+def _decodedFrames(path):
+    #Frames a player gets out of path (the container's frame count is unknown for a cut-off file)
+    import cv2
+    cap = cv2.VideoCapture(path)
+    count = 0
+    while cap.read()[0]:
+        count += 1
+    cap.release()
+    return count
+
+
+def _topBoxes(data):
+    #(type, offset) of the top-level MP4 boxes
+    boxes, pos = [], 0
+    while pos + 8 <= len(data):
+        size, kind = struct.unpack('>I4s', data[pos:pos + 8])
+        boxes.append((kind, pos))
+        pos += size
+    return boxes
+
+
+def test_fragments_play_back_up_to_the_last_complete_one(tmp_path):
+    out_file = str(tmp_path / 'run1.mp4')
+    frameRing, quit_flag = _capture(35)
+    options = writerOptions({'encoder': {'fragment_s': 1 / 3.}}, 30)
+    assert options['fragmentFrames'] == 10
+    writeVid(frameRing, quit_flag, out_file, 30, **options)
+    assert sorted(os.listdir(str(tmp_path))) == ['run1.mp4', 'run1_frames.npy']
+    assert _decodedFrames(out_file) == len(loadFrameLog(frameLogFile(out_file))) == 35
+    with open(out_file, 'rb') as f:
+        data = f.read()
+    fragments = [pos for kind, pos in _topBoxes(data) if kind == b'moof']
+    assert len(fragments) == 4
+    #A run cut off while its last fragment was being written keeps the complete ones
+    cut_file = str(tmp_path / 'cut.mp4')
+    with open(cut_file, 'wb') as f:
+        f.write(data[:fragments[-1]])
+    assert _decodedFrames(cut_file) == 30